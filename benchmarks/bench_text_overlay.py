@@ -0,0 +1,69 @@
+# Times drawing the text boxes (timecodes, 'no frame', episode labels) onto a frame of the mapped gaze video.
+# old: cv2.getTextSize, cv2.rectangle and cv2.putText for every text on every frame
+# new: _overlay.TextBoxCache, which caches text sizes and draws static texts from cached patches
+# Also checks that both give identical output. Run as: python benchmarks/bench_text_overlay.py [n_frames]
+import sys
+import time
+import cv2
+import numpy as np
+
+from gazeMapper.process import _overlay
+
+
+def _texts(i: int) -> tuple[list[str], list[tuple[int,int,int]], list[bool]]:
+    # a timecode that changes every frame and three texts that do not
+    texts = [f'{i/30:8.3f} [{i:6d}]', 'no frame', 'trial 3', 'validate 1']
+    colors= [(0,0,0), (128,128,128), (0,0,255), (255,0,0)]
+    return texts, colors, [False, True, True, True]
+
+
+def draw_old(img: np.ndarray, i: int):
+    texts, colors, _ = _texts(i)
+    text_sizes: list[tuple[int,int]]= []
+    baselines : list[int]           = []
+    for t in texts:
+        t, b = cv2.getTextSize(t,cv2.FONT_HERSHEY_PLAIN,2,2)
+        text_sizes.append((t[0], t[1]))
+        baselines.append(b)
+    max_height = max(text_sizes, key=lambda x: x[1])[1]
+    x_end = 0
+    margin = 5
+    for t,f,ts,b in zip(texts,colors,text_sizes,baselines):
+        x_advance = ts[0]+margin
+        cv2.rectangle(img,(x_end,img.shape[0]),(x_end+x_advance,img.shape[0]-max_height-b-margin), f, -1)
+        cv2.putText(img, t, (x_end+margin, img.shape[0]-margin), cv2.FONT_HERSHEY_PLAIN, 2, (0,255,255), 2)
+        x_end += x_advance
+
+
+def draw_new(img: np.ndarray, i: int, text_boxes: _overlay.TextBoxCache):
+    texts, colors, is_static = _texts(i)
+    baselines : list[int] = []
+    max_height = 0
+    for t in texts:
+        t, b = text_boxes.get_text_size(t)
+        max_height = max(max_height, t[1])
+        baselines.append(b)
+    x_end = 0
+    for t,f,b,st in zip(texts,colors,baselines,is_static):
+        x_end += text_boxes.draw(img, t, x_end, max_height, b, f, (0,255,255), use_cache=st)
+
+
+if __name__=='__main__':
+    n_frames = int(sys.argv[1]) if len(sys.argv)>1 else 500
+    rng = np.random.default_rng(0)
+    for width, height in ((1280,720), (1920,1080), (3840,2160)):
+        frames = [rng.integers(0, 256, (height, width, 3), np.uint8) for _ in range(4)]
+        text_boxes = _overlay.TextBoxCache(cv2.FONT_HERSHEY_PLAIN, 2, 2, margin=5)
+        # check output is identical
+        for i in range(20):
+            a, b = frames[i%len(frames)].copy(), frames[i%len(frames)].copy()
+            draw_old(a, i)
+            draw_new(b, i, text_boxes)
+            assert np.array_equal(a, b), f'output differs for frame {i} at {width}x{height}'
+        times = {}
+        for name, fun in (('old', draw_old), ('new', lambda img, i: draw_new(img, i, text_boxes))):
+            t = time.perf_counter()
+            for i in range(n_frames):
+                fun(frames[i%len(frames)], i)
+            times[name] = (time.perf_counter()-t)/n_frames*1e6
+        print(f'{width}x{height}: old {times["old"]:6.1f} us/frame, new {times["new"]:6.1f} us/frame')
@@ -0,0 +1,75 @@
+# Times handing frames to the video encoder in the mapped gaze video writer path.
+# old: every frame becomes an ffpyplayer Image built from frame.flatten().tobytes() (two full-frame copies plus
+#      allocations), which is then encoded on the processing thread
+# new: QueuedVideoWriter.write_frame(), which copies the frame into a preallocated buffer that is encoded on a
+#      separate thread
+# Reported are the cost of the handoff itself (creating the Image vs. copying into a pooled buffer), and the total
+# time per frame when writing a video, with a sleep per frame standing in for decoding and drawing.
+# Run as: python benchmarks/bench_video_writer.py [width height n_frames work_ms]
+import pathlib
+import sys
+import tempfile
+import time
+import numpy as np
+
+from ffpyplayer.writer import MediaWriter
+from ffpyplayer.pic import Image
+
+from gazeMapper.process import _video_writer
+
+
+def _out_opts(width: int, height: int):
+    return {'pix_fmt_in':'bgr24', 'pix_fmt_out':'yuv420p', 'codec':'mpeg4', 'width_in':width, 'height_in':height, 'frame_rate':(25,1)}
+
+
+def handoff_old(frames: list[np.ndarray]) -> float:
+    t = time.perf_counter()
+    for f in frames:
+        Image(plane_buffers=[f.flatten().tobytes()], pix_fmt='bgr24', size=(f.shape[1], f.shape[0]))
+    return time.perf_counter()-t
+
+
+def handoff_new(frames: list[np.ndarray]) -> float:
+    buf = bytearray(frames[0].nbytes)
+    view = np.frombuffer(buf, np.uint8).reshape(frames[0].shape)
+    t = time.perf_counter()
+    for f in frames:
+        np.copyto(view, f)
+        Image(plane_buffers=[buf], pix_fmt='bgr24', size=(f.shape[1], f.shape[0]))
+    return time.perf_counter()-t
+
+
+def write_old(file: pathlib.Path, frames: list[np.ndarray], work: float) -> float:
+    writer = MediaWriter(str(file), [_out_opts(frames[0].shape[1], frames[0].shape[0])], overwrite=True)
+    t = time.perf_counter()
+    for i,f in enumerate(frames):
+        time.sleep(work)
+        img = Image(plane_buffers=[f.flatten().tobytes()], pix_fmt='bgr24', size=(f.shape[1], f.shape[0]))
+        writer.write_frame(img=img, pts=i/25)
+    writer.close()
+    return time.perf_counter()-t
+
+
+def write_new(file: pathlib.Path, frames: list[np.ndarray], work: float) -> float:
+    writer = _video_writer.QueuedVideoWriter(file, _out_opts(frames[0].shape[1], frames[0].shape[0]), 8)
+    t = time.perf_counter()
+    for i,f in enumerate(frames):
+        time.sleep(work)
+        writer.write_frame(f, pts=i/25)
+    writer.close()
+    return time.perf_counter()-t
+
+
+if __name__=='__main__':
+    width, height, n_frames, work_ms = (int(a) for a in sys.argv[1:5]) if len(sys.argv)>4 else (1920, 1080, 100, 20)
+    # smooth moving gradient with some noise, so that encoding cost is somewhat representative of scene video
+    rng = np.random.default_rng(0)
+    x, y = np.meshgrid(np.arange(width), np.arange(height))
+    frames = [(np.dstack([(x+4*i)%256, (y+2*i)%256, (x+y)%256])+rng.integers(0, 8, (height, width, 3))).astype(np.uint8) for i in range(n_frames)]
+    print(f'{width}x{height}, {n_frames} frames, {work_ms} ms work per frame')
+    for name, fun in (('old',handoff_old), ('new',handoff_new)):
+        print(f'handoff {name}: {fun(frames)/n_frames*1000:7.3f} ms/frame')
+    with tempfile.TemporaryDirectory() as d:
+        for name, fun in (('old',write_old), ('new',write_new)):
+            t = fun(pathlib.Path(d) / f'{name}.mp4', frames, work_ms/1000)
+            print(f'write   {name}: {t/n_frames*1000:7.3f} ms/frame')
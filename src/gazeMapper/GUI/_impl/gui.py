@@ -76,6 +76,7 @@ class GUI:
         self.process_pool                                                = process_pool.ProcessPool()
         self.job_scheduler                                               = process_pool.JobScheduler[utils.JobInfo](self.process_pool, self._check_job_valid)
         self._active_jobs_cache         : dict[utils.JobInfo, int]       = {}
+        self._requested_GUI_runs        : list[utils.JobInfo]            = []
 
         self._window_list                   : list[hello_imgui.DockableWindow]  = []
         self._to_dock                                                           = []
@@ -498,8 +499,19 @@ class GUI:
             args = (working_dir,)
         # check if task needs a GUI, if so make sure only one needing a GUI can run at the same time, and that these
         # tasks are prioritized so we're not stuck waiting for a GUI task while some other task completes
-        exclusive_id = 1 if (action.needs_GUI or kwargs.get('show_visualization',False)) else None
+        needs_GUI = action.needs_GUI
+        if action==process.Action.SYNC_ET_TO_CAM and 'no_gui' not in kwargs and not kwargs.get('force_gui',False):
+            # with automatic offset estimation, a GUI is only needed to review unreliable estimates. The task is then
+            # first run without GUI, and requests a run with GUI if needed (see _action_done_callback)
+            cfg = config.apply_all_overrides(self.study_config, self.session_config_overrides[sess], strict_check=False) if sess in self.session_config_overrides else self.study_config
+            if process.config_has_automatic_et_sync(cfg, recording):
+                needs_GUI = False
+                kwargs['no_gui'] = True
+        exclusive_id = 1 if (needs_GUI or kwargs.get('show_visualization',False)) else None
         priority = 1 if exclusive_id is not None else None
+        if action==process.Action.VALIDATE and kwargs.get('plots_only',False):
+            # making plots is not urgent, run in the background after other tasks
+            priority = 1000
 
         # add to scheduler
         payload = process_pool.JobPayload(func, args, kwargs)
@@ -523,6 +535,12 @@ class GUI:
                 if self.job_scheduler.jobs[job_id].get_state() in [process_pool.State.Pending, process_pool.State.Running]:
                     self._active_jobs_cache[self.job_scheduler.jobs[job_id].user_data] = job_id
 
+            # schedule runs with GUI requested by completed jobs
+            while self._requested_GUI_runs:
+                job = self._requested_GUI_runs.pop(0)
+                if self._check_job_valid(job):
+                    self.launch_task(job.session, job.recording, job.action, no_gui=False)
+
             for job_id in self._active_jobs_cache.values():
                 job_desc = self.job_scheduler.jobs[job_id]
                 for warning_index, warning in job_desc.get_unnotified_warnings():
@@ -630,6 +648,10 @@ class GUI:
             if job_id in self.job_scheduler.jobs:
                 self.job_scheduler.jobs[job_id].error = tb
 
+        # a SYNC_ET_TO_CAM run without GUI returns the episodes that need to be reviewed in the GUI, if any
+        if job.action==process.Action.SYNC_ET_TO_CAM and state==process_pool.State.Completed and future.result():
+            self._requested_GUI_runs.append(job)
+
         # clean up, if needed, when a task failed or was canceled
         if job.action==process.Action.IMPORT and state in [process_pool.State.Canceled, process_pool.State.Failed]:
             # remove working directory if this was an import task
@@ -1950,6 +1972,8 @@ class GUI:
         for a in all_actions:
             running= [r for r in actions_running if a in actions_running[r]]
             val_coding_options: list[str] = []
+            plot_options: list[str] = []
+            review_options: list[str] = []
             if running:
                 possible = True
                 hover_text = f'Cancel running {a.displayable_name} for recordings:\n- '+'\n- '.join(running)
@@ -1968,6 +1992,13 @@ class GUI:
                 if a==process.Action.CODE_EPISODES and not running:
                     if (val_events:=[cs for cs in process.get_specific_event_types(self.study_config, annotation.EventType.Validate) if not cs['which_recordings'] or any(r in cs['which_recordings'] for r in to_run)]):
                         val_coding_options = [cs['name'] for cs in val_events]
+                if a==process.Action.VALIDATE and not running:
+                    # plots can be made for recordings for which validation has been run
+                    plot_options = [r for r in to_run if sess.recordings[r].state[a]==process_pool.State.Completed]
+                if a==process.Action.SYNC_ET_TO_CAM and not running:
+                    # with automatic offset estimation, the GUI is only shown for unreliable estimates. Allow reviewing all
+                    cfg = config.apply_all_overrides(self.study_config, self.session_config_overrides[session_name], strict_check=False) if session_name in self.session_config_overrides else self.study_config
+                    review_options = [r for r in to_run if process.config_has_automatic_et_sync(cfg, r)]
                 icon = ifa6.ICON_FA_PLAY if status<process_pool.State.Completed else ifa6.ICON_FA_ARROW_ROTATE_RIGHT
             if not possible:
                 imgui.begin_disabled()
@@ -1984,6 +2015,20 @@ class GUI:
                             # run
                             _runner(a, session_name, to_run, self.launch_task, sort_order, val_coding_event=v)
                     imgui.end_menu()
+            elif plot_options:
+                if imgui.begin_menu(icon+f" {a.displayable_name}"):
+                    if imgui.selectable(a.displayable_name, False)[0]:
+                        _runner(a, session_name, to_run, self.launch_task, sort_order)
+                    if imgui.selectable('Make validation plots', False)[0]:
+                        _runner(a, session_name, plot_options, self.launch_task, sort_order, plots_only=True)
+                    imgui.end_menu()
+            elif review_options:
+                if imgui.begin_menu(icon+f" {a.displayable_name}"):
+                    if imgui.selectable(a.displayable_name, False)[0]:
+                        _runner(a, session_name, to_run, self.launch_task, sort_order)
+                    if imgui.selectable('Review all episodes in GUI', False)[0]:
+                        _runner(a, session_name, review_options, self.launch_task, sort_order, force_gui=True)
+                    imgui.end_menu()
             elif imgui.selectable(icon+f" {a.displayable_name}##{session_name}", False)[0]:
                 if running:
                     for r in running:
@@ -52,6 +52,9 @@ class EtSyncSetup(typed_dict_defaults.TypedDictDefault, total=False):
     get_cam_movement_method     : Literal['plane','function']       = 'plane'
     get_cam_movement_function   : CamMovementForEtSyncFunction|None = None
     use_average                 : bool                              = True
+    auto_estimate               : bool                              = False
+    auto_min_quality            : float                             = .8
+    auto_max_offset             : float                             = .5    # s
 
 class ValidationSetup(typed_dict_defaults.TypedDictDefault, total=False):
     do_global_shift             : bool                      = True
@@ -125,12 +128,16 @@ class Study:
                  interpolate_plane_pose_recordings          : set[str]|None                 = None,
                  interpolate_plane_pose_max_missing_frames  : int                           = 0,
 
+                 validate_num_workers                       : int                           = 1,
+                 validate_defer_plots                       : bool                          = False,
+
                  overlay_video_gaze_vid_pos_color           : RgbColor                      = RgbColor(  0,255,  0),
                  overlay_video_gaze_world_pos_color         : RgbColor|None                 = RgbColor(255,  0,255),
                  overlay_video_gaze_vid_pos_radius          : int                           = 8,
                  overlay_video_gaze_world_pos_radius        : int                           = 5,
                  overlay_video_gaze_vid_pos_thickness       : int                           = 2,
                  overlay_video_gaze_world_pos_thickness     : int                           = -1,
+                 overlay_video_num_segments                 : int                           = 1,
 
                  sync_ref_recording                         : str|None                      = None,
                  sync_ref_do_time_stretch                   : bool|None                     = None,
@@ -140,6 +147,7 @@ class Study:
                  export_output3D                            : bool                          = False,
                  export_output2D                            : bool                          = True,
                  export_only_code_marker_presence           : bool                          = True,
+                 export_video_strategy                      : Literal['copy','hardlink','reflink','symlink'] = 'reflink',
 
                  mapped_video_make_which                               : set[str]|None                     = None,
                  mapped_video_recording_colors                         : dict[str,RgbColor]|None           = None,
@@ -164,6 +172,13 @@ class Study:
                  mapped_video_which_gaze_type_on_plane                 : gaze_worldref.Type                = gaze_worldref.Type.Scene_Video_Position,
                  mapped_video_which_gaze_type_on_plane_allow_fallback  : bool                              = True,
                  mapped_video_gaze_to_plane_margin                     : float                             = 0.25,
+                 mapped_video_encode_queue_size                        : int                               = 8,
+                 mapped_video_num_segments                             : int                               = 1,
+                 mapped_video_codec                                    : str|None                          = None,
+                 mapped_video_preset                                   : str|None                          = None,
+                 mapped_video_crf                                      : int|None                          = None,
+                 mapped_video_scale                                    : float                             = 1.,
+                 mapped_video_frame_stride                             : int                               = 1,
 
                  gui_num_workers                            : int                           = 2,
 
@@ -186,12 +201,16 @@ class Study:
         self.interpolate_plane_pose_recordings          = interpolate_plane_pose_recordings
         self.interpolate_plane_pose_max_missing_frames  = interpolate_plane_pose_max_missing_frames
 
+        self.validate_num_workers                       = validate_num_workers
+        self.validate_defer_plots                       = validate_defer_plots
+
         self.overlay_video_gaze_vid_pos_color           = overlay_video_gaze_vid_pos_color
         self.overlay_video_gaze_world_pos_color         = overlay_video_gaze_world_pos_color
         self.overlay_video_gaze_vid_pos_radius          = overlay_video_gaze_vid_pos_radius
         self.overlay_video_gaze_world_pos_radius        = overlay_video_gaze_world_pos_radius
         self.overlay_video_gaze_vid_pos_thickness       = overlay_video_gaze_vid_pos_thickness
         self.overlay_video_gaze_world_pos_thickness     = overlay_video_gaze_world_pos_thickness
+        self.overlay_video_num_segments                 = overlay_video_num_segments        # number of segments that are rendered in parallel
 
         self.sync_ref_recording                         = sync_ref_recording
         self.sync_ref_do_time_stretch                   = sync_ref_do_time_stretch
@@ -201,6 +220,7 @@ class Study:
         self.export_output3D                            = export_output3D
         self.export_output2D                            = export_output2D
         self.export_only_code_marker_presence           = export_only_code_marker_presence
+        self.export_video_strategy                      = export_video_strategy             # how videos are put in the export directory, falls back to a copy if the requested method is not possible
 
         self.mapped_video_make_which                               = mapped_video_make_which
         self.mapped_video_recording_colors                         = mapped_video_recording_colors
@@ -225,6 +245,13 @@ class Study:
         self.mapped_video_which_gaze_type_on_plane                 = mapped_video_which_gaze_type_on_plane
         self.mapped_video_which_gaze_type_on_plane_allow_fallback  = mapped_video_which_gaze_type_on_plane_allow_fallback
         self.mapped_video_gaze_to_plane_margin                     = mapped_video_gaze_to_plane_margin                      # fraction of plane size, added to each side of the plane
+        self.mapped_video_encode_queue_size                        = mapped_video_encode_queue_size                         # max number of frames per output video waiting to be encoded
+        self.mapped_video_num_segments                             = mapped_video_num_segments                              # number of segments that are rendered in parallel
+        self.mapped_video_codec                                    = mapped_video_codec                                     # None: default codec for the output file format
+        self.mapped_video_preset                                   = mapped_video_preset
+        self.mapped_video_crf                                      = mapped_video_crf
+        self.mapped_video_scale                                    = mapped_video_scale                                     # factor by which the output video is scaled down
+        self.mapped_video_frame_stride                             = mapped_video_frame_stride                              # only every nth frame is rendered
 
         self.gui_num_workers                            = gui_num_workers
 
@@ -756,6 +783,12 @@ class Study:
                 raise ValueError(msg)
             else:
                 type_utils.merge_problem_dicts(problems, {'interpolate_plane_pose_max_missing_frames': (type_utils.ProblemLevel.Error, msg)})
+        if self.validate_num_workers < 1:
+            msg = 'validate_num_workers should be >= 1'
+            if strict_check:
+                raise ValueError(msg)
+            else:
+                type_utils.merge_problem_dicts(problems, {'validate_num_workers': (type_utils.ProblemLevel.Error, msg)})
         return problems
 
     def _check_sync_ref(self, strict_check):
@@ -824,6 +857,42 @@ class Study:
                     raise ValueError(msg)
                 else:
                     type_utils.merge_problem_dicts(problems,{'mapped_video_recording_colors': (type_utils.ProblemLevel.Error, msg)})
+        if self.mapped_video_encode_queue_size < 1:
+            msg = 'mapped_video_encode_queue_size should be >= 1'
+            if strict_check:
+                raise ValueError(msg)
+            else:
+                type_utils.merge_problem_dicts(problems, {'mapped_video_encode_queue_size': (type_utils.ProblemLevel.Error, msg)})
+        if self.mapped_video_num_segments < 1:
+            msg = 'mapped_video_num_segments should be >= 1'
+            if strict_check:
+                raise ValueError(msg)
+            else:
+                type_utils.merge_problem_dicts(problems, {'mapped_video_num_segments': (type_utils.ProblemLevel.Error, msg)})
+        if self.mapped_video_crf is not None and self.mapped_video_crf < 0:
+            msg = 'mapped_video_crf should be >= 0'
+            if strict_check:
+                raise ValueError(msg)
+            else:
+                type_utils.merge_problem_dicts(problems, {'mapped_video_crf': (type_utils.ProblemLevel.Error, msg)})
+        if not 0. < self.mapped_video_scale <= 1.:
+            msg = 'mapped_video_scale should be larger than 0 and not larger than 1'
+            if strict_check:
+                raise ValueError(msg)
+            else:
+                type_utils.merge_problem_dicts(problems, {'mapped_video_scale': (type_utils.ProblemLevel.Error, msg)})
+        if self.mapped_video_frame_stride < 1:
+            msg = 'mapped_video_frame_stride should be >= 1'
+            if strict_check:
+                raise ValueError(msg)
+            else:
+                type_utils.merge_problem_dicts(problems, {'mapped_video_frame_stride': (type_utils.ProblemLevel.Error, msg)})
+        if self.overlay_video_num_segments < 1:
+            msg = 'overlay_video_num_segments should be >= 1'
+            if strict_check:
+                raise ValueError(msg)
+            else:
+                type_utils.merge_problem_dicts(problems, {'overlay_video_num_segments': (type_utils.ProblemLevel.Error, msg)})
         return problems
 
     def field_problems(self) -> type_utils.ProblemDict:
@@ -1128,12 +1197,15 @@ study_parameter_doc = {
     'head_attached_recordings_replace_et_scene': type_utils.GUIDocInfo('Head-attached recording: override scene camera', 'gazeMapper allows using recordings from a head-attached camera to replace pose determination done from the scene camera image. It might make sense to enable this when the image quality of the scene camera is not good enough. Requires instrinsics and extrinsics (transformation from the head-attached camera to the scene camera) of the head-attached camera to be known.'),
     'interpolate_plane_pose_recordings': type_utils.GUIDocInfo('Plane pose interpolation: recordings', 'Eye tracker recordings for which detected plane poses should be interpolated or resampled to the eye tracking sample rate.'),
     'interpolate_plane_pose_max_missing_frames': type_utils.GUIDocInfo('Plane pose interpolation: max missing frames', 'Maximum number of missing detected video frames allowed between two detected plane poses for interpolation. A value of 0 only interpolates between adjacent detected video frames.'),
+    'validate_num_workers': type_utils.GUIDocInfo('Validation: Number of workers', 'Number of processes used for processing the validation episodes of a recording in parallel when running the Validate action. A value of 1 processes the episodes one at a time. When the Validate action is run from the GUI, the episodes are processed one at a time regardless of this setting, since each action already runs in its own worker.'),
+    'validate_defer_plots': type_utils.GUIDocInfo('Validation: Defer plots', 'If set, the Validate action only computes and stores the numeric results (fixation classification, assignment of fixations to targets and data quality). The plots of the classified fixations and of the assignment to targets are then not made as part of the action, but can be made on demand (e.g., using the "Make validation plots" option of the Validate action in the GUI\'s recording context menu, or by calling gazeMapper.process.run_validation.make_plots()).'),
     'overlay_video_gaze_vid_pos_color': type_utils.GUIDocInfo('Gaze overlay video: Color for gaze position on video', 'Color used for drawing the recorded gaze position on the scene video.'),
     'overlay_video_gaze_world_pos_color': type_utils.GUIDocInfo('Gaze overlay video: Color for 3D gaze position', 'Color used for drawing the recorded 3D gaze position in the world. Not drawn if value is not set.'),
     'overlay_video_gaze_vid_pos_radius': type_utils.GUIDocInfo('Gaze overlay video: Radius for gaze position on video', 'Radius of circle used for drawing the recorded gaze position on the scene video.'),
     'overlay_video_gaze_world_pos_radius': type_utils.GUIDocInfo('Gaze overlay video: Radius for 3D gaze position', 'Radius of circle used for drawing the recorded 3D gaze position in the world.'),
     'overlay_video_gaze_vid_pos_thickness': type_utils.GUIDocInfo('Gaze overlay video: Thickness for gaze position on video', 'Line thickness of circle used for drawing the recorded gaze position on the scene video.'),
     'overlay_video_gaze_world_pos_thickness': type_utils.GUIDocInfo('Gaze overlay video: Thickness for 3D gaze position', 'Line thickness of circle used for drawing the recorded 3D gaze position in the world.'),
+    'overlay_video_num_segments': type_utils.GUIDocInfo('Gaze overlay video: Number of segments', 'If larger than 1, the gaze overlay video is split into this number of segments that are rendered in parallel, each in their own process, and then joined together. Requires ffmpeg to be on the path. Not used when the video generation is shown in a viewer, or when run from the GUI (since each action already runs in its own worker).'),
     'sync_ref_recording': type_utils.GUIDocInfo('Synchronization: Reference recording', 'If there are multiple recordings, sets to which recording all other recordings will be synchronized.'),
     'sync_ref_do_time_stretch': type_utils.GUIDocInfo('Synchronization: Do time stretch?', 'If enabled, multiple sync points are used to calculate a time stretch factor to compensate for clock drift when synchronizing multiple recordings.'),
     'sync_ref_stretch_which': type_utils.GUIDocInfo('Synchronization: Stretch which recording', 'Which recording(s) should be corrected for clock drift if "Synchronization: Do time stretch?" is enabled.',{
@@ -1146,6 +1218,14 @@ study_parameter_doc = {
     'export_output3D': type_utils.GUIDocInfo('Mapped data export: include 3D fields', 'Determines whether gaze positions on the plane in the scene camera reference frame are exported when invoking the Export Trials action.'),
     'export_output2D': type_utils.GUIDocInfo('Mapped data export: include 2D fields', 'Determines whether gaze positions on the plane in the plane\'s reference frame are exported when invoking the Export Trials action.'),
     'export_only_code_marker_presence': type_utils.GUIDocInfo('Mapped data export: only include marker presence?', 'If enabled, for each marker only a single column is added to the export created by the Export Trials action, indicating whether the given marker was detected or not on a given frame. If not enabled, marker pose information is included in the export.'),
+    'export_video_strategy': type_utils.GUIDocInfo('Video export: Strategy', 'How the gaze overlay and mapped gaze videos are placed in the export directory by the Export Trials action. If the selected strategy is not possible (e.g. because the export directory is on a different drive), the video is copied instead.',{
+        None: {     # indicates the doc specification applies to the contained values
+            'copy': type_utils.GUIDocInfo('Copy', 'The video is copied to the export directory.'),
+            'hardlink': type_utils.GUIDocInfo('Hard link', 'A hard link to the video is made in the export directory, so that no extra disk space is used. Note that the exported video is the same file as the video in the working directory: when the video is regenerated (by rerunning the Make Gaze Overlay Video or Make Mapped Gaze Video actions), the exported video is overwritten too, and is corrupt if the regeneration fails or is interrupted.'),
+            'reflink': type_utils.GUIDocInfo('Copy-on-write clone', 'The video is cloned to the export directory, which takes no extra disk space but behaves like a copy. Only supported by some filesystems (e.g. btrfs and xfs) on Linux, the video is copied instead when not supported.'),
+            'symlink': type_utils.GUIDocInfo('Symbolic link', 'A symbolic link to the video is made in the export directory. The exported video is not usable when the project directory is moved or deleted, and changes when the video is regenerated.')
+        }
+    }),
     'mapped_video_make_which': type_utils.GUIDocInfo('Mapped video: Which recordings', 'Indicates one or multiple recordings for which to make videos of the eye tracker scene camera or external camera (synchronized to one of the recordings if there are multiple) showing detected plane origins, detected individual markers and gaze from any other recordings eye tracker recordings. Also shown for eye tracker recordings are gaze on the scene video from the eye tracker, gaze projected to the detected planes. Each only if available, and enabled in the below video generation settings.'),
     'mapped_video_recording_colors': type_utils.GUIDocInfo('Mapped video: Recording colors', 'Colors used for drawing each recording\'s gaze point, scene camera and gaze vector (depending on settings).'),
     'mapped_video_projected_vidPos_color': type_utils.GUIDocInfo('Mapped video: Color for gaze position on plane', 'Color used for drawing the recorded gaze position on the scene video transformed to the plane. Not drawn if value is not set.'),
@@ -1169,6 +1249,13 @@ study_parameter_doc = {
     'mapped_video_which_gaze_type_on_plane': type_utils.GUIDocInfo('Mapped video: Which gaze on plane to show?', 'Sets which gaze-on-plane (e.g. from gaze position on the scene video or from gaze vectors projected to the plane) is used for the gaze positions shown in the generated videos.', _gaze_type_doc),
     'mapped_video_which_gaze_type_on_plane_allow_fallback': type_utils.GUIDocInfo('Mapped video: Allow fallback to showing gaze on plane based on scene video gaze?', 'Sets if it is allowed to fall back to using the projection of the gaze position on the plane derived from the gaze position on the video if the gaze-on-plane type specified in the "Mapped video: Which gaze on plane to show?" setting is not available.'),
     'mapped_video_gaze_to_plane_margin': type_utils.GUIDocInfo('Mapped video: Gaze position margin','Gaze position more than this factor outside a defined plane will not be drawn.'),
+    'mapped_video_encode_queue_size': type_utils.GUIDocInfo('Mapped video: Encoding queue size','Each output video is encoded on its own thread, so that decoding, drawing and encoding happen at the same time. This sets the maximum number of frames per output video that can be waiting to be encoded. Larger values may smooth out variations in processing speed, but use more memory.'),
+    'mapped_video_num_segments': type_utils.GUIDocInfo('Mapped video: Number of segments','If larger than 1, the mapped gaze video is split into this number of segments that are rendered in parallel, each in their own process, and then joined together. Segment boundaries are placed at episode boundaries where possible. Requires ffmpeg to be on the path. Not used when the video generation is shown in a viewer, or when run from the GUI (since each action already runs in its own worker).'),
+    'mapped_video_codec': type_utils.GUIDocInfo('Mapped video: Codec','Video codec (ffmpeg encoder name, e.g. `libx264`) used for encoding the mapped gaze video. If not set, the default codec for mp4 files is used.'),
+    'mapped_video_preset': type_utils.GUIDocInfo('Mapped video: Encoder preset','Encoder preset (e.g. `ultrafast` or `medium` for `libx264`) used for encoding the mapped gaze video. Faster presets encode quicker, but produce larger files for the same quality. If not set, the default of the encoder is used.'),
+    'mapped_video_crf': type_utils.GUIDocInfo('Mapped video: Constant rate factor','Constant rate factor (CRF) used for encoding the mapped gaze video, for encoders that support it (e.g. `libx264`). Higher values give lower quality and smaller files. If not set, the default of the encoder is used.'),
+    'mapped_video_scale': type_utils.GUIDocInfo('Mapped video: Scale factor','Factor (larger than 0 and at most 1) by which the size of the mapped gaze video is scaled down. Frames are scaled down before gaze and the other overlays, timecode and episode information are drawn and before encoding, so that drawing and encoding become quicker. Markers and plane axes drawn during pose estimation are drawn at the original size.'),
+    'mapped_video_frame_stride': type_utils.GUIDocInfo('Mapped video: Frame stride','If larger than 1, only every nth frame of the video is rendered. The resulting video plays at normal speed, but with a lower frame rate. Skipped frames are not processed, which makes making the video quicker. Together with the above encoding settings, this allows making a quick draft version of the mapped gaze video, see the `draft` argument of `gazeMapper.process.make_mapped_gaze_video.run()`.'),
     'gui_num_workers': type_utils.GUIDocInfo('Number of workers','Each action is processed by a worker and each worker can handle one action at a time. Having more workers means more actions are processed simultaneously, but having too many will not provide any gain and might freeze the program and your whole computer. Since much of the processing utilizes more than one processor thread, set this value to significantly less than the number of threads available in your system. NB: If you currently have running or enqueued jobs, the number of workers will only be changed once all have completed or are cancelled.'),
 }
 event_setup_doc = {
@@ -1203,6 +1290,9 @@ event_setup_doc = {
             'parameters': type_utils.GUIDocInfo('Parameters', 'Set of parameters and values to pass to the function. The frame to process (np.ndarray) is the first (positional) input passed to the function, and should not be specified in this set.'),
         }),
         'use_average': type_utils.GUIDocInfo('Gaze data synchronization: Use average?', 'Whether to use the average offset of multiple sync episodes. If not enabled, the offset for the first sync episode is used, the rest are ignored.'),
+        'auto_estimate': type_utils.GUIDocInfo('Gaze data synchronization: Automatically estimate offset?', 'If enabled, the offset between the eye tracker data and the scene camera is estimated automatically for each sync episode by maximizing the cross-correlation between the velocity of the gaze position and of the target position in the scene video, and no GUI is shown. Only episodes for which the estimate is not reliable (see "Gaze data synchronization: Minimum quality of automatic estimate") have to be reviewed using the GUI. Should be enabled for all sync episodes of a recording to take effect. All episodes can still be reviewed using the GUI (using the "Review all episodes in GUI" option of the Sync ET To Cam action in the GUI\'s recording context menu, or by calling gazeMapper.process.sync_et_to_cam.run() with force_gui=True).'),
+        'auto_min_quality': type_utils.GUIDocInfo('Gaze data synchronization: Minimum quality of automatic estimate', 'Automatically estimated offsets for which the peak correlation between gaze and target velocity is lower than this value are considered not reliable and have to be reviewed using the GUI.'),
+        'auto_max_offset': type_utils.GUIDocInfo('Gaze data synchronization: Maximum automatically estimated offset (s)', 'The largest offset (positive or negative) between the eye tracker data and the scene camera that is considered when automatically estimating the offset.'),
     }),
     'validation_setup': type_utils.GUIDocInfo('glassesValidator setup', 'Setup for determining the data quality of gaze data based on looking at a validation poster during this event (using glassesValidator).',{
         'do_global_shift': type_utils.GUIDocInfo('Apply global shift?', 'If enabled, for each validation interval the median position will be removed from the gaze data and the mean from the targets, removing any overall shift of the data. This improves the matching of fixations to targets when there is a significant overall offset in the data. It may fail (backfire) if there are data samples far outside the range of the validation targets, or if there is no data for some targets.'),
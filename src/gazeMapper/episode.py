@@ -3,7 +3,7 @@ import pandas as pd
 import typing
 from collections import defaultdict
 
-from glassesTools import annotation
+from glassesTools import annotation, naming as gt_naming, timestamps
 
 from . import config, naming
 
@@ -87,111 +87,203 @@ def get_source_labeled_episodes(episodes: EpisodeMap, imported_episodes: Episode
             labeled[f'{nm} (from recording {other_rec})'] = (episodes[nm][0], _copy_intervals(imported_episodes[nm][other_rec]))
     return labeled
 
-def load_episodes_from_all_recordings_with_info(study_config: config.Study, recording_dir: str|pathlib.Path, episode_subset: set[str]|None=None, load_from_other_recordings=True, empty_if_no_coding=True, error_if_unwanted_found=True, missing_other_coding_ok=False) -> tuple[EpisodeMap, set[str], EpisodeSourceRefs, EpisodeImportedMap]:
-    from . import synchronization
-    # loads episodes for both the current recording, and optionally also from other synced recordings in the session as set up in the study config
-    recording_dir = pathlib.Path(recording_dir)
-    rec_name = recording_dir.name
-    coding_file = recording_dir / naming.coding_file
-    if coding_file.is_file():
-        episodes = list_to_marker_dict(read_list_from_file(coding_file))
-        if episode_subset is not None:
-            episodes = {k:v for k,v in episodes.items() if k in episode_subset}
-    else:
-        if not empty_if_no_coding:
-            raise FileNotFoundError(f'No coding file found at {coding_file}')
-        episodes = get_empty_marker_dict([(cs['name'],cs['event_type']) for cs in study_config.coding_setup if episode_subset is None or cs['name'] in episode_subset])
+class ActiveEpisodeLookup:
+    # finds which episodes are active at a given frame. Episodes are compiled once into lists of start and end
+    # frames sorted by start frame. When queried with increasing frame indices (e.g. while rendering a video), a
+    # cursor advances through the episodes so that each query only considers episodes that started since the
+    # previous query and episodes that are still ongoing. Querying an earlier frame restarts the cursor.
+    # Active episodes are returned as (name, index) in the order of the input episode map
+    def __init__(self, episodes: EpisodeMap):
+        entries = [(name, idx, iv[0], iv[-1]) for name in episodes for idx, iv in enumerate(episodes[name][1]) if iv]
+        order   = sorted(range(len(entries)), key=lambda i: entries[i][2])
+        self._entries   = [entries[i][:2] for i in order]
+        self._order     = order                         # position of each entry in the input, for ordering output
+        self._starts    = [entries[i][2] for i in order]
+        self._ends      = [entries[i][3] for i in order]
+        self._reset()
+
+    def _reset(self):
+        self._cursor    = 0
+        self._ongoing   : list[int] = []
+        self._last_frame= -1
+
+    def get_active(self, frame_idx: int) -> list[tuple[str, int]]:
+        if frame_idx<self._last_frame:
+            self._reset()
+        self._last_frame = frame_idx
+        # add episodes that started, remove those that ended
+        while self._cursor<len(self._starts) and self._starts[self._cursor]<=frame_idx:
+            self._ongoing.append(self._cursor)
+            self._cursor += 1
+        self._ongoing = [i for i in self._ongoing if self._ends[i]>=frame_idx]
+        return [self._entries[i] for i in sorted(self._ongoing, key=lambda i: self._order[i])]
+
+class EpisodeGraph:
+    # Session-wide view of the episodes coded for the recordings in a session. Coding files, frame
+    # timestamps and the sync between recordings are each loaded only once, and episodes imported from
+    # other recordings are resolved once, however many recordings are queried. Contains only plain
+    # data, so can be pickled to be sent to worker processes.
+    # NB: coding done after the graph is constructed is not picked up, make a new graph in that case
+    def __init__(self, study_config: config.Study, session_dir: str|pathlib.Path):
+        self.study_config   = study_config
+        self.session_dir    = pathlib.Path(session_dir)
+
+        self._coding        : dict[str, EpisodeMap|None]                        = {}
+        self._video_ts      : dict[str, timestamps.VideoTimestamps]             = {}
+        self._sync          : pd.DataFrame|None                                 = None
+        self._sync_loaded   : bool                                              = False
+        self._imported      : dict[tuple[str,str,str], list[list[int]]|None]    = {}
+
+    def _get_coding(self, rec: str) -> EpisodeMap|None:
+        if rec not in self._coding:
+            coding_file = self.session_dir / rec / naming.coding_file
+            self._coding[rec] = list_to_marker_dict(read_list_from_file(coding_file)) if coding_file.is_file() else None
+        return self._coding[rec]
+
+    def _get_video_ts(self, rec: str) -> timestamps.VideoTimestamps:
+        if rec not in self._video_ts:
+            self._video_ts[rec] = timestamps.VideoTimestamps(self.session_dir / rec / gt_naming.frame_timestamps_fname)
+        return self._video_ts[rec]
+
+    def _get_sync(self) -> pd.DataFrame|None:
+        from . import synchronization
+        if not self._sync_loaded:
+            ref_rec  = self.study_config.sync_ref_recording
+            all_recs = [r.name for r in self.study_config.session_def.recordings if r.name!=ref_rec]
+            self._sync = synchronization.get_sync_for_recs(self.session_dir, all_recs, ref_rec, bool(self.study_config.sync_ref_do_time_stretch), list(self.study_config.sync_ref_average_recordings or []), missing_ref_coding_ok=True)
+            self._sync_loaded = True
+        return self._sync
+
+    def _get_episodes_from_other_recording(self, event: str, rec: str, other_rec: str) -> list[list[int]]|None:
+        from . import synchronization
+        key = (event, rec, other_rec)
+        if key not in self._imported:
+            self._imported[key] = None
+            other_episodes = self._get_coding(other_rec)
+            if other_episodes is None or event not in other_episodes:
+                return None
+            if (sync:=self._get_sync()) is None:
+                return None
+            ref_rec = self.study_config.sync_ref_recording
+            self._imported[key] = synchronization.other_video_frame_indices_to_video(self.session_dir, other_episodes[event][1], rec, other_rec, ref_rec, sync,
+                                                                                     self._get_video_ts(rec), self._get_video_ts(other_rec), self._get_video_ts(ref_rec),
+                                                                                     bool(self.study_config.sync_ref_do_time_stretch), self.study_config.sync_ref_stretch_which or 'other')
+        return self._imported[key]
+
+    def resolve_all(self):
+        # load and resolve everything up front, e.g. before pickling the graph to send it to worker processes
+        for r in self.study_config.session_def.recordings:
+            self.get_episodes_with_info(r.name, error_if_unwanted_found=False, missing_other_coding_ok=True)
+
+    def get_episodes_with_info(self, rec_name: str, episode_subset: set[str]|None=None, load_from_other_recordings=True, empty_if_no_coding=True, error_if_unwanted_found=True, missing_other_coding_ok=False) -> tuple[EpisodeMap, set[str], EpisodeSourceRefs, EpisodeImportedMap]:
+        # loads episodes for both the current recording, and optionally also from other synced recordings in the session as set up in the study config
+        study_config = self.study_config
+        episodes = self._get_coding(rec_name)
+        if episodes is not None:
+            episodes = copy_episode_map(episodes)
+            if episode_subset is not None:
+                episodes = {k:v for k,v in episodes.items() if k in episode_subset}
+        else:
+            if not empty_if_no_coding:
+                raise FileNotFoundError(f'No coding file found at {self.session_dir / rec_name / naming.coding_file}')
+            episodes = get_empty_marker_dict([(cs['name'],cs['event_type']) for cs in study_config.coding_setup if episode_subset is None or cs['name'] in episode_subset])
 
-    # check what coding we expect for this file
-    if len(study_config.session_def.recordings)==1:
-        to_code = {cs['name'] for cs in study_config.coding_setup}
-    else:
-        to_code: set[str] = set()
+        # check what coding we expect for this file
+        if len(study_config.session_def.recordings)==1:
+            to_code = {cs['name'] for cs in study_config.coding_setup}
+        else:
+            to_code: set[str] = set()
+            for cs in study_config.coding_setup:
+                if cs['event_type']==annotation.EventType.Sync_Camera:
+                    # camera sync events are always coded for all recordings
+                    to_code.add(cs['name'])
+                    continue
+                which_recs = cs.get('which_recordings')
+                if which_recs is None or rec_name in which_recs:
+                    to_code.add(cs['name'])
+        if episode_subset is not None:
+            to_code = to_code.intersection(episode_subset)
+
+        # add missing fields
+        wanted_events = {cs['name'] for cs in study_config.coding_setup if episode_subset is None or cs['name'] in episode_subset}
+        for evt in wanted_events:
+            if evt not in episodes:
+                cs = [cs for cs in study_config.coding_setup if cs['name']==evt][0]
+                episodes[evt] = (cs['event_type'], [])
+
+        episode_sources = _get_local_episode_sources(episodes)
+        imported_episodes = _get_empty_imported_episodes(episodes)
+
+        if not load_from_other_recordings:
+            return episodes, to_code, episode_sources, imported_episodes
+
+        # now check if there is coding to get from other recordings, or if there is coding that should not be there
+        # checking for coding from other recordings is done using the study config setup, it can be switched off for specific events
+        # check for unwanted coding
+        to_remove = []
+        for nm in episodes:
+            if episodes[nm][1] and nm not in to_code:
+                if error_if_unwanted_found:
+                    cs = [cs for cs in study_config.coding_setup if cs['name']==nm][0]
+                    raise ValueError(f'{nm} episodes are gotten from the recordings {", ".join(sorted(cs.get("which_recordings")))} and should not be coded for this recording ({rec_name})')
+                else:
+                    to_remove.append(nm)
+        for nm in to_remove:
+            del episodes[nm]
+        for evt in wanted_events:
+            if evt not in episodes:
+                cs = [cs for cs in study_config.coding_setup if cs['name']==evt][0]
+                episodes[evt] = (cs['event_type'], [])
+        episode_sources = _get_local_episode_sources(episodes)
+        imported_episodes = _get_empty_imported_episodes(episodes)
+
+        if study_config.sync_ref_recording is None:
+            return episodes, to_code, episode_sources, imported_episodes
+
+        # check for coding to get from other recordings
         for cs in study_config.coding_setup:
-            if cs['event_type']==annotation.EventType.Sync_Camera:
-                # camera sync events are always coded for all recordings
-                to_code.add(cs['name'])
+            nm = cs['name']
+            if episode_subset is not None and nm not in episode_subset:
                 continue
             which_recs = cs.get('which_recordings')
-            if which_recs is None or rec_name in which_recs:
-                to_code.add(cs['name'])
-    if episode_subset is not None:
-        to_code = to_code.intersection(episode_subset)
-
-    # add missing fields
-    wanted_events = {cs['name'] for cs in study_config.coding_setup if episode_subset is None or cs['name'] in episode_subset}
-    for evt in wanted_events:
-        if evt not in episodes:
-            cs = [cs for cs in study_config.coding_setup if cs['name']==evt][0]
-            episodes[evt] = (cs['event_type'], [])
-
-    episode_sources = _get_local_episode_sources(episodes)
-    imported_episodes = _get_empty_imported_episodes(episodes)
-
-    if not load_from_other_recordings:
-        return episodes, to_code, episode_sources, imported_episodes
-
-    # now check if there is coding to get from other recordings, or if there is coding that should not be there
-    # checking for coding from other recordings is done using the study config setup, it can be switched off for specific events
-    # check for unwanted coding
-    to_remove = []
-    for nm in episodes:
-        if episodes[nm][1] and nm not in to_code:
-            if error_if_unwanted_found:
-                cs = [cs for cs in study_config.coding_setup if cs['name']==nm][0]
-                raise ValueError(f'{nm} episodes are gotten from the recordings {", ".join(sorted(cs.get("which_recordings")))} and should not be coded for this recording ({rec_name})')
-            else:
-                to_remove.append(nm)
-    for nm in to_remove:
-        del episodes[nm]
-    for evt in wanted_events:
-        if evt not in episodes:
-            cs = [cs for cs in study_config.coding_setup if cs['name']==evt][0]
-            episodes[evt] = (cs['event_type'], [])
-    episode_sources = _get_local_episode_sources(episodes)
-    imported_episodes = _get_empty_imported_episodes(episodes)
-
-    ref_rec = study_config.sync_ref_recording
-    if ref_rec is None:
-        return episodes, to_code, episode_sources, imported_episodes
-    all_recs = [r.name for r in study_config.session_def.recordings if r.name!=ref_rec]
-
-    # check for coding to get from other recordings
-    for cs in study_config.coding_setup:
-        nm = cs['name']
-        if episode_subset is not None and nm not in episode_subset:
-            continue
-        which_recs = cs.get('which_recordings')
-        if which_recs is None:
-            continue
-        candidate_recs = [r.name for r in study_config.session_def.recordings if r.name in which_recs and r.name!=rec_name]
-        if not candidate_recs:
-            continue
-        should_get_from_other = cs.get('load_from_other_recordings')
-        should_use_other_for_base = should_get_from_other and not episodes[nm][1]
-        gotten_from_other = not should_use_other_for_base
-        for other_rec in candidate_recs:
-            eps = synchronization.get_episode_frame_indices_from_other_video(recording_dir, nm, rec_name, other_rec, ref_rec, all_recs, bool(study_config.sync_ref_do_time_stretch), list(study_config.sync_ref_average_recordings or []), study_config.sync_ref_stretch_which or 'other', missing_other_coding_ok=True)
-            if not eps:
+            if which_recs is None:
                 continue
-            imported_episodes[nm][other_rec] = _copy_intervals(eps)
-            if not should_use_other_for_base or gotten_from_other:
+            candidate_recs = [r.name for r in study_config.session_def.recordings if r.name in which_recs and r.name!=rec_name]
+            if not candidate_recs:
                 continue
-            episodes[nm] = (cs['event_type'], _copy_intervals(eps))
-            episode_sources[nm] = [(other_rec, i) for i in range(len(eps))]
-            gotten_from_other = True
-        if not gotten_from_other and should_get_from_other and not missing_other_coding_ok:
-            other_recs = ', '.join(sorted(candidate_recs))
-            if which_recs is not None and rec_name in which_recs:
-                msg_part = f'Coding for {nm} is expected to be coded for this recording ({rec_name}), but not found in this or any other recording that it may be found in ({other_recs}).'
-            else:
-                msg_part = f'Coding for {nm} (not expected for this recording, {rec_name}) was not found in any other recording for which it may be expected ({other_recs}).'
-            raise ValueError(f'{msg_part} Please ensure coding for {nm} is present.')
+            should_get_from_other = cs.get('load_from_other_recordings')
+            should_use_other_for_base = should_get_from_other and not episodes[nm][1]
+            gotten_from_other = not should_use_other_for_base
+            for other_rec in candidate_recs:
+                eps = self._get_episodes_from_other_recording(nm, rec_name, other_rec)
+                if not eps:
+                    continue
+                imported_episodes[nm][other_rec] = _copy_intervals(eps)
+                if not should_use_other_for_base or gotten_from_other:
+                    continue
+                episodes[nm] = (cs['event_type'], _copy_intervals(eps))
+                episode_sources[nm] = [(other_rec, i) for i in range(len(eps))]
+                gotten_from_other = True
+            if not gotten_from_other and should_get_from_other and not missing_other_coding_ok:
+                other_recs = ', '.join(sorted(candidate_recs))
+                if which_recs is not None and rec_name in which_recs:
+                    msg_part = f'Coding for {nm} is expected to be coded for this recording ({rec_name}), but not found in this or any other recording that it may be found in ({other_recs}).'
+                else:
+                    msg_part = f'Coding for {nm} (not expected for this recording, {rec_name}) was not found in any other recording for which it may be expected ({other_recs}).'
+                raise ValueError(f'{msg_part} Please ensure coding for {nm} is present.')
+
+        return episodes, to_code, episode_sources, imported_episodes
 
-    return episodes, to_code, episode_sources, imported_episodes
+def load_episodes_from_all_recordings_with_info(study_config: config.Study, recording_dir: str|pathlib.Path, episode_subset: set[str]|None=None, load_from_other_recordings=True, empty_if_no_coding=True, error_if_unwanted_found=True, missing_other_coding_ok=False, episode_graph: EpisodeGraph|None=None) -> tuple[EpisodeMap, set[str], EpisodeSourceRefs, EpisodeImportedMap]:
+    # loads episodes for both the current recording, and optionally also from other synced recordings in the session as set up in the study config
+    # when episodes of multiple recordings of a session are needed, pass in an EpisodeGraph for the session so that work is shared between calls
+    recording_dir = pathlib.Path(recording_dir)
+    if episode_graph is None:
+        episode_graph = EpisodeGraph(study_config, recording_dir.parent)
+    return episode_graph.get_episodes_with_info(recording_dir.name, episode_subset, load_from_other_recordings, empty_if_no_coding, error_if_unwanted_found, missing_other_coding_ok)
 
-def load_episodes_from_all_recordings(study_config: config.Study, recording_dir: str|pathlib.Path, episode_subset: set[str]|None=None, load_from_other_recordings=True, empty_if_no_coding=True, error_if_unwanted_found=True, missing_other_coding_ok=False) -> tuple[EpisodeMap, set[str]]:
-    episodes, to_code, _, _ = load_episodes_from_all_recordings_with_info(study_config, recording_dir, episode_subset, load_from_other_recordings, empty_if_no_coding, error_if_unwanted_found, missing_other_coding_ok)
+def load_episodes_from_all_recordings(study_config: config.Study, recording_dir: str|pathlib.Path, episode_subset: set[str]|None=None, load_from_other_recordings=True, empty_if_no_coding=True, error_if_unwanted_found=True, missing_other_coding_ok=False, episode_graph: EpisodeGraph|None=None) -> tuple[EpisodeMap, set[str]]:
+    episodes, to_code, _, _ = load_episodes_from_all_recordings_with_info(study_config, recording_dir, episode_subset, load_from_other_recordings, empty_if_no_coding, error_if_unwanted_found, missing_other_coding_ok, episode_graph)
     return episodes, to_code
 
 
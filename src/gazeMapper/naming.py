@@ -5,9 +5,15 @@ world_gaze_prefix   = 'planeGaze_'
 coding_file         = 'coding.tsv'
 target_sync_prefix  = 'et_sync_target_'
 VOR_sync_file       = 'VOR_sync.tsv'
+gaze_sync_columns_prefix = 'gazeData_'
+ref_frame_map_file  = 'refFrameMap.npy'
+marker_presence_file= 'markerPresence.npz'
 gaze_offset_prefix  = 'gazeOffset_'
 validation_prefix   = 'validate_'
 val_fixation_infix  = '_fixations_interval_'
+val_fixation_plot_data_suffix = '_plot_data'
+fixation_cache_dir  = 'fixationCache'
 mapped_gaze_video   = 'mappedGaze.mp4'
+mapped_gaze_video_draft = 'mappedGaze_draft.mp4'
 gaze_export_prefix  = 'planeGaze_'
 offset_export_prefix= 'gazeOffset_'
@@ -139,6 +139,16 @@ def get_specific_event_types(study_config: 'config.Study', specific_event_type:
 def _config_has_et_sync(study_config: 'config.Study') -> bool:
     return not not get_specific_event_types(study_config, annotation.EventType.Sync_ET_Data, ['sync_setup'])
 
+def mapped_video_uses_plane_gaze(study_config: 'config.Study') -> bool:
+    # whether MAKE_MAPPED_GAZE_VIDEO draws gaze on the planes (which it takes from the output of GAZE_TO_PLANE when available)
+    return not not study_config.mapped_video_show_gaze_on_plane_in_which or not not study_config.mapped_video_show_gaze_vec_in_which
+
+def config_has_automatic_et_sync(study_config: 'config.Study', rec: str) -> bool:
+    # whether SYNC_ET_TO_CAM automatically estimates the offset for all ET sync events of the recording, so that the
+    # GUI is only needed to review unreliable estimates
+    sync_events = [cs for cs in get_specific_event_types(study_config, annotation.EventType.Sync_ET_Data) if cs['which_recordings'] is None or rec in cs['which_recordings']]
+    return bool(sync_events) and all(cs['sync_setup'] is not None and cs['sync_setup'].get('auto_estimate', False) for cs in sync_events)
+
 def config_has_plane_pose_interpolation(study_config: 'config.Study', rec: str|None=None) -> bool:
     if not study_config.interpolate_plane_pose_recordings:
         return False
@@ -258,12 +268,17 @@ def _determine_to_invalidate(action: Action, study_config: 'config.Study') -> se
         case Action.SYNC_ET_TO_CAM:
             states_to_invalidate = action.next_values()
         case Action.INTERPOLATE_PLANE_POSE:
+            # NB: MAKE_MAPPED_GAZE_VIDEO does not use interpolated plane poses, nor gaze-to-plane output computed from
+            # them. GAZE_TO_PLANE is invalidated, so the video is invalidated when GAZE_TO_PLANE is run again
             states_to_invalidate = {a for a in Action.GAZE_TO_PLANE.next_values(inclusive=True) if a not in [Action.MAKE_MAPPED_GAZE_VIDEO]}
         case Action.SYNC_TO_REFERENCE:
             states_to_invalidate = action.next_values()
         case Action.GAZE_TO_PLANE:
-            # NB: MAKE_MAPPED_GAZE_VIDEO does the job itself/doesn't use the gaze-to-plane file
-            states_to_invalidate = {a for a in action.next_values() if a not in [Action.MAKE_MAPPED_GAZE_VIDEO]}
+            actions = action.next_values()
+            if not mapped_video_uses_plane_gaze(study_config):
+                # MAKE_MAPPED_GAZE_VIDEO only uses the gaze-to-plane files for drawing gaze on planes
+                actions.discard(Action.MAKE_MAPPED_GAZE_VIDEO)
+            states_to_invalidate = actions
         case Action.COMPUTE_GAZE_OFFSETS:
             states_to_invalidate = {Action.EXPORT_TRIALS}
         case Action.VALIDATE:
@@ -0,0 +1,101 @@
+import pathlib
+import shutil
+import subprocess
+import tempfile
+from typing import Any
+
+from ffpyplayer.pic import Image
+
+
+def is_available() -> bool:
+    return shutil.which('ffmpeg') is not None and shutil.which('ffprobe') is not None
+
+
+def has_audio(video_file: str|pathlib.Path) -> bool:
+    command = ['ffprobe',
+        '-loglevel', 'error',
+        '-select_streams', 'a',
+        '-show_entries', 'stream=codec_type',
+        '-of', 'csv=p=0',
+        str(video_file)]
+    proc = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    return proc.returncode==0 and not proc.stderr and 'audio' in proc.stdout.decode().split()
+
+
+def write(out_file: str|pathlib.Path, video_input: list[str], extra_args: list[str]|None = None):
+    # write out_file from the video input without reencoding. extra_args can be used to e.g. add audio, in that case
+    # they should specify the stream mapping and codecs
+    command = ['ffmpeg', '-hide_banner', '-loglevel', 'error', '-y', *video_input, *(extra_args if extra_args is not None else ['-c', 'copy']), str(out_file)]
+    proc = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if proc.returncode!=0:
+        raise RuntimeError(f'Writing {out_file} failed: {proc.stderr.decode().strip()}')
+
+
+def concat(out_file: str|pathlib.Path, segment_files: list[pathlib.Path], extra_args: list[str]|None = None):
+    # join segments without reencoding, the segment files are removed when done.
+    # NB: segment files should be in the same folder as out_file
+    out_file  = pathlib.Path(out_file)
+    list_file = out_file.with_name(f'{out_file.stem}_segments.txt')
+    with open(list_file, 'w') as f:
+        for s in segment_files:
+            f.write(f"file '{s.name}'\n")
+    write(out_file, ['-f', 'concat', '-safe', '0', '-i', str(list_file)], extra_args)
+    # clean up
+    list_file.unlink()
+    for s in segment_files:
+        s.unlink()
+
+
+class Writer:
+    # encodes frames by piping them to ffmpeg, with the same interface as ffpyplayer's MediaWriter. This is used when
+    # more than only the encoded frames need to go into the output file (e.g. audio of the source video, specified by
+    # extra_args, which should also specify the stream mapping), so that the output file is written in one go.
+    # NB: ffmpeg reads the frames at a constant frame rate, frames missing according to the presentation timestamps
+    # are filled in by repeating the previous frame
+    def __init__(self, out_file: str|pathlib.Path, out_opts: dict[str, Any], lib_opts: dict[str, str], extra_args: list[str]):
+        self._out_file  = out_file
+        self._fps       = out_opts['frame_rate'][0]/out_opts['frame_rate'][1]
+        self._n_frames  = 0
+        self._last: bytearray|None = None
+        command = ['ffmpeg', '-hide_banner', '-loglevel', 'error', '-y',
+            '-f', 'rawvideo', '-pix_fmt', out_opts['pix_fmt_in'], '-s', f'{out_opts["width_in"]}x{out_opts["height_in"]}', '-framerate', '{}/{}'.format(*out_opts['frame_rate']), '-i', 'pipe:0',
+            *extra_args,
+            '-c:v', out_opts['codec'], '-pix_fmt', out_opts['pix_fmt_out'], *(a for k,o in lib_opts.items() for a in (f'-{k}', o)),
+            str(out_file)]
+        # NB: error output goes to a file, so that ffmpeg cannot block on a full pipe while we're writing frames
+        self._stderr = tempfile.TemporaryFile()
+        self._proc = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=self._stderr)
+
+    def write_frame(self, img: Image, pts: float):
+        buf = img.to_memoryview(keep_align=True)[0]
+        try:
+            # repeat the previous frame (or this one, if it is the first) until the frame at pts
+            fill = buf if self._last is None else self._last
+            while self._n_frames<round(pts*self._fps):
+                self._proc.stdin.write(fill)
+                self._n_frames += 1
+            self._proc.stdin.write(buf)
+            self._n_frames += 1
+        except BrokenPipeError:
+            # ffmpeg exited, report why
+            self.close()
+            raise
+        # keep a copy, the caller may reuse the frame's memory
+        if self._last is None:
+            self._last = bytearray(len(buf))
+        self._last[:] = buf
+
+    def close(self):
+        if not self._proc.stdin.closed:
+            try:
+                self._proc.stdin.close()
+            except BrokenPipeError:
+                pass    # ffmpeg exited early, reported below
+        self._proc.wait()
+        if self._stderr.closed:
+            return
+        self._stderr.seek(0)
+        err = self._stderr.read().decode(errors='replace').strip()
+        self._stderr.close()
+        if self._proc.returncode!=0:
+            raise RuntimeError(f'Writing {self._out_file} failed: {err}')
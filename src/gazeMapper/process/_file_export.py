@@ -0,0 +1,67 @@
+import pathlib
+import shutil
+import os
+from typing import Literal
+
+Strategy = Literal['copy','hardlink','reflink','symlink']
+
+# strategies to try, in order, for each requested export strategy. Copying always works (if the destination is writable)
+# and is therefore the last resort. NB: a reflink (copy-on-write clone) behaves like a copy, but can only be made on the
+# same filesystem (and only some filesystems such as btrfs and xfs support it), a hard link also can only be made on the
+# same filesystem, and symbolic links may require special privileges (e.g. on Windows).
+# A reflink must only fall back to a copy: hard and symbolic links share the file with the working directory, so
+# regenerating the video (which overwrites the file in place) would change or corrupt the exported video. Links are
+# therefore only made when explicitly requested
+_fallbacks: dict[str, list[str]] = {
+    'copy':     ['copy'],
+    'hardlink': ['hardlink', 'copy'],
+    'reflink':  ['reflink', 'copy'],
+    'symlink':  ['symlink', 'copy'],
+}
+
+_FICLONE = 0x40049409   # linux ioctl request for cloning a file (see ioctl_ficlone(2))
+
+
+def export(src: str|pathlib.Path, dst: str|pathlib.Path, strategy: Strategy = 'copy') -> str:
+    # put src at dst using the requested strategy, falling back to the next strategy if it is not possible. Returns the
+    # strategy that was used
+    src = pathlib.Path(src)
+    dst = pathlib.Path(dst)
+    if strategy not in _fallbacks:
+        raise ValueError(f'Unknown export strategy "{strategy}", should be one of {list(_fallbacks)}')
+
+    for s in _fallbacks[strategy]:
+        # remove previous export, if any (links cannot be made if the destination exists)
+        if dst.is_symlink() or dst.exists():
+            dst.unlink()
+        try:
+            match s:
+                case 'copy':
+                    shutil.copy2(src, dst)
+                case 'hardlink':
+                    os.link(src, dst)
+                case 'reflink':
+                    _reflink(src, dst)
+                case 'symlink':
+                    dst.symlink_to(src.resolve())
+        except OSError:
+            if s=='copy':
+                raise
+            continue
+        return s
+
+
+def _reflink(src: pathlib.Path, dst: pathlib.Path):
+    # make a copy-on-write clone of src at dst. Only possible on Linux
+    try:
+        import fcntl
+    except ImportError:
+        raise OSError('reflinks are not supported on this platform') from None
+    with open(src, 'rb') as f_src, open(dst, 'wb') as f_dst:
+        try:
+            fcntl.ioctl(f_dst.fileno(), _FICLONE, f_src.fileno())
+        except OSError:
+            f_dst.close()
+            dst.unlink()
+            raise
+    shutil.copystat(src, dst)
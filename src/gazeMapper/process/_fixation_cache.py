@@ -0,0 +1,81 @@
+import pathlib
+import hashlib
+import json
+import shutil
+import numpy as np
+import pandas as pd
+from typing import Any
+
+import I2MC
+import glassesTools
+
+from .. import naming
+
+
+# fixation classification results are cached per classification interval in the recording's working directory. Results
+# are keyed by a hash of the inputs to the classification: the plane gaze samples of the interval, the classifier
+# settings, the plot limits (for the plot) and the versions of the libraries doing the classification. The
+# classification also depends on some properties of the whole plane gaze file (the sampling frequency, which is used
+# to determine default settings, and which gaze signals are available), so these are hashed as well.
+# This way, the classification is only rerun for intervals whose inputs actually changed
+_cache_version = 2
+
+
+def get_keys(plane_gaze_file: str|pathlib.Path, intervals: list[list[int]], I2MC_settings: dict[str, Any]|None, plot_limits: list[list[float]]) -> list[str]:
+    # get the key for each of the classification intervals. NB: the plane gaze file is read and hashed only once
+    gazes = pd.read_csv(plane_gaze_file, delimiter='\t', index_col=False)
+    h = hashlib.sha256()
+    h.update(json.dumps({'version': _cache_version, 'I2MC_settings': I2MC_settings, 'plot_limits': plot_limits,
+                         'glassesTools': glassesTools.__version__, 'I2MC': I2MC.__version__}, sort_keys=True, default=str).encode())
+    # properties of the whole file
+    ts_diff = np.diff(gazes['timestamp'].to_numpy())
+    ts_diff = ts_diff[ts_diff>0]
+    h.update(json.dumps({'freq': float(np.round(np.mean(1000./ts_diff))) if ts_diff.size else None,
+                         'has_data': {c:bool(v) for c,v in gazes.notna().any().items()}}).encode())
+    # samples of each interval
+    row_hashes = pd.util.hash_pandas_object(gazes, index=False).to_numpy()
+    frame_idx  = gazes['frame_idx'].to_numpy()
+    keys: list[str] = []
+    for interval in intervals:
+        sel = (frame_idx>=interval[0]) & ((interval[1]==-1) | (frame_idx<=interval[1]))
+        h_interval = h.copy()
+        h_interval.update(row_hashes[sel].tobytes())
+        keys.append(h_interval.hexdigest())
+    return keys
+
+
+def _get_cache_file(working_dir: pathlib.Path, key: str, suffix: str) -> pathlib.Path:
+    return working_dir / naming.fixation_cache_dir / f'{key}{suffix}'
+
+
+def restore(working_dir: str|pathlib.Path, key: str, output_stem: str|pathlib.Path, suffixes: list[str]) -> bool:
+    # copy cached files to the output location, if all requested files are cached
+    working_dir = pathlib.Path(working_dir)
+    output_stem = pathlib.Path(output_stem)
+    cache_files = [_get_cache_file(working_dir, key, s) for s in suffixes]
+    if not all(f.is_file() for f in cache_files):
+        return False
+    for f,s in zip(cache_files,suffixes):
+        shutil.copyfile(f, output_stem.parent / f'{output_stem.name}{s}')
+    return True
+
+
+def store(working_dir: str|pathlib.Path, key: str, output_stem: str|pathlib.Path, suffixes: list[str]):
+    working_dir = pathlib.Path(working_dir)
+    output_stem = pathlib.Path(output_stem)
+    (working_dir / naming.fixation_cache_dir).mkdir(exist_ok=True)
+    for s in suffixes:
+        if (f:=output_stem.parent / f'{output_stem.name}{s}').is_file():
+            shutil.copyfile(f, _get_cache_file(working_dir, key, s))
+
+
+def prune(working_dir: str|pathlib.Path, keys: set[str]):
+    # remove cached results whose key is not in keys (i.e., are no longer used)
+    cache_dir = pathlib.Path(working_dir) / naming.fixation_cache_dir
+    if not cache_dir.is_dir():
+        return
+    for f in cache_dir.iterdir():
+        if f.stem not in keys:
+            f.unlink()
+    if not any(cache_dir.iterdir()):
+        cache_dir.rmdir()
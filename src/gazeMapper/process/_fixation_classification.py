@@ -0,0 +1,118 @@
+import math
+import pathlib
+import numpy as np
+import pandas as pd
+import typing
+
+import I2MC
+import matplotlib.pyplot as plt
+
+from glassesTools import gaze_worldref
+
+
+# I2MC fixation classification of gaze on a plane, as done by glassesTools.fixation_classification.from_plane_gaze().
+# That function only writes its output to file, while here the gaze data as plotted (which I2MC interpolates in
+# place) is also returned, so that it can be stored and the plot can be made later without rerunning the
+# classification
+
+
+def classify(gazes: dict[int, list[gaze_worldref.Gaze]], interval: list[int], I2MC_settings_override: dict[str,typing.Any]|None) -> tuple[pd.DataFrame, pd.DataFrame]:
+    # returns the fixations and the gaze data to plot them on
+    # set I2MC options
+    opt = {'xres': None, 'yres': None}  # dummy values for required options
+    opt['missingx']         = math.nan
+    opt['missingy']         = math.nan
+    opt['maxdisp']          = 50        # mm
+    opt['windowtimeInterp'] = .25       # s
+    opt['maxMergeDist']     = 20        # mm
+    opt['maxMergeTime']     = 81        # ms
+    opt['minFixDur']        = 50        # ms
+
+    # sampling frequency to tell I2MC about: the known one nearest to the empirically determined sampling frequency
+    # of the whole recording. See glassesTools.fixation_classification.from_plane_gaze()
+    ts          = np.array([s.timestamp for v in gazes.values() for s in v])
+    ts_diff     = np.diff(ts)
+    ts_diff     = ts_diff[ts_diff>0]
+    rec_freq    = np.round(np.mean(1000./ts_diff))  # Hz
+    known_freqs = [30., 50., 60., 90., 120., 200.]
+    opt['freq'] = known_freqs[np.abs(known_freqs - rec_freq).argmin()]
+    if opt['freq']==200.:
+        pass    # defaults are good
+    elif opt['freq']==120.:
+        opt['downsamples']      = [2, 3, 5]
+        opt['chebyOrder']       = 7
+    elif opt['freq'] in [50., 60.]:
+        opt['downsamples']      = [2, 5]
+        opt['downsampFilter']   = False
+    else:
+        # 90 Hz, 30 Hz
+        opt['downsamples']      = [2, 3]
+        opt['downsampFilter']   = False
+
+    # apply setting overrides from caller, if any
+    if I2MC_settings_override:
+        for k in I2MC_settings_override:
+            if I2MC_settings_override[k] is not None:
+                opt[k] = I2MC_settings_override[k]
+
+    # collect data
+    has_left        = np.any(np.logical_not(np.isnan([s.gazePosPlane2DLeft               for v in gazes.values() for s in v])))
+    has_right       = np.any(np.logical_not(np.isnan([s.gazePosPlane2DRight              for v in gazes.values() for s in v])))
+    has_ray         = np.any(np.logical_not(np.isnan([s.gazePosPlane2D_vidPos_ray        for v in gazes.values() for s in v])))
+    has_homography  = np.any(np.logical_not(np.isnan([s.gazePosPlane2D_vidPos_homography for v in gazes.values() for s in v])))
+    if not has_ray and not has_homography:
+        raise RuntimeError('No data available to process')
+    samples = [s for k,v in gazes.items() if k>=interval[0] and (interval[1]==-1 or k<=interval[1]) for s in v]
+    # NB: classification uses the world-based data if available, but plotting uses the ray (if available) or
+    # homography data, as that corresponds to the gaze visualization provided in the software
+    if has_ray:
+        vid_pos = np.array([s.gazePosPlane2D_vidPos_ray for s in samples]).reshape(-1,2)
+    else:
+        vid_pos = np.array([s.gazePosPlane2D_vidPos_homography for s in samples]).reshape(-1,2)
+
+    data = {}
+    data['time'] = np.array([s.timestamp for s in samples])
+    need_recalc_fix = False
+    if has_left and has_right:
+        # prefer using separate left and right eye signals, if available. Better I2MC robustness
+        data['L_X']  = np.array([s.gazePosPlane2DLeft[0]  for s in samples])
+        data['L_Y']  = np.array([s.gazePosPlane2DLeft[1]  for s in samples])
+        data['R_X']  = np.array([s.gazePosPlane2DRight[0] for s in samples])
+        data['R_Y']  = np.array([s.gazePosPlane2DRight[1] for s in samples])
+        need_recalc_fix = True
+    else:
+        data['average_X']  = vid_pos[:,0]
+        data['average_Y']  = vid_pos[:,1]
+
+    # run event classification to find fixations
+    fixations, data_I2MC, par_I2MC = I2MC.I2MC(data, opt, False)
+
+    # replace gaze data used for classification with gaze position on scene video, and recalculate fixation positions
+    # based on that data
+    if need_recalc_fix:
+        data_I2MC = data_I2MC.drop(columns=['L_X','L_Y','R_X','R_Y'],errors='ignore')
+        data_I2MC['average_X'] = vid_pos[:,0]
+        data_I2MC['average_Y'] = vid_pos[:,1]
+        fixations = I2MC.get_fixations(data_I2MC['finalweights'].array, data_I2MC['time'].array, data_I2MC['average_X'], data_I2MC['average_Y'], data_I2MC['average_missing'], par_I2MC)
+
+    return pd.DataFrame(fixations), data_I2MC[['time','average_X','average_Y']]
+
+
+def write_fixations(fixations: pd.DataFrame, file: str|pathlib.Path):
+    fixations.to_csv(file, mode='w', na_rep='nan', sep='\t', index=False, float_format='%.3f')
+
+
+def write_plot_data(plot_data: pd.DataFrame, file: str|pathlib.Path):
+    plot_data.to_csv(file, mode='w', na_rep='nan', sep='\t', index=False)
+
+
+def read_file(file: str|pathlib.Path) -> pd.DataFrame:
+    return pd.read_csv(file, delimiter='\t', index_col=False)
+
+
+def plot(fixations: pd.DataFrame, plot_data: pd.DataFrame, plot_limits: list[list[float]]|None, file: str|pathlib.Path):
+    # timeseries plot of gaze data with fixations
+    f = I2MC.plot.data_and_fixations(plot_data, fixations, fix_as_line=True, unit='mm', res=plot_limits)
+    plt.gca().invert_yaxis()
+    f.savefig(str(file))
+    plt.close(f)
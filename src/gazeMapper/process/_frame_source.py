@@ -0,0 +1,46 @@
+import numpy as np
+import typing
+
+from glassesTools import pose
+
+
+class FrameSource:
+    # serves a video's frames (and the output of processing them with the pose estimator) for a known sequence of
+    # requested frame indices, e.g. the frames of a recording corresponding to each frame of the reference video. The
+    # video is only read forward, and each frame is decoded and processed once. Frames that are requested again within
+    # the lookahead window (e.g. because the video has a lower frame rate than the reference), or that are skipped now
+    # but requested within the window, are kept in a buffer. Since the caller draws on the frames it gets, buffered
+    # frames are served as a copy, except for the last request for that frame.
+    # If only every nth request is made, set stride to n so that frames for skipped requests are not read
+    def __init__(self, estimator: pose.Estimator, requests: list[int], lookahead: int = 8, stride: int = 1):
+        self._estimator = estimator
+        self._requests  = requests
+        self._lookahead = lookahead
+        self._stride    = stride
+        self._buffer: dict[int, tuple] = {}
+        self._last_read = -1
+
+    @staticmethod
+    def _copy(output: tuple) -> tuple:
+        frame_output = output[4]
+        return *output[:4], (None if frame_output[0] is None else np.copy(frame_output[0]), *frame_output[1:])
+
+    def _read(self, fr_idx: int) -> tuple:
+        self._last_read = max(self._last_read, fr_idx)
+        return self._estimator.process_one_frame(fr_idx)
+
+    def get(self, request_idx: int) -> tuple[pose.Status, dict[str, pose.Pose], dict[typing.Any, typing.Any], dict[str, list[int, typing.Any]], tuple[np.ndarray, int, float, dict[str, typing.Any]]]:
+        fr_idx  = self._requests[request_idx]
+        later   = set(self._requests[request_idx+self._stride:request_idx+1+self._lookahead*self._stride:self._stride])
+        if fr_idx not in self._buffer:
+            # read forward to the wanted frame, buffering frames on the way that will be requested soon
+            for i in sorted(i for i in later if self._last_read<i<fr_idx):
+                self._buffer[i] = self._read(i)
+            self._buffer[fr_idx] = self._read(fr_idx)
+        output = self._buffer[fr_idx]
+        if fr_idx in later:
+            output = self._copy(output)
+        # remove frames from buffer that are no longer needed
+        for i in [i for i in self._buffer if i not in later]:
+            del self._buffer[i]
+        return output
@@ -0,0 +1,115 @@
+import pathlib
+import numpy as np
+import pandas as pd
+import polars as pl
+from collections import defaultdict
+
+from glassesTools import data_files, gaze_headref, naming as gt_naming
+
+from . import _utils
+from .. import naming
+
+
+# timestamps and frame indices determined by synchronization (VOR sync of gaze to the scene camera, and sync
+# to the reference recording) are not written into the gaze data file, but into small sidecar files with one
+# row per row of the gaze data file. These are joined with the gaze data when reading it.
+sync_suffixes = ['VOR', 'ref']
+
+
+def get_sync_columns_file(working_dir: str|pathlib.Path, suffix: str) -> pathlib.Path:
+    return pathlib.Path(working_dir) / f'{naming.gaze_sync_columns_prefix}{suffix}.tsv'
+
+
+def write_sync_columns(working_dir: str|pathlib.Path, suffix: str, ts: np.ndarray, fridxs: np.ndarray):
+    # use polars as that library saves to file waaay faster
+    df = pl.DataFrame({f'timestamp_{suffix}': ts, f'frame_idx_{suffix}': fridxs})
+    df.write_csv(get_sync_columns_file(working_dir, suffix), separator='\t', null_value='nan', float_precision=8)
+
+
+def _check_sync_columns(sync_file: pathlib.Path, n_sync_rows: int, n_rows: int):
+    # a synchronization file that does not have a row for each row of the gaze data file is not for the current gaze
+    # data, e.g. because the recording was imported again after synchronization
+    if n_sync_rows!=n_rows:
+        raise RuntimeError(f'The synchronization file {sync_file} does not match the gaze data file for this recording ({n_sync_rows} rows instead of {n_rows}). Rerun the synchronization to fix this.')
+
+
+def read_timestamps(working_dir: str|pathlib.Path, ts_column_suffixes: list[str]) -> np.ndarray:
+    # read only the timestamp column we need, using the first of the suffixes that is available
+    working_dir = pathlib.Path(working_dir)
+    gaze_file   = working_dir / gt_naming.gaze_data_fname
+    gaze_cols   = pd.read_csv(gaze_file, delimiter='\t', index_col=False, nrows=0).columns
+    for suf in ts_column_suffixes:
+        col = f'timestamp_{suf}' if suf else 'timestamp'
+        if suf and (sync_file:=get_sync_columns_file(working_dir, suf)).is_file():
+            ts = pd.read_csv(sync_file, delimiter='\t', index_col=False, usecols=[col])[col].to_numpy()
+            _check_sync_columns(sync_file, len(ts), pl.scan_csv(gaze_file, separator='\t').select(pl.len()).collect().item())
+            return ts
+        if col in gaze_cols:
+            # NB: gaze data files synchronized with older versions of gazeMapper have these columns embedded
+            return pd.read_csv(gaze_file, delimiter='\t', index_col=False, usecols=[col])[col].to_numpy()
+    raise ValueError("None of the specified suffixes were found, can't continue")
+
+
+def read_dataframe(working_dir: str|pathlib.Path, dtype: dict|None=None) -> pd.DataFrame:
+    # read the gaze data file, and join in any available synchronization columns
+    working_dir = pathlib.Path(working_dir)
+    df = pd.read_csv(working_dir / gt_naming.gaze_data_fname, delimiter='\t', index_col=False, dtype=dtype)
+    for suf in sync_suffixes:
+        sync_file = get_sync_columns_file(working_dir, suf)
+        if not sync_file.is_file():
+            continue
+        sync_cols = pd.read_csv(sync_file, delimiter='\t', index_col=False, dtype=dtype)
+        _check_sync_columns(sync_file, len(sync_cols), len(df))
+        df = _utils.insert_ts_fridx_in_df(df, gaze_headref.Gaze, suf, sync_cols[f'timestamp_{suf}'].to_numpy(), sync_cols[f'frame_idx_{suf}'].to_numpy())
+    return df
+
+
+def scan_dataframe(working_dir: str|pathlib.Path) -> pl.LazyFrame:
+    # lazy polars equivalent of read_dataframe(), reading all columns as float except for the frame indices
+    working_dir = pathlib.Path(working_dir)
+    df = _utils.scan_tsv(working_dir / gt_naming.gaze_data_fname, gaze_headref.Gaze._non_float)
+    for suf in sync_suffixes:
+        sync_file = get_sync_columns_file(working_dir, suf)
+        if not sync_file.is_file():
+            continue
+        sync_cols = _utils.scan_tsv(sync_file, gaze_headref.Gaze._non_float)
+        n_rows, n_sync_rows = (f.select(pl.len()).collect().item() for f in (df, sync_cols))
+        _check_sync_columns(sync_file, n_sync_rows, n_rows)
+        cols = _utils.insert_ts_fridx_in_columns(df.collect_schema().names(), gaze_headref.Gaze, suf)
+        df = pl.concat([df.drop(sync_cols.collect_schema().names(), strict=False), sync_cols], how='horizontal').select(cols)
+    return df
+
+def read_dict_from_file(working_dir: str|pathlib.Path, episodes: list[list[int]]|None=None, ts_column_suffixes: list[str]|None=None) -> tuple[dict[int,list[gaze_headref.Gaze]], int]:
+    # equivalent to gaze_headref.read_dict_from_file(), but with synchronization columns joined in
+    df = read_dataframe(working_dir, defaultdict(lambda: float, **gaze_headref.Gaze._non_float))
+    if episodes:
+        sel = np.zeros(len(df), dtype='bool')
+        for e in episodes:
+            sel |= (df['frame_idx'] >= e[0]) & (df['frame_idx'] <= e[1])
+        df = df[sel]
+
+    # group columns into numpy arrays and keep only the columns we want
+    cols_compressed = gaze_headref.Gaze._columns_compressed
+    for c,ac in zip(cols_compressed,data_files.uncompress_columns(cols_compressed)):
+        if len(ac)>1 and any([a in df.columns for a in ac]):
+            df[c] = [x for x in df[ac].values]
+    df = df[[c for c in cols_compressed if c in df.columns]].copy()
+
+    # keep a copy of the original timestamp and frame_idx, and put requested one in the normal columns
+    df['frame_idx_ori'] = df['frame_idx']
+    df['timestamp_ori'] = df['timestamp']
+    if ts_column_suffixes:
+        for suf in ts_column_suffixes: # these are in order of preference
+            if (field:=f'frame_idx_{suf}' if suf else 'frame_idx') not in df.columns:
+                continue
+            df['frame_idx'] = df[field]
+            df['timestamp'] = df[f'timestamp_{suf}' if suf else 'timestamp']
+            break
+        else:
+            raise ValueError("None of the specified suffixes were found, can't continue")
+
+    # organize into dict by frame index
+    gazes: dict[int,list[gaze_headref.Gaze]] = {}
+    for k,kwargs in zip(df['frame_idx'].values,df.to_dict(orient='records')):
+        gazes.setdefault(k, []).append(gaze_headref.Gaze(**kwargs))
+    return gazes, df['frame_idx'].max()
@@ -0,0 +1,225 @@
+import pathlib
+import numpy as np
+import pandas as pd
+from collections import defaultdict
+
+from glassesTools import marker as gt_marker, validation
+
+from .. import naming
+
+
+# marker presence for a set of markers is represented as a frames x markers boolean matrix, with one row per
+# frame from the first to the last frame in which any of the markers was detected. This allows determining
+# stretches of marker presence for all markers at once, instead of per marker through pandas.
+class Presence:
+    def __init__(self, markers: list[gt_marker.MarkerID], first_frame: int, presence: np.ndarray):
+        self.markers    = markers
+        self.first_frame= first_frame
+        self.presence   = presence  # frames x markers
+
+    def select(self, markers: list[gt_marker.MarkerID]) -> 'Presence':
+        return Presence(markers, self.first_frame, self.presence[:, [self.markers.index(m) for m in markers]])
+
+    def get_frames(self, m: gt_marker.MarkerID) -> np.ndarray:
+        # frames during which the marker was visible
+        return np.nonzero(self.presence[:, self.markers.index(m)])[0]+self.first_frame
+
+
+# DETECT_MARKERS also stores a presence index: the presence matrix for all detected markers, bit-packed along
+# the frame axis, along with the marker IDs of its columns. This is much quicker to read than the marker files
+def write_index(working_dir: str|pathlib.Path, markers: dict[gt_marker.MarkerID, list[gt_marker.Pose]]):
+    presence = make_presence(list(markers), [np.array([p.frame_idx for p in markers[m]], dtype='int64') for m in markers])
+    np.savez(pathlib.Path(working_dir) / naming.marker_presence_file,
+             marker_ids=np.array([(m.m_id, m.aruco_dict_id) for m in presence.markers], dtype='int64').reshape(-1,2),
+             first_frame=presence.first_frame,
+             n_frames=presence.presence.shape[0],
+             presence=np.packbits(presence.presence, axis=0))
+
+
+def read_index(working_dir: str|pathlib.Path) -> Presence|None:
+    if not (index_file:=pathlib.Path(working_dir) / naming.marker_presence_file).is_file():
+        return None
+    with np.load(index_file) as f:
+        markers  = [gt_marker.MarkerID(int(i), int(d)) for i,d in f['marker_ids']]
+        presence = np.unpackbits(f['presence'], axis=0, count=int(f['n_frames'])).astype('bool')
+        return Presence(markers, int(f['first_frame']), presence)
+
+
+def _read_current_index(markers: list[gt_marker.MarkerID], working_dir: str|pathlib.Path) -> Presence|None:
+    # the presence index, if available, up to date and containing all requested markers. The index is stale if any
+    # of the marker detection files was written after it (e.g. markers detected again with an older version of gazeMapper)
+    index_file = pathlib.Path(working_dir) / naming.marker_presence_file
+    if not index_file.is_file():
+        return None
+    index_time = index_file.stat().st_mtime
+    for m in markers:
+        if (f:=gt_marker.get_file_name(m.m_id, m.aruco_dict_id, working_dir)).is_file() and f.stat().st_mtime>index_time:
+            return None
+    index = read_index(working_dir)
+    if index is None or not all(m in index.markers for m in markers):
+        return None
+    return index.select(markers)
+
+
+def read(markers: list[gt_marker.MarkerID], working_dir: str|pathlib.Path) -> Presence:
+    # read from the presence index if available, else fall back to the marker detection files (e.g. for
+    # recordings processed with an older version of gazeMapper)
+    if (presence:=_read_current_index(markers, working_dir)) is not None:
+        return presence
+    return read_from_files(markers, working_dir)
+
+
+def read_validation_targets(validation_plane: validation.Plane, working_dir: str|pathlib.Path, episode_name: str, missing_ok=False) -> tuple[Presence, dict[int, list[gt_marker.MarkerID]]]:
+    # presence of the targets of a dynamic validation plane. A target is present when any of its markers is. Like
+    # validation.dynamic.get_marker_observations(), which is used as fallback if the presence index is not available,
+    # only targets for which at least one marker was observed are included
+    markers_per_target: dict[int, list[gt_marker.MarkerID]] = defaultdict(list)
+    for m in validation_plane.dynamic_markers:
+        markers_per_target[validation_plane.dynamic_markers[m][0]].append(gt_marker.MarkerID(m, validation_plane.aruco_dict_id))
+    markers_per_target = dict(markers_per_target)
+    all_markers = [m for ms in markers_per_target.values() for m in ms]
+    if (presence:=_read_current_index(all_markers, working_dir)) is None:
+        observations, markers_per_target = validation.dynamic.get_marker_observations(validation_plane, working_dir, episode_name, missing_ok=missing_ok)
+        targets = list(observations)
+        return make_presence(targets, [mo.index[mo['marker_presence'].to_numpy(dtype='bool')].to_numpy() for mo in observations.values()]), markers_per_target
+
+    # NB: a marker that was never detected has no detection file
+    targets: list[int] = []
+    columns: list[np.ndarray] = []
+    for t,ms in markers_per_target.items():
+        col = presence.presence[:, [all_markers.index(m) for m in ms]].any(axis=1)
+        if col.any():
+            targets.append(t)
+            columns.append(col)
+        elif not missing_ok:
+            missing_str = '\n- '.join([gt_marker.get_file_name(m.m_id, m.aruco_dict_id, None) for m in ms])
+            raise FileNotFoundError(f'None of the marker files for target {t} were found:\n- {missing_str}')
+    columns = np.stack(columns, axis=1) if columns else np.zeros((presence.presence.shape[0], 0), dtype='bool')
+    # trim to the frames during which any of the targets is present
+    present = np.nonzero(columns.any(axis=1))[0]
+    if not present.size:
+        return Presence(targets, 0, np.zeros((0, len(targets)), dtype='bool')), markers_per_target
+    return Presence(targets, presence.first_frame+present[0], columns[present[0]:present[-1]+1]), markers_per_target
+
+
+def to_observations_per_target(presence: Presence) -> dict[int, pd.DataFrame]:
+    # marker observations per target in the format produced by validation.dynamic.get_marker_observations(), for use
+    # with validation.assign_intervals.dynamic_markers(): frames during which the target is present
+    return {t: pd.DataFrame({'marker_presence': True}, index=pd.Index(presence.get_frames(t), name='frame_idx')) for t in presence.markers}
+
+
+def read_from_files(markers: list[gt_marker.MarkerID], working_dir: str|pathlib.Path) -> Presence:
+    # NB: equivalent to gt_marker.code_for_presence(allow_failed=True) followed by gt_marker.expand_detection(fill_value=False):
+    # a marker is present in each frame for which it has a row in the marker detection file
+    frame_idxs = [pd.read_csv(gt_marker.get_file_name(m.m_id, m.aruco_dict_id, working_dir), sep='\t', usecols=['frame_idx'], dtype={'frame_idx': int})['frame_idx'].to_numpy() for m in markers]
+    return make_presence(markers, frame_idxs)
+
+
+def make_presence(markers: list[gt_marker.MarkerID], frame_idxs: list[np.ndarray]) -> Presence:
+    # NB: columns can be keyed by something else than marker IDs, e.g. validation targets
+    if not any(f.size for f in frame_idxs):
+        return Presence(markers, 0, np.zeros((0, len(markers)), dtype='bool'))
+    first_frame = min(f.min() for f in frame_idxs if f.size)
+    last_frame  = max(f.max() for f in frame_idxs if f.size)
+    presence    = np.zeros((last_frame-first_frame+1, len(markers)), dtype='bool')
+    for c,f in enumerate(frame_idxs):
+        presence[f-first_frame, c] = True
+    return Presence(markers, first_frame, presence)
+
+
+def get_appearance_starts_ends(presence: Presence, max_gap_duration: int, min_duration: int) -> tuple[dict[gt_marker.MarkerID, np.ndarray], dict[gt_marker.MarkerID, np.ndarray]]:
+    # vectorized equivalent of gt_marker.get_appearance_starts_ends() for all markers at once. Returns, per marker,
+    # the first and last frame of each stretch of marker presence
+    last_frame = presence.first_frame+presence.presence.shape[0]-1
+    return get_appearance_starts_ends_in_episodes(presence, [(presence.first_frame, last_frame)], max_gap_duration, min_duration)[0]
+
+
+def get_appearance_starts_ends_in_episodes(presence: Presence, episodes: list[tuple[int,int]], max_gap_duration: int, min_duration: int) -> list[tuple[dict[gt_marker.MarkerID, np.ndarray], dict[gt_marker.MarkerID, np.ndarray]]]:
+    # as get_appearance_starts_ends(), but separately for each episode (first and last frame, inclusive), as if
+    # the presence signal only contained the frames of the episode. All episodes are processed in one pass
+    n_markers = presence.presence.shape[1]
+    # stack the frames of all episodes, with a row of False in front of each episode and at the end
+    # so that every run has a start and an end that are within the same episode
+    frames  = [np.arange(max(e[0],presence.first_frame), min(e[1],presence.first_frame+presence.presence.shape[0]-1)+1) for e in episodes]
+    offsets = np.cumsum([0]+[f.size+1 for f in frames])
+    stacked = np.zeros((offsets[-1]+1, n_markers), dtype='int8')
+    for f,o in zip(frames,offsets):
+        stacked[o+1:o+1+f.size] = presence.presence[f-presence.first_frame]
+    frames  = np.concatenate([np.concatenate(([-1],f)) for f in frames]+[[-1]]).astype('int64')
+    # find edges. NB: work on the transpose so that the edges come out sorted by marker, then by frame
+    # NB: positions are of the first present frame (starts) and the first frame no longer present (ends)
+    d = np.diff(stacked.T, axis=1)
+    s_col, starts = np.nonzero(d== 1)
+    e_col, ends   = np.nonzero(d==-1)
+    starts += 1
+    ends   += 1
+    ep      = np.searchsorted(offsets, starts, side='right')-1
+    # fill gaps in marker detection (only between runs of the same marker in the same episode)
+    fill   = (s_col[1:]==e_col[:-1]) & (ep[1:]==ep[:-1]) & (starts[1:]-ends[:-1]<=max_gap_duration)
+    keep_s = np.ones(starts.shape, dtype='bool')
+    keep_e = np.ones(ends  .shape, dtype='bool')
+    keep_s[1:]  = ~fill
+    keep_e[:-1] = ~fill
+    s_col, starts, ep = s_col[keep_s], starts[keep_s], ep[keep_s]
+    ends   = ends[keep_e]
+    # remove too short
+    long_enough = ends-starts>=min_duration
+    s_col, starts, ends, ep = s_col[long_enough], starts[long_enough], ends[long_enough], ep[long_enough]
+    # turn into frame_idx values and split per episode and marker
+    # NB: -1 so that ends point to last frame during which marker was last seen
+    starts = frames[starts]
+    ends   = frames[ends-1]
+    order  = np.lexsort((starts, s_col, ep))
+    s_col, starts, ends, ep = s_col[order], starts[order], ends[order], ep[order]
+    splits = np.searchsorted(ep*n_markers+s_col, np.arange(1, len(episodes)*n_markers))
+    starts = np.split(starts, splits)
+    ends   = np.split(ends  , splits)
+    return [({m:starts[e*n_markers+c] for c,m in enumerate(presence.markers)}, {m:ends[e*n_markers+c] for c,m in enumerate(presence.markers)}) for e in range(len(episodes))]
+
+
+def get_sequence_interval(starts: dict[gt_marker.MarkerID, np.ndarray], ends: dict[gt_marker.MarkerID, np.ndarray], pattern: list[gt_marker.MarkerID], max_intermarker_gap_duration: int, side='start') -> np.ndarray:
+    # vectorized equivalent of gt_marker.get_sequence_interval(): find marker pattern (sequence of markers
+    # following in right order with gap no longer than max_intermarker_gap_duration). For each appearance of
+    # the first marker, the next marker in the sequence is the first to appear at or after the previous one
+    # disappears (smallest non-negative gap)
+    end_idx = np.arange(len(ends[pattern[0]]))
+    valid   = np.ones(end_idx.shape, dtype='bool')
+    for j in range(len(pattern)-1):
+        end     = ends[pattern[j]][end_idx[valid]]
+        nxt     = starts[pattern[j+1]]
+        idx     = np.searchsorted(nxt, end, side='left')
+        ok      = idx<len(nxt)
+        ok[ok]  = nxt[idx[ok]]-end[ok]<=max_intermarker_gap_duration
+        vi      = np.nonzero(valid)[0]
+        valid[vi[~ok]] = False
+        end_idx[vi[ok]]= idx[ok]
+    if side=='start':
+        return starts[pattern[0]][valid]
+    return ends[pattern[-1]][end_idx[valid]]
+
+
+def match_interval_starts_ends(starts: np.ndarray, ends: np.ndarray) -> list[tuple[int,int]]:
+    # match interval starts and ends: run through starts and find latest start that is before first end
+    # (discard ends that are before the start). Consumed starts and ends are skipped using searchsorted,
+    # which assumes starts and ends are sorted
+    # NB: intervals start the frame *after* the marker is last observed, and intervals end the frame *before* the marker is first observed
+    intervals: list[tuple[int,int]] = []
+    s_idx = 0
+    e_idx = 0
+    while s_idx<len(starts):
+        # remove ends before the current start
+        e_idx = max(e_idx, np.searchsorted(ends, starts[s_idx], side='left'))
+        if e_idx > len(ends)-1:
+            # we're out of ends, done
+            break
+        # for all starts in contention, find the last one that is before the next end (first of these if there are several)
+        s_last = np.searchsorted(starts, ends[e_idx], side='left')-1
+        if s_last<s_idx:
+            s_last = s_idx
+        else:
+            s_last = max(s_idx, np.searchsorted(starts, starts[s_last], side='left'))
+        intervals.append((starts[s_last]+1, ends[e_idx]-1))
+        # these are consumed
+        s_idx = s_last+1
+        e_idx+= 1
+    return intervals
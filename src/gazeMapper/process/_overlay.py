@@ -0,0 +1,56 @@
+import functools
+import cv2
+import numpy as np
+
+
+@functools.lru_cache(maxsize=4096)
+def get_text_size(text: str, font_face: int, font_scale: float, thickness: int) -> tuple[tuple[int,int], int]:
+    # glyph metrics per font and scale, cached as the same texts are measured for many frames
+    return cv2.getTextSize(text, font_face, font_scale, thickness)
+
+
+class TextBoxCache:
+    # draws texts on a filled box. Boxes that are the same across many frames (e.g. episode labels) are rendered once
+    # into a patch along with a mask of the drawn pixels, keyed by their content, and are then copied onto frames.
+    # NB: drawing is not anti-aliased, so copying the masked patch gives output identical to drawing the box directly
+    def __init__(self, font_face: int, font_scale: float, thickness: int, margin: int, pad: int = 10):
+        self.font_face  = font_face
+        self.font_scale = font_scale
+        self.thickness  = thickness
+        self.margin     = margin
+        self._pad       = pad   # space around box in patch, for text strokes extending beyond the box
+        self._cache: dict[tuple, tuple[np.ndarray, np.ndarray]] = {}  # patch and uint8 mask (as cv2.copyTo needs)
+
+    def get_text_size(self, text: str) -> tuple[tuple[int,int], int]:
+        return get_text_size(text, self.font_face, self.font_scale, self.thickness)
+
+    def _draw(self, img: np.ndarray, text: str, x: int, y: int, width: int, height: int, box_color, text_color):
+        cv2.rectangle(img, (x, y), (x+width, y-height), box_color, -1)
+        cv2.putText(img, text, (x+self.margin, y-self.margin), self.font_face, self.font_scale, text_color, self.thickness)
+
+    def draw(self, img: np.ndarray, text: str, x: int, text_height: int, baseline: int, box_color: tuple[int,int,int], text_color: tuple[int,int,int], use_cache=True) -> int:
+        # draws box with its bottom left corner at x at the bottom of the image, returns the width of the box
+        width  = self.get_text_size(text)[0][0]+self.margin
+        height = text_height+baseline+self.margin
+        if not use_cache:
+            self._draw(img, text, x, img.shape[0], width, height, box_color, text_color)
+            return width
+
+        key = (text, text_height, baseline, box_color, text_color)
+        if key not in self._cache:
+            patch = np.zeros((height+2*self._pad, width+2*self._pad, 3), np.uint8)
+            mask  = np.zeros(patch.shape[:2], np.uint8)
+            self._draw(patch, text, self._pad, patch.shape[0]-self._pad, width, height, box_color, text_color)
+            self._draw(mask , text, self._pad, patch.shape[0]-self._pad, width, height, 255, 255)
+            self._cache[key] = (patch, mask)
+        patch, mask = self._cache[key]
+
+        # copy drawn pixels onto image, clipping patch to image
+        y0, x0 = img.shape[0]-patch.shape[0]+self._pad, x-self._pad
+        py0, px0 = max(0, -y0), max(0, -x0)
+        py1, px1 = min(patch.shape[0], img.shape[0]-y0), min(patch.shape[1], img.shape[1]-x0)
+        if py1>py0 and px1>px0:
+            # NB: region is a view into img, so copyTo draws in place
+            region = img[y0+py0:y0+py1, x0+px0:x0+px1]
+            cv2.copyTo(patch[py0:py1, px0:px1], mask[py0:py1, px0:px1], region)
+        return width
@@ -1,26 +1,78 @@
+import pathlib
 import pandas as pd
+import polars as pl
 import numpy as np
-from typing import Any
+import concurrent.futures
+import multiprocessing
+from typing import Any, Callable
 
 from glassesTools import data_files
 
 
-def insert_ts_fridx_in_df(df: pd.DataFrame, object: Any, suffix: str, ts: np.ndarray, fridxs: np.ndarray):
+def _get_ts_fridx_insert_positions(columns: list[str], object: Any, suffix: str) -> list[tuple[str,int]]:
     # figure out where
-    cols = [c for cs in data_files.uncompress_columns(object._columns_compressed) for c in cs if c in df.columns or c in [f'timestamp_{suffix}',f'frame_idx_{suffix}']]
+    cols = [c for cs in data_files.uncompress_columns(object._columns_compressed) for c in cs if c in columns or c in [f'timestamp_{suffix}',f'frame_idx_{suffix}']]
     ts_idx = cols.index(f'timestamp_{suffix}')
     fr_idx = cols.index(f'frame_idx_{suffix}')
     # figure out what order
     cols = ['timestamp','frame_idx']
     if ts_idx>fr_idx:
         cols = [cols[1], cols[0]]
-    # insert
-    for c in cols:
+    return [(c, ts_idx if c=='timestamp' else fr_idx) for c in cols]
+
+
+def insert_ts_fridx_in_df(df: pd.DataFrame, object: Any, suffix: str, ts: np.ndarray, fridxs: np.ndarray):
+    for c,i in _get_ts_fridx_insert_positions(df.columns, object, suffix):
         v = ts if c=='timestamp' else fridxs
-        i = ts_idx if c=='timestamp' else fr_idx
         if f'{c}_{suffix}' in df.columns:
             df[f'{c}_{suffix}'] = v
         else:
             df.insert(i, f'{c}_{suffix}', v)
 
     return df
+
+
+def insert_ts_fridx_in_columns(columns: list[str], object: Any, suffix: str) -> list[str]:
+    # the column order that insert_ts_fridx_in_df() would yield
+    columns = list(columns)
+    for c,i in _get_ts_fridx_insert_positions(columns, object, suffix):
+        if f'{c}_{suffix}' not in columns:
+            columns.insert(i, f'{c}_{suffix}')
+    return columns
+
+
+def scan_tsv(file: str|pathlib.Path, non_float: dict[str,type]) -> pl.LazyFrame:
+    # lazily read a tsv file, with all columns as float except the indicated ones, which are integer. This is
+    # the polars equivalent of pd.read_csv(file, sep='\t', dtype=defaultdict(lambda: float, **non_float))
+    cols = pl.scan_csv(file, separator='\t').collect_schema().names()
+    return pl.scan_csv(file, separator='\t', schema={c: pl.Int64 if c in non_float else pl.Float64 for c in cols})
+
+
+def run_jobs(fun: Callable[..., Any], jobs: list[tuple], num_workers: int, done_callback: Callable[[int, Any], None]|None = None, initializer: Callable[[], None]|None = None) -> list[Any]:
+    # run fun for each set of arguments in jobs, in parallel using a pool of num_workers processes if possible.
+    # Results are returned in the order of jobs, and done_callback (if provided) is also called in this order.
+    # initializer (if provided) is called once in each worker process, it is not called when jobs are run in this process.
+    # NB: daemonic processes (such as the workers used by the GUI) cannot have children, so then jobs are run one at a time
+    num_workers = min(num_workers, len(jobs))
+    if num_workers<=1 or multiprocessing.current_process().daemon:
+        results = []
+        for i,args in enumerate(jobs):
+            results.append(fun(*args))
+            if done_callback:
+                done_callback(i, results[-1])
+        return results
+
+    with concurrent.futures.ProcessPoolExecutor(num_workers, mp_context=multiprocessing.get_context("spawn"), initializer=initializer) as executor:
+        futures = [executor.submit(fun, *args) for args in jobs]
+        try:
+            results = []
+            for i,f in enumerate(futures):
+                results.append(f.result())
+                if done_callback:
+                    done_callback(i, results[-1])
+        except BaseException:
+            # don't wait for the remaining jobs to complete
+            for f in futures:
+                f.cancel()
+            raise
+        return results
@@ -0,0 +1,83 @@
+import pathlib
+import numpy as np
+import queue
+import threading
+from typing import Any
+
+from ffpyplayer.writer import MediaWriter
+from ffpyplayer.pic import Image
+
+from . import _ffmpeg
+
+
+class QueuedVideoWriter:
+    # encodes frames on a separate thread, fed through a bounded queue, so that encoding can occur at the same time
+    # as decoding and drawing of the next frames. The queue size bounds how many frames can be waiting to be encoded.
+    # Errors that occur during encoding are raised from the next call to write_frame() or close().
+    # Submitted frames are copied into a pool of preallocated buffers, which are returned to the pool once encoded. So
+    # the caller is free to change or reuse a frame once it is submitted (frames returned by a pose estimator may be
+    # served again, e.g. for repeated frames), while in steady state no memory is allocated per frame.
+    # If extra_args are provided, frames are encoded by piping them to ffmpeg, which is given these arguments (see
+    # _ffmpeg.Writer), instead of by ffpyplayer
+    def __init__(self, file: str|pathlib.Path, out_opts: dict[str, Any], queue_size: int, lib_opts: dict[str, str]|None = None, extra_args: list[str]|None = None):
+        self._writer: MediaWriter|_ffmpeg.Writer
+        if extra_args is None:
+            self._writer = MediaWriter(str(file), [out_opts], lib_opts=lib_opts or {}, overwrite=True)
+        else:
+            self._writer = _ffmpeg.Writer(file, out_opts, lib_opts or {}, extra_args)
+        self._pix_fmt= out_opts['pix_fmt_in']
+        self._queue: queue.Queue[tuple[bytearray, np.ndarray, float]|None] = queue.Queue(maxsize=queue_size)
+        # one buffer for each queue slot, plus the one being encoded. Buffers are allocated on first use. Each buffer
+        # is a bytearray (which ffpyplayer accepts without copying) along with an array view of it to copy frames into
+        self._pool_size = queue_size+1
+        self._n_buffers = 0
+        self._free: queue.Queue[tuple[bytearray, np.ndarray]] = queue.Queue()
+        self._exc: BaseException|None = None
+        self._thread = threading.Thread(target=self._encode, daemon=True)
+        self._thread.start()
+
+    def _encode(self):
+        while (item:=self._queue.get()) is not None:
+            buf, frame, pts = item
+            # NB: if encoding failed, remaining frames are discarded so that the producer does not block
+            if self._exc is None:
+                try:
+                    # the image uses the buffer's memory directly, no copy is made
+                    img = Image(plane_buffers=[buf], pix_fmt=self._pix_fmt, size=(frame.shape[1], frame.shape[0]))
+                    self._writer.write_frame(img=img, pts=pts)
+                except BaseException as e:
+                    self._exc = e
+            # encoder is done with the buffer, make it available again
+            self._free.put((buf, frame))
+
+    def _raise_if_failed(self):
+        if self._exc is not None:
+            raise self._exc
+
+    @staticmethod
+    def _make_buffer(frame: np.ndarray) -> tuple[bytearray, np.ndarray]:
+        buf = bytearray(frame.nbytes)
+        return buf, np.frombuffer(buf, dtype=frame.dtype).reshape(frame.shape)
+
+    def _get_buffer(self, frame: np.ndarray) -> tuple[bytearray, np.ndarray]:
+        if self._free.empty() and self._n_buffers<self._pool_size:
+            self._n_buffers += 1
+            return self._make_buffer(frame)
+        buf, view = self._free.get()    # NB: blocks until the encoder has a buffer available
+        if view.shape!=frame.shape or view.dtype!=frame.dtype:
+            buf, view = self._make_buffer(frame)
+        return buf, view
+
+    def write_frame(self, frame: np.ndarray, pts: float):
+        self._raise_if_failed()
+        buf, view = self._get_buffer(frame)
+        np.copyto(view, frame)
+        self._queue.put((buf, view, pts))
+
+    def close(self):
+        # wait for all queued frames to be encoded, then close the file
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        self._writer.close()
+        self._raise_if_failed()
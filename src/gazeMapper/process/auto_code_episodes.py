@@ -5,8 +5,9 @@ import shutil
 import copy
 import warnings
 
-from glassesTools import annotation, marker as gt_marker, naming as gt_naming, process_pool, timestamps, validation
+from glassesTools import annotation, marker as gt_marker, naming as gt_naming, process_pool, timestamps
 
+from . import _marker_presence
 from .. import config, episode, naming, plane, process, session
 
 
@@ -43,52 +44,22 @@ def run(working_dir: str|pathlib.Path, config_dir: str|pathlib.Path|None = None,
             file_missing = [gt_marker.get_file_name(m.m_id, m.aruco_dict_id, None) for m,miss in zip(all_marker_ids,file_missing) if miss]
             missing_str  = '\n- '.join(file_missing)
             raise FileNotFoundError(f'The following marker files were not found:\n- {missing_str}')
-        markers = {m: gt_marker.read_dataframe_from_file(m.m_id, m.aruco_dict_id, working_dir) for m in all_marker_ids}
-        # recode so we have a boolean with when markers are present
-        markers = {m: gt_marker.code_for_presence(markers[m], allow_failed=True) for m in markers if not markers[m].empty}
-        # marker presence signal only contains marker detections (True). We need to fill the gaps in between detections with False (not detected) so we have a continuous signal without gaps
-        markers = {m: gt_marker.expand_detection(markers[m], fill_value=False) for m in markers}
+        # get boolean matrix (frames x markers) indicating when markers are present
+        presence = _marker_presence.read(list(all_marker_ids), working_dir)
         # now auto code indicated intervals
         # see where stretches of marker presence start and end
-        marker_starts: dict[gt_marker.MarkerID,list[int]] = {}
-        marker_ends  : dict[gt_marker.MarkerID,list[int]] = {}
-        for m in markers:
-            marker_starts[m], marker_ends[m] = gt_marker.get_appearance_starts_ends(markers[m], cs['auto_code']['max_gap_duration'], cs['auto_code']['min_duration'])
+        marker_starts, marker_ends = _marker_presence.get_appearance_starts_ends(presence, cs['auto_code']['max_gap_duration'], cs['auto_code']['min_duration'])
         # find potential interval starts and ends
         if len(cs['auto_code']['start_markers'])>1:
-            starts = gt_marker.get_sequence_interval(marker_starts, marker_ends, cs['auto_code']['start_markers'], cs['auto_code']['max_intermarker_gap_duration'], side='end')
+            starts = _marker_presence.get_sequence_interval(marker_starts, marker_ends, cs['auto_code']['start_markers'], cs['auto_code']['max_intermarker_gap_duration'], side='end')
         else:
             starts = marker_ends  [cs['auto_code']['start_markers'][0]]
         if len(cs['auto_code'][ 'end_markers' ])>1:
-            ends   = gt_marker.get_sequence_interval(marker_starts, marker_ends, cs['auto_code'][ 'end_markers' ], cs['auto_code']['max_intermarker_gap_duration'], side='start')
+            ends   = _marker_presence.get_sequence_interval(marker_starts, marker_ends, cs['auto_code'][ 'end_markers' ], cs['auto_code']['max_intermarker_gap_duration'], side='start')
         else:
             ends   = marker_starts[cs['auto_code'][ 'end_markers' ][0]]
         # now match interval starts and ends
-        # strategy: run through starts and find latest start that is before first end (discard ends that are before the start)
-        # keep pointer into array keeping track of ends and start that have already been discarded or consumed
-        # NB: this assumes starts and ends are sorted, which the above procedures should indeed deliver
-        intervals: list[tuple[int,int]] = []
-        s_idx = 0
-        e_idx = 0
-        while s_idx<len(starts):
-            # remove ends before the current start
-            e_skip = np.nonzero(ends[e_idx:]<starts[s_idx])[0]
-            if e_skip.size:
-                e_idx += e_skip[-1]+1
-            if e_idx > len(ends)-1:
-                # we're out of ends, done
-                break
-            # for all starts in contention, find the last one that is before the next end
-            gaps = ends[e_idx]-starts[s_idx:]
-            # NB: it cannot occur that there are no starts before this end, since we move e_idx above in that case
-            # and bail out if there are no ends left
-            gaps[gaps<=0] = np.iinfo(gaps.dtype).max
-            mini = np.argmin(gaps)
-            # NB: intervals start the frame *after* the marker is last observed, and intervals end the frame *before* the marker is first observed
-            intervals.append((starts[s_idx+mini]+1, ends[e_idx]-1))
-            # these are consumed
-            s_idx+=mini+1
-            e_idx+=1
+        intervals = _marker_presence.match_interval_starts_ends(starts, ends)
         # if no intervals found, see if there are user-coded intervals to fall back on
         if not intervals and (eps:=episodes.get(cs['name'], None)):
             intervals = [(eps[1][i], eps[1][i+1]) for i in range(0, len(eps[1]), 2)]
@@ -97,84 +68,80 @@ def run(working_dir: str|pathlib.Path, config_dir: str|pathlib.Path|None = None,
             # This deals with multiple consecutive marker presentation without intervening segmentation markers. It is assumed that all targets are shown in
             # multiple runs of all individual targets (possibly random) order (so not fully randomized over all target presentations, then can't split).
             # Intervals are then split smaller after each run of all targets has been presented.
+            # All episodes are processed at once: first determine the target presentations during each episode,
+            # then check for each episode whether it can be split, and finally split all intervals at once
+            # target presentations per episode: (start frames, end frames, targets) sorted by start frame
+            target_observations: list[tuple[np.ndarray,np.ndarray,np.ndarray]|None] = []
             if (fname:=working_dir/f'{naming.validation_prefix}{cs["name"]}_fixation_assignment_override.tsv').exists():
                 coding = pd.read_csv(fname, delimiter='\t', dtype={'target':int, 'marker_interval':int},index_col=None)
-                has_override = True
+                video_ts = timestamps.VideoTimestamps(working_dir / gt_naming.frame_timestamps_fname)
+                obs = (np.array([video_ts.find_frame(t) for t in coding['start_timestamp']], dtype='int64'),
+                       np.array([video_ts.find_frame(t) for t in coding['end_timestamp']], dtype='int64'),
+                       coding['target'].to_numpy())
+                target_observations = [obs for _ in intervals]
+                n_targets = coding['target'].nunique()
             else:
                 p = list(cs['planes'])[0]
                 plane_def = [pl for pl in study_config.planes if pl.name==p][0]
                 if plane_def.type!=plane.Type.GlassesValidator:
                     raise ValueError(f'Plane {p} is not a {plane.Type.GlassesValidator.value} plane')
                 validation_plane = plane.get_plane_from_definition(plane_def, config_dir/p)
-                all_marker_observations_per_target, markers_per_target = validation.dynamic.get_marker_observations(validation_plane, working_dir, cs['name'])
-                has_override = False
-            for e in intervals.copy():
-                if not has_override:
-                    # make local copy of marker_observations, containing only the current episode
-                    marker_observations_per_target = {t:mo.loc[e[0]:e[1],:] for t,mo in all_marker_observations_per_target.items()}
-                    # check we have data for at least one of the markers for a given target
-                    failed = False
-                    for t in marker_observations_per_target:
-                        if marker_observations_per_target[t].empty:
+                # presence matrix (frames x targets)
+                presence, markers_per_target = _marker_presence.read_validation_targets(validation_plane, working_dir, cs['name'])
+                targets  = presence.markers
+                n_targets= len(targets)
+                if not targets:
+                    warnings.warn(f'{cs["name"]}: None of the markers for any of the targets were observed, cannot split consecutive repetitions', process_pool.ProcessingWarning)
+                    target_observations = [None for _ in intervals]
+                else:
+                    # check we have data for at least one of the markers for a given target in each episode
+                    n_frames = presence.presence.shape[0]
+                    n_obs    = np.concatenate((np.zeros((1,n_targets),dtype='int64'), np.cumsum(presence.presence, axis=0)))
+                    ivals    = np.array(intervals, dtype='int64').reshape(-1,2)
+                    observed = (n_obs[np.clip(ivals[:,1]-presence.first_frame+1, 0, n_frames)]-n_obs[np.clip(ivals[:,0]-presence.first_frame, 0, n_frames)])>0
+                    # for each target, see when it is presented using the marker presence signal
+                    appearances = _marker_presence.get_appearance_starts_ends_in_episodes(presence, intervals, cs['validation_setup']['dynamic_max_gap_duration'], cs['validation_setup']['dynamic_min_duration'])
+                    for e,obs,(starts,ends) in zip(intervals,observed,appearances):
+                        if not obs.all():
+                            t = targets[np.argmin(obs)]
                             missing_str  = '\n- '.join([gt_marker.marker_ID_to_str(m) for m in markers_per_target[t]])
                             warnings.warn(f'{cs["name"]}: None of the markers for target {t} were observed during the episode from frame {e[0]} to frame {e[1]}:\n- {missing_str}, skipping dynamic splitting of this episode', process_pool.ProcessingWarning)
-                            failed = True
-                            break
-                    if failed:
-                        continue
-
-                    # marker presence signal only contains marker detections (True). We need to fill the gaps in between detections with False (not detected) so we have a continuous signal without gaps
-                    marker_observations_per_target = {t: gt_marker.expand_detection(marker_observations_per_target[t], fill_value=False) for t in marker_observations_per_target}
-
-                    # for each target, see when it is presented using the marker presence signal
-                    target_observation_map: list[tuple[tuple[int,int],int]] = []  # ((start_frame,end_frame), target_id)
-                    for t in marker_observations_per_target:
-                        start, end = gt_marker.get_appearance_starts_ends(marker_observations_per_target[t], cs['validation_setup']['dynamic_max_gap_duration'], cs['validation_setup']['dynamic_min_duration'])
-                        for s,en in zip(start,end):
-                            target_observation_map.append(((s,en), t))
-                    # sort on start frame
-                    target_observation_map.sort(key=lambda x: x[0][0])
-                    # check each target occurs equally often
-                    target_counts = {t:0 for t in all_marker_observations_per_target}
-                    for _,t in target_observation_map:
-                        target_counts[t]+=1
-                else:
-                    video_ts = timestamps.VideoTimestamps(working_dir / gt_naming.frame_timestamps_fname)
-                    target_observation_map = []
-                    for _, row in coding.iterrows():
-                        start_frame = video_ts.find_frame(row['start_timestamp'])
-                        end_frame   = video_ts.find_frame(row['end_timestamp'])
-                        target_observation_map.append(((start_frame, end_frame), int(row['target'])))
-                    target_counts = coding['target'].value_counts().to_dict()
-                counts_set = set(target_counts.values())
-                if len(counts_set)!=1:
+                            target_observations.append(None)
+                            continue
+                        t_idx = np.concatenate([np.full(starts[t].size, i) for i,t in enumerate(targets)])
+                        order = np.argsort(np.concatenate([starts[t] for t in targets]), kind='stable')   # sort on start frame
+                        target_observations.append((np.concatenate([starts[t] for t in targets])[order], np.concatenate([ends[t] for t in targets])[order], t_idx[order]))
+            # find break points between consecutive runs
+            split_frames: list[np.ndarray] = []
+            for e,obs in zip(intervals,target_observations):
+                if obs is None:
+                    continue
+                starts, ends, tgts = obs
+                # check each target occurs equally often
+                target_counts = np.unique(tgts, return_counts=True)[1]
+                if tgts.size and (target_counts.size!=n_targets or np.any(target_counts!=target_counts[0])):
                     warnings.warn(f'{cs["name"]}: Not all targets were presented equally often during the episode from frame {e[0]} to frame {e[1]}, cannot split consecutive repetitions', process_pool.ProcessingWarning)
                     continue
                 # check each target is only presented once per consecutive run
-                n_repetitions = counts_set.pop()
-                n_targets     = len(target_counts)
-                for rep in range(1, n_repetitions):
-                    si, ei = (rep-1)*n_targets, rep*n_targets
-                    targets_in_run = set(t for _,t in target_observation_map[si:ei])
-                    if len(targets_in_run)!=n_targets:  # not all targets present in this run
-                        warnings.warn(f'{cs["name"]}: Not all targets were presented during repetition {rep} in the episode from frame {e[0]} to frame {e[1]}, cannot split consecutive repetitions', process_pool.ProcessingWarning)
-                        failed = True
-                        break
-                # find break points between consecutive runs
-                for rep in range(1, n_repetitions):
-                    # find the index in target_observation_map where the next repetition starts
-                    break_idx = rep * n_targets
-                    # get the frame to split at: halfway between the end of the last target in the previous run and the start of the first target in this run
-                    split_frame = (target_observation_map[break_idx-1][0][1] + target_observation_map[break_idx][0][0]) // 2
-                    # now adjust intervals accordingly
-                    # find which interval this split frame falls into
-                    for int_idx in range(len(intervals)):
-                        if intervals[int_idx][0]<=split_frame<=intervals[int_idx][1]:
-                            # split here
-                            old_int = intervals[int_idx]
-                            intervals[int_idx] = (old_int[0], split_frame)
-                            intervals.insert(int_idx+1, (split_frame+1, old_int[1]))
-                            break
+                n_repetitions = tgts.size//n_targets if n_targets else 0
+                if n_repetitions<2:
+                    continue
+                runs = np.sort(tgts.reshape(n_repetitions, n_targets), axis=1)
+                incomplete = np.nonzero(np.any(np.diff(runs[:-1], axis=1)==0, axis=1))[0]
+                if incomplete.size:
+                    warnings.warn(f'{cs["name"]}: Not all targets were presented during repetition {incomplete[0]+1} in the episode from frame {e[0]} to frame {e[1]}, cannot split consecutive repetitions', process_pool.ProcessingWarning)
+                    continue
+                # get the frame to split at: halfway between the end of the last target in the previous run and the start of the first target in the next run
+                break_idx = np.arange(1, n_repetitions)*n_targets
+                split_frames.append((ends[break_idx-1]+starts[break_idx])//2)
+            # now split the intervals these split frames fall into
+            if split_frames:
+                split_frames = np.unique(np.concatenate(split_frames))
+                new_intervals: list[tuple[int,int]] = []
+                for i0,i1 in intervals:
+                    sf = split_frames[(split_frames>=i0) & (split_frames<i1)]
+                    new_intervals.extend(zip(np.concatenate(([i0],sf+1)), np.concatenate((sf,[i1]))))
+                intervals = new_intervals
         # now insert into coding file. This just overwrites whatever is there
         if cs['name'] not in episodes:
             episodes[cs['name']] = (cs['event_type'], [])
@@ -4,6 +4,7 @@ import copy
 
 from glassesTools import annotation, marker as gt_marker, process_pool
 
+from . import _marker_presence
 from .. import config, episode, naming, process, session
 
 
@@ -29,18 +30,17 @@ def run(working_dir: str|pathlib.Path, config_dir: str|pathlib.Path|None = None,
     for cs in sync_events:
         if 'markers' not in cs['auto_code'] or not cs['auto_code']['markers']:
             raise ValueError(f'No markers configured for auto coding of sync event "{cs["name"]}"')
-        markers = [gt_marker.read_dataframe_from_file(m.m_id, m.aruco_dict_id, working_dir) for m in cs['auto_code']['markers'] if gt_marker.get_file_name(m.m_id, m.aruco_dict_id, working_dir).is_file()]
+        markers = [m for m in cs['auto_code']['markers'] if gt_marker.get_file_name(m.m_id, m.aruco_dict_id, working_dir).is_file()]
         if not markers:
             missing_str = '\n- '.join([gt_marker.get_file_name(m.m_id, m.aruco_dict_id, None) for m in cs['auto_code']['markers']])
             raise FileNotFoundError(f'None of the following marker files were found:\n- {missing_str}')
-        # recode so we have a boolean with when markers are present
-        markers = [gt_marker.code_for_presence(m, allow_failed=True) for m in markers if not m.empty]
-        if not markers:
+        # get boolean matrix (frames x markers) indicating when markers are present
+        presence = _marker_presence.read(markers, working_dir)
+        if not presence.presence.any():
             raise RuntimeError(f'No markers found in the marker detection files for session "{working_dir.parent.name}", recording "{working_dir.name}"')
-        # marker presence signal only contains marker detections (True). We need to fill the gaps in between detections with False (not detected) so we have a continuous signal without gaps
-        markers = [gt_marker.expand_detection(m, fill_value=False) for m in markers]
         # see where stretches of True (marker presence) start
-        marker_starts = [s for m in markers for s in gt_marker.get_appearance_starts_ends(m, cs['auto_code']['max_gap_duration'], cs['auto_code']['min_duration'])[0]]
+        marker_starts = _marker_presence.get_appearance_starts_ends(presence, cs['auto_code']['max_gap_duration'], cs['auto_code']['min_duration'])[0]
+        marker_starts = [s for m in markers for s in marker_starts[m]]
         # insert in episodes
         if cs['name'] not in episodes:
             episodes[cs['name']] = (cs['event_type'], [])
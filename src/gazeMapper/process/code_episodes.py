@@ -12,13 +12,14 @@ isMacOS = sys.platform.startswith("darwin")
 if isMacOS:
     import AppKit
 
-from glassesTools import annotation, drawing, gaze_headref, gaze_worldref, naming as gt_naming, ocv, plane as gt_plane, pose as gt_pose, process_pool, propagating_thread, timestamps, validation
+from glassesTools import annotation, drawing, gaze_worldref, naming as gt_naming, ocv, plane as gt_plane, pose as gt_pose, process_pool, propagating_thread, timestamps
 from glassesTools.camera_recording import Type as CameraRecordingType
 from glassesTools.gui.video_player import GUI
 from glassesTools.validation import assign_intervals
 
 
 from .. import config, episode, naming, plane, process, session
+from . import _gaze_files, _marker_presence
 
 # This script shows a video player that is used to indicate the interval(s)
 # during which the poster should be found in the video and in later
@@ -107,7 +108,8 @@ def do_the_work(working_dir: pathlib.Path, config_dir: pathlib.Path, gui: GUI, v
                 episodes[_get_target_name(t)] = (annotation.EventType.Target, [])
             if val_p_def.is_dynamic and val_coding_event in e:
                 # dynamic plane but no coding yet, try and prepopulate the coding based on ArUco marker detections (c.f. run_validation)
-                marker_observations_per_target, markers_per_target = validation.dynamic.get_marker_observations(pl, working_dir, val_coding_event, missing_ok=True)
+                presence, markers_per_target = _marker_presence.read_validation_targets(pl, working_dir, val_coding_event, missing_ok=True)
+                marker_observations_per_target = _marker_presence.to_observations_per_target(presence)
                 for idx,_ in enumerate(e[val_coding_event][1]):
                     selected_intervals, _ = assign_intervals.dynamic_markers(marker_observations_per_target,
                                                 markers_per_target,
@@ -157,7 +159,7 @@ def do_the_work(working_dir: pathlib.Path, config_dir: pathlib.Path, gui: GUI, v
     elif rec_def.type==session.RecordingType.Eye_Tracker:
         # Read gaze data
         has_gaze = True
-        gazes = gaze_headref.read_dict_from_file(working_dir / gt_naming.gaze_data_fname, ts_column_suffixes=['VOR',''])[0]
+        gazes = _gaze_files.read_dict_from_file(working_dir, ts_column_suffixes=['VOR',''])[0]
 
         # Read gaze on poster data, if available
         plane_files = [working_dir/f'{naming.world_gaze_prefix}{p}.tsv' for p in planes]
@@ -3,12 +3,12 @@ import numpy as np
 import pandas as pd
 import polars as pl
 
-from glassesTools import data_types, gaze_worldref, naming as gt_naming, plane as gt_plane, process_pool
+from glassesTools import data_types, gaze_worldref, plane as gt_plane, process_pool
 from glassesTools.validation import Plane as val_Plane
 from glassesTools.validation.config import get_validation_setup
 
 from .. import config, episode, naming, plane, process, session
-from . import _pose_files
+from . import _gaze_files, _pose_files
 
 
 def run(working_dir: str|pathlib.Path, config_dir: str|pathlib.Path|None = None, progress_indicator: process_pool.JobProgress|None=None, **study_settings):
@@ -80,7 +80,7 @@ def run(working_dir: str|pathlib.Path, config_dir: str|pathlib.Path|None = None,
     all_episodes_per_plane = {p: sorted(all_episodes_per_plane[p]) for p in all_episodes_per_plane}
     plane_gazes = {p: gaze_worldref.read_dict_from_file(working_dir / f'{naming.world_gaze_prefix}{p}.tsv', episodes=all_episodes_per_plane[p], ts_column_suffixes=['VOR','']) for p in all_planes}
     poses = {p:_pose_files.read_preferred_plane_pose(working_dir, p, all_episodes_per_plane[p]) for p in all_planes}
-    head_gaze = pd.read_csv(working_dir/gt_naming.gaze_data_fname, delimiter='\t', index_col=False)
+    head_gaze = _gaze_files.read_dataframe(working_dir)
 
 
     # get first plane gaze
@@ -103,13 +103,19 @@ def run(working_dir: str|pathlib.Path, config_dir: str|pathlib.Path|None = None,
     progress_indicator.set_intervals(step:=min(50,int(total/200)), step)
 
     # per plane, per target, compute gaze offsets from target
+    frame_idx_col = 'frame_idx'+extra_suffix
     for p in all_planes:
-        df: pd.DataFrame|None = None
+        # frames for which we have gaze on the plane, for quick selection of the gaze samples in each episode
+        gaze_frames = np.array(sorted(plane_gazes[p].keys()))
+        # first compute offsets for all episodes, then assemble output
+        ep_frame_idxs: list[np.ndarray] = []
+        ep_timestamps: list[np.ndarray] = []
+        ep_offsets   : list[dict[tuple[str,str,str], np.ndarray]] = []
         for nm in episodes_per_plane:
             if not p in episodes_per_plane[nm]:
                 continue
             for e in episodes_per_plane[nm][p]:
-                this_gaze = {k:v for (k,v) in plane_gazes[p].items() if k>=e[0] and k<=e[1]}
+                this_gaze = {k:plane_gazes[p][k] for k in gaze_frames[np.searchsorted(gaze_frames, e[0], side='left'):np.searchsorted(gaze_frames, e[1], side='right')].tolist()}
                 if not this_gaze:
                     raise RuntimeError(f'There is no gaze data on the plane for episode "{e}" on plane "{p}", cannot proceed. This may be because there was no gaze during this interval or because the plane was not detected.')
 
@@ -128,51 +134,69 @@ def run(working_dir: str|pathlib.Path, config_dir: str|pathlib.Path|None = None,
                     targets_for_homography[nm][p],
                     viewing_distance_per_plane[nm][p]
                     )
-                # prepare output data frame
-                new_rows = pd.DataFrame({'frame_idx'+extra_suffix: frame_idxs}, index=pd.Index(timestamps, name='timestamp'+extra_suffix))
-                if df is None:
-                    df = new_rows
-                else:
-                    df = pd.concat([df, new_rows])
-
+                ep_frame_idxs.append(np.asarray(frame_idxs))
+                ep_timestamps.append(np.asarray(timestamps))
+                ep_offsets.append({})
                 for t in offsets:
                     for d_type in offsets[t]:
-                        col_names = [f'{x}_target_{t}_{d_type.name}' for x in ('offset', 'offset_x', 'offset_y')]
-                        df.loc[timestamps, col_names] = offsets[t][d_type]
+                        col_names = tuple(f'{x}_target_{t}_{d_type.name}' for x in ('offset', 'offset_x', 'offset_y'))
+                        ep_offsets[-1][col_names] = offsets[t][d_type]
                         progress_indicator.update(n=e[1]-e[0]+1)
 
+        # gaze samples of all episodes, with offsets as columns (in order of first occurrence)
+        offset_cols = list(dict.fromkeys(c for o in ep_offsets for cols in o for c in cols))
+        col_idxs    = {c:i for i,c in enumerate(offset_cols)}
+        n_samples   = sum(ts.size for ts in ep_timestamps)
+        gaze_ts     = np.empty(n_samples)
+        gaze_fr     = np.empty(n_samples, dtype='int64')
+        offset_vals = np.full((n_samples, len(offset_cols)), np.nan)
+        i0 = 0
+        for frs, ts, o in zip(ep_frame_idxs, ep_timestamps, ep_offsets):
+            i1 = i0+ts.size
+            gaze_ts[i0:i1] = ts
+            gaze_fr[i0:i1] = frs
+            for cols in o:
+                offset_vals[i0:i1, [col_idxs[c] for c in cols]] = o[cols]
+            i0 = i1
+
         # merge with original timestamps so that we have nan in the signal for missing gaze timestamps
         # select all coded intervals that are configured for this plane
-        frame_idx_col = 'frame_idx'+extra_suffix
-        selector = np.zeros(len(head_gaze), dtype=bool)
-        for nm in episodes_per_plane:
-            if p in episodes_per_plane[nm]:
-                for e in episodes_per_plane[nm][p]:
-                    selector |= (head_gaze[frame_idx_col]>=e[0]) & (head_gaze[frame_idx_col]<=e[1])
-        hg = head_gaze.loc[selector]
-        # combine to add missing rows
-        frame_idx = df.pop(frame_idx_col).combine_first(hg[frame_idx_col])
+        hg_frame_idx = head_gaze[frame_idx_col].to_numpy()
+        hg_episode   = {nm: _get_episode_membership(hg_frame_idx, episodes_per_plane[nm][p]) for nm in episodes_per_plane if p in episodes_per_plane[nm]}
+        hg = head_gaze.loc[np.any([ep>=0 for ep in hg_episode.values()], axis=0)]
+        # output has rows for all timestamps (sorted) in either the gaze on the plane or the head gaze
+        hg_ts   = hg.index.to_numpy()
+        out_ts  = np.union1d(gaze_ts, hg_ts)
+        i_gaze  = np.searchsorted(out_ts, gaze_ts)
+        i_hg    = np.searchsorted(out_ts, hg_ts)
+        def _fill_column(idxs_vals: list[tuple[np.ndarray,np.ndarray]]):
+            # NB: like a pandas merge: stays integer if all rows get a value, else turns into float with nans
+            have = np.zeros(out_ts.size, dtype='bool')
+            for idxs,_ in idxs_vals:
+                have[idxs] = True
+            col = np.full(out_ts.size, np.nan) if not have.all() else np.empty(out_ts.size, dtype=idxs_vals[0][1].dtype)
+            for idxs,vals in idxs_vals[::-1]:   # first has precedence
+                col[idxs] = vals
+            return col
+        df = pd.DataFrame({'timestamp'+extra_suffix: out_ts})
+        df[offset_cols] = np.full((out_ts.size, len(offset_cols)), np.nan)
+        df.loc[i_gaze, offset_cols] = offset_vals
         if has_VOR:
-            # also add non-VOR timestamps and frame_idxs, plus need some special handling to preserve integer type
-            # merge in the original timestamps and frame indexes (and adds missing rows)
-            df = df.merge(hg[['timestamp', 'frame_idx']], how='outer', left_index=True, right_index=True)
-        else:
-            df = df.merge(pd.DataFrame(index=hg.index), how='outer', left_index=True, right_index=True)
-        # Combine back in the frame_idx column
-        df[frame_idx_col] = frame_idx
+            # also add non-VOR timestamps and frame_idxs
+            for c in ('timestamp', 'frame_idx'):
+                df[c] = _fill_column([(i_hg, hg[c].to_numpy())])
+        # frame_idx, preferably from gaze on plane
+        df[frame_idx_col] = _fill_column([(i_gaze, gaze_fr), (i_hg, hg[frame_idx_col].to_numpy())])
 
         # Add in episode column
         df['episode'] = pd.NA
-        for nm in episodes_per_plane:
-            if p in episodes_per_plane[nm]:
-                for e in episodes_per_plane[nm][p]:
-                    df.loc[(df[frame_idx_col]>=e[0]) & (df[frame_idx_col]<=e[1]), 'episode'] = nm
+        out_frame_idx = df[frame_idx_col].to_numpy()
+        for nm in hg_episode:
+            df.loc[_get_episode_membership(out_frame_idx, episodes_per_plane[nm][p])>=0, 'episode'] = nm
 
         # Order columns as timestamps, frame indices, episode, then offsets
-        df = df.reset_index()
         timestamp_cols = [c for c in ('timestamp', 'timestamp_VOR') if c in df.columns]
         frame_idx_cols = [c for c in ('frame_idx', 'frame_idx_VOR') if c in df.columns]
-        offset_cols = [c for c in df.columns if c.startswith('offset')]
         leading_cols = timestamp_cols + frame_idx_cols + ['episode']
         df = df[leading_cols + offset_cols]
 
@@ -182,3 +206,13 @@ def run(working_dir: str|pathlib.Path, config_dir: str|pathlib.Path|None = None,
 
     # update state
     session.update_action_states(working_dir, process.Action.COMPUTE_GAZE_OFFSETS, process_pool.State.Completed, study_config)
+
+
+def _get_episode_membership(frame_idxs: np.ndarray, episodes: list[list[int]]) -> np.ndarray:
+    # for each frame, index of the episode it is in, or -1 if not in any episode. Episodes must be sorted and not overlap
+    if not episodes:
+        return np.full(frame_idxs.shape, -1)
+    bounds = np.array(episodes).reshape(-1,2)
+    idx    = np.searchsorted(bounds[:,0], frame_idxs, side='right')-1
+    inside = (idx>=0) & (frame_idxs<=bounds[np.clip(idx,0,None),1])
+    return np.where(inside, idx, -1)
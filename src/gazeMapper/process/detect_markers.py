@@ -6,6 +6,7 @@ from glassesTools import annotation, aruco, marker as gt_marker, naming as gt_na
 from glassesTools.camera_recording import Type as CameraRecordingType
 from glassesTools.gui.video_player import GUI
 
+from . import _marker_presence
 from .. import config, episode, marker, naming, plane, process, session, synchronization
 
 
@@ -115,6 +116,8 @@ def do_the_work(working_dir: pathlib.Path, config_dir: pathlib.Path, gui: GUI|No
         pose.write_list_to_file(poses[p], working_dir/f'{naming.plane_pose_prefix}{p}.tsv', skip_failed=True)
     for m in individual_markers:
         gt_marker.write_list_to_file(individual_markers[m], gt_marker.get_file_name(m.m_id, m.aruco_dict_id, working_dir), skip_failed=False)
+    # also store index of when each marker is present, for quick lookup
+    _marker_presence.write_index(working_dir, individual_markers)
 
     # if this is a head-attached recording, further check whether its pose is used to replace pose for another camera
     # if so, write a pose file for that camera also
@@ -128,7 +131,8 @@ def do_the_work(working_dir: pathlib.Path, config_dir: pathlib.Path, gui: GUI|No
             videos_ts = {r:timestamps.VideoTimestamps(working_dir.parent / r / gt_naming.frame_timestamps_fname) for r in [to_replace, rec_name]}
             to_sync_frame_idxs = synchronization.reference_frames_to_video(to_replace, sync, videos_ts[rec_name].indices,
                                                                            videos_ts[to_replace].timestamps, videos_ts[rec_name].timestamps,
-                                                                           study_config.sync_ref_do_time_stretch, study_config.sync_ref_stretch_which)
+                                                                           study_config.sync_ref_do_time_stretch, study_config.sync_ref_stretch_which,
+                                                                           working_dir.parent / to_replace)
             frame_map = {frep:fr for fr,frep in zip(videos_ts[rec_name].indices,to_sync_frame_idxs) if frep!=-1}
             # turn poses into a dict for easy access
             poses = {pl:{p.frame_idx:p for p in poses[pl]} for pl in poses}
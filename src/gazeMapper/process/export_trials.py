@@ -1,21 +1,19 @@
 import pathlib
-import shutil
 import copy
 import numpy as np
 import pandas as pd
 import polars as pl
-from collections import defaultdict
 import dataclasses
 import csv
 import warnings
 
 from ETDQualitizer import vector_to_Fick
 
-from glassesTools import annotation, data_types, gaze_headref, gaze_worldref, marker as gt_marker, naming as gt_naming, ocv, process_pool, transforms
+from glassesTools import annotation, data_types, gaze_worldref, marker as gt_marker, naming as gt_naming, ocv, process_pool, transforms
 from glassesTools.validation import export as val_export
 
 from .. import config, episode, naming, process, session
-from . import _pose_files
+from . import _file_export, _gaze_files, _marker_presence, _pose_files, _utils
 
 
 @dataclasses.dataclass
@@ -180,30 +178,39 @@ def run(working_dir: str|pathlib.Path, export_path: str|pathlib.Path, export_con
     # get settings for the study
     study_config = config.read_study_config_with_overrides(config_dir, {config.OverrideLevel.Session: working_dir}, **study_settings)
 
+    # coded episodes are shared between the exports
+    episode_graph = episode.EpisodeGraph(study_config, working_dir)
+
     # now all the actual exports (NB: validation and et_sync are done once for a whole selection, so not handled here as this function is called per session)
     if export_config.plane_gaze.do_it:
-        export_plane_gaze(export_path, working_dir, study_config, export_config.plane_gaze)
+        export_plane_gaze(export_path, working_dir, study_config, export_config.plane_gaze, episode_graph)
 
     if export_config.gaze_offsets.do_it:
-        export_gaze_offsets(export_path, working_dir, study_config, export_config.gaze_offsets)
+        export_gaze_offsets(export_path, working_dir, study_config, export_config.gaze_offsets, episode_graph)
 
     if export_config.gaze_overlay_video.do_it:
-        export_gazeOverlay_video(export_path, working_dir, export_config.gaze_overlay_video)
+        export_gazeOverlay_video(export_path, working_dir, export_config.gaze_overlay_video, study_config.export_video_strategy)
 
     if export_config.mapped_gaze_video.do_it:
-        export_mappedGaze_video(export_path, working_dir, export_config.mapped_gaze_video)
+        export_mappedGaze_video(export_path, working_dir, export_config.mapped_gaze_video, study_config.export_video_strategy)
 
     # update state
     session.update_action_states(working_dir, process.Action.EXPORT_TRIALS, process_pool.State.Completed, study_config)
 
 
-def export_plane_gaze(export_path: pathlib.Path, working_dir: pathlib.Path, study_config: config.Study, export_config: PlaneGaze):
+def export_plane_gaze(export_path: pathlib.Path, working_dir: pathlib.Path, study_config: config.Study, export_config: PlaneGaze, episode_graph: episode.EpisodeGraph|None = None):
     cs_plane_gaze = [cs for cs in study_config.coding_setup if cs['planes']]
     if not cs_plane_gaze:
         raise ValueError('No events where gaze is mapped to a plane are configured for the study, nothing to process')
 
     planes = {v for cs in cs_plane_gaze for v in cs['planes']}
 
+    if episode_graph is None:
+        episode_graph = episode.EpisodeGraph(study_config, working_dir)
+
+    # frame timestamps of the reference recording, shared between recordings. Loaded when first needed
+    ref_frame_ts: pl.LazyFrame|None = None
+
     # per recording, read the relevant files and put them all together
     for r in export_config.recs:
         # check if files needed for export are present, else skip
@@ -212,7 +219,7 @@ def export_plane_gaze(export_path: pathlib.Path, working_dir: pathlib.Path, stud
             continue
         # get trial coding
         # trial episodes are gotten from the reference recording if there is one and this is not the reference recording
-        episodes = episode.load_episodes_from_all_recordings(study_config, working_dir/r, {cs['name'] for cs in cs_plane_gaze})[0]
+        episodes = episode.load_episodes_from_all_recordings(study_config, working_dir/r, {cs['name'] for cs in cs_plane_gaze}, episode_graph=episode_graph)[0]
         if not any(episodes[e][1] for e in episodes):
             warnings.warn(f'No {annotation.tooltip_map[annotation.EventType.Trial]} events found in the coding file for recording {r} in session {working_dir.name}. Skipping...', process_pool.ProcessingWarning)
             continue
@@ -220,9 +227,10 @@ def export_plane_gaze(export_path: pathlib.Path, working_dir: pathlib.Path, stud
         # keep track of units or other descriptions for each column
         column_info = {'frame_ts': 'scene camera frame timestamp (ms)'}
 
-        # get all plane-gaze data
-        plane_gazes = {p:pd.read_csv(working_dir / r / f'{naming.world_gaze_prefix}{p}.tsv', sep='\t', dtype=defaultdict(lambda: float, **gaze_worldref.Gaze._non_float)) for p in planes}
-        cols = set(c for df in plane_gazes.values() for c in df.columns)
+        # get all plane-gaze data. NB: the files are scanned lazily, so that only the needed columns are read
+        # and the data is only materialized when writing the export files
+        plane_gazes = {p:_utils.scan_tsv(working_dir / r / f'{naming.world_gaze_prefix}{p}.tsv', gaze_worldref.Gaze._non_float) for p in planes}
+        cols = set(c for df in plane_gazes.values() for c in df.collect_schema().names())
         for c in cols:
             if c.startswith('gazePos'):
                 column_info[c] = 'mm'
@@ -243,8 +251,8 @@ def export_plane_gaze(export_path: pathlib.Path, working_dir: pathlib.Path, stud
 
         # get head-referenced gaze
         if export_config.include_head_ref_gaze:
-            head_ref_gaze = pd.read_csv(working_dir / r / f'{gt_naming.gaze_data_fname}', sep='\t', dtype=defaultdict(lambda: float, **gaze_headref.Gaze._non_float))
-            cols = head_ref_gaze.columns
+            head_ref_gaze = _gaze_files.scan_dataframe(working_dir / r)
+            cols = head_ref_gaze.collect_schema().names()
             for c in cols:
                 if c.startswith('gaze_pos_vid'):
                     column_info[c] = 'pixels'
@@ -258,25 +266,26 @@ def export_plane_gaze(export_path: pathlib.Path, working_dir: pathlib.Path, stud
                 # get w.r.t. straight ahead ([0, 0, 1] in camera coordinates)
                 cam=ocv.CameraParams.read_from_file(working_dir / r / gt_naming.scene_camera_calibration_fname)
                 # first unproject to get gaze vector from gaze position in pixels on the camera image
-                gazew=transforms.unproject_points(head_ref_gaze[['gaze_pos_vid_x', 'gaze_pos_vid_y']].values, cam)
+                gazew=transforms.unproject_points(head_ref_gaze.select('gaze_pos_vid_x', 'gaze_pos_vid_y').collect().to_numpy(), cam)
                 # then get Fick angles from gaze vector (NB: positive angles are rightward and downward)
-                head_ref_gaze['azimuth'], head_ref_gaze['elevation'] = vector_to_Fick(gazew[:,0], gazew[:,1], gazew[:,2])
+                azimuth, elevation = vector_to_Fick(gazew[:,0], gazew[:,1], gazew[:,2])
+                head_ref_gaze = pl.concat([head_ref_gaze, pl.LazyFrame({'azimuth': azimuth, 'elevation': elevation})], how='horizontal')
                 column_info.update({'azimuth': 'deg (Fick)', 'elevation': 'deg (Fick)'})
 
-        # throw away unwanted columns
+        # throw away unwanted columns (NB: as the files are scanned lazily, these columns are then not read at all)
         if not export_config.include_3D:
             for p in plane_gazes:
                 # throw away all columns starting with gazePosCam or gazeOriCam
-                plane_gazes[p] = plane_gazes[p].drop(columns=[c for c in plane_gazes[p].columns if c.startswith('gazePosCam') or c.startswith('gazeOriCam')])
+                plane_gazes[p] = plane_gazes[p].drop(pl.selectors.starts_with('gazePosCam','gazeOriCam'))
         if not export_config.include_2D:
             for p in plane_gazes:
                 # throw away all columns starting with gazePosPlane2D
-                plane_gazes[p] = plane_gazes[p].drop(columns=[c for c in plane_gazes[p].columns if c.startswith('gazePosPlane2D')])
+                plane_gazes[p] = plane_gazes[p].drop(pl.selectors.starts_with('gazePosPlane2D'))
 
         # rename putting plane name in there so that names are unique
         for p in plane_gazes:
-            rename = {c:f'{c[:7]}_{p}_{c[7:]}' for c in plane_gazes[p].columns if c.startswith('gazePos') or c.startswith('gazeOri')}
-            plane_gazes[p] = plane_gazes[p].rename(columns=rename)
+            rename = {c:f'{c[:7]}_{p}_{c[7:]}' for c in plane_gazes[p].collect_schema().names() if c.startswith('gazePos') or c.startswith('gazeOri')}
+            plane_gazes[p] = plane_gazes[p].rename(rename)
             # update column info with new names
             for c in rename:
                 if c in column_info:
@@ -285,143 +294,174 @@ def export_plane_gaze(export_path: pathlib.Path, working_dir: pathlib.Path, stud
         # if there are individual markers, load them so they can be added later
         # load
         if export_config.include_markers:
-            markers = {m.id: gt_marker.read_dataframe_from_file(m.id, m.aruco_dict_id, working_dir/r) for m in study_config.individual_markers if gt_marker.get_file_name(m.id, m.aruco_dict_id, working_dir/r).is_file()}
+            # NB: keyed by marker id, like the output columns
+            marker_ids = {m.id: gt_marker.MarkerID(m.id, m.aruco_dict_id) for m in study_config.individual_markers if gt_marker.get_file_name(m.id, m.aruco_dict_id, working_dir/r).is_file()}
             # recode to presence/absence if wanted
             if export_config.markers_only_presence:
-                markers = gt_marker.code_for_presence(markers, allow_failed=True)
+                # get from presence index, no need to load the marker files
+                presence = _marker_presence.read(list(marker_ids.values()), working_dir/r)
                 # compress if wanted (turn presence into comma-separated list of present marker ids, and drop the individual columns)
                 if export_config.markers_compress:
-                    presence_cols = {i:f'marker_{i}_presence' for i in markers}
-                    observed: dict[int, set[int]] = {}   # keep track of which markers observed for each frame
-                    for i in markers:
-                        # get frame indices where this marker is observed
-                        frame_indices = markers[i].loc[markers[i][presence_cols[i]],['frame_idx']].values.flatten()
-                        for fr in frame_indices:
-                            if fr not in observed:
-                                observed[fr] = set()
-                            observed[fr].add(i)
-                    # turn into comma-separated list of observed marker ids
-                    markers = pd.DataFrame(
-                        [
-                            {"frame_idx": k, "markers": ",".join(map(str, sorted(v)))}
-                            for k, v in sorted(observed.items())
-                        ]
-                    )
+                    order = np.argsort(list(marker_ids))
+                    ids   = np.array(list(marker_ids))[order]
+                    pres  = presence.presence[:,order]
+                    observed = np.nonzero(pres.any(axis=1))[0]
+                    # turn into comma-separated list of observed marker ids, once per unique combination of markers
+                    combos, inverse = np.unique(pres[observed], axis=0, return_inverse=True)
+                    combo_strs = np.array([",".join(map(str, ids[c])) for c in combos], dtype='object')
+                    markers = pl.LazyFrame({"frame_idx": observed+presence.first_frame, "markers": combo_strs[inverse.flatten()]}, schema={"frame_idx": pl.Int64, "markers": pl.String})
                     column_info['markers'] = 'observed marker ids (comma-separated)'
+                else:
+                    markers = {i: pl.LazyFrame({'frame_idx': presence.get_frames(marker_ids[i]), f'marker_{i}_presence': True}, schema={'frame_idx': pl.Int64, f'marker_{i}_presence': pl.Boolean}) for i in marker_ids}
             else:
+                markers = {i: pl.from_pandas(gt_marker.read_dataframe_from_file(m.m_id, m.aruco_dict_id, working_dir/r)).lazy() for i,m in marker_ids.items()}
                 # rename columns to unique names
                 for i in markers:
-                    markers[i] = markers[i].rename(columns={c:f'marker_{i}_{c}' for c in markers[i].columns if c not in ['frame_idx']})
+                    markers[i] = markers[i].rename({c:f'marker_{i}_{c}' for c in markers[i].collect_schema().names() if c not in ['frame_idx']})
 
         # if head pose is wanted, load it so it can be added later
         if export_config.include_head_pose:
-            head_pose = {pl: pd.read_csv(_pose_files.get_preferred_plane_pose_file(working_dir / r, pl)[0], sep='\t') for pl in planes}
+            head_pose = {p: pl.from_pandas(pd.read_csv(_pose_files.get_preferred_plane_pose_file(working_dir / r, p)[0], sep='\t')).lazy() for p in planes}
             column_info.update({f: 'rotation vector component' for f in ('pose_R_vec_x','pose_R_vec_y','pose_R_vec_z')})
             column_info.update({f: 'mm' for f in ('pose_T_vec_x','pose_T_vec_y','pose_T_vec_z')})
             if export_config.include_head_pose_Fick_angles:
                 pass    # TODO
             for p in plane_gazes:
                 # drop unwanted columns
-                head_pose[p] = head_pose[p].drop(columns=[c for c in head_pose[p].columns if c.startswith('homography') or c.endswith('N_points') or c.endswith('reprojection_error')])
+                head_pose[p] = head_pose[p].drop(pl.selectors.starts_with('homography') | pl.selectors.ends_with('N_points','reprojection_error'))
                 # rename columns to include plane name so that they are unique
-                rename = {c:f'{c[:4]}_{p}_{c[5:]}' for c in head_pose[p].columns if c.startswith('pose')}
-                head_pose[p] = head_pose[p].rename(columns=rename)
+                rename = {c:f'{c[:4]}_{p}_{c[5:]}' for c in head_pose[p].collect_schema().names() if c.startswith('pose')}
+                head_pose[p] = head_pose[p].rename(rename)
                 # update column info with new names
                 for c in rename:
                     if c in column_info:
                         column_info[rename[c]] = column_info[c]
 
-        # for the rest, make a file per coding stream
-        ori_plane_gazes = copy.deepcopy(plane_gazes)
+        # frame timestamps, shared between the coding streams
+        frame_ts = pl.read_csv(working_dir / r / gt_naming.frame_timestamps_fname, separator='\t').lazy().rename({'timestamp':'frame_ts'})
+
+        # for the rest, make a file per coding stream. NB: the lazy frames are not modified below, so can be shared between coding streams
         for cs in cs_plane_gaze:
             nm = cs['name']
             if not episodes[nm][1]:
                 continue
 
             # now merge
-            planes = list(cs['planes'])
-            plane_gazes = {p:ori_plane_gazes[p].copy() for p in planes}
-            keys = list(plane_gazes.keys())
+            cs_planes = list(cs['planes'])
+            to_merge = [plane_gazes[p] for p in cs_planes]
             if export_config.include_head_ref_gaze:
-                # get all frame_idxs that occur in plane gazes
-                frame_idxs = set()
-                for p in planes:
-                    frame_idxs.update(plane_gazes[p]['frame_idx'].values)
-                # get head ref gaze for those frame_idxs only
-                plane_gazes['__xxhead_refxx__'] = head_ref_gaze[head_ref_gaze['frame_idx'].isin(frame_idxs)].copy()
-                keys.insert(0,'__xxhead_refxx__')
-            for i in range(1,len(keys)):
-                # NB: by not providing on, merge is done on intersection of columns (so that is all timestamp and frame_idx columns, which is what we want)
-                plane_gazes[keys[0]] = plane_gazes[keys[0]].merge(plane_gazes[keys[i]], how='outer')
-            plane_gazes = plane_gazes[keys[0]]
+                # get head ref gaze only for the frame_idxs that occur in plane gazes
+                frame_idxs = pl.concat([df.select('frame_idx') for df in to_merge]).unique()
+                to_merge.insert(0, head_ref_gaze.join(frame_idxs, on='frame_idx', how='semi', maintain_order='left'))
+            # NB: merge is done on intersection of columns (so that is all timestamp and frame_idx columns, which is what we want)
+            plane_gaze = _outer_join(to_merge)
 
             # merge in markers
             if export_config.include_markers:
                 if export_config.markers_only_presence and export_config.markers_compress:
-                    plane_gazes = plane_gazes.merge(markers, how='left', on='frame_idx')
-                    # replace nan with empty string for frames where no markers are observed
-                    plane_gazes['markers'] = plane_gazes['markers'].fillna('')
+                    plane_gaze = _left_join(plane_gaze, markers, on='frame_idx')
+                    # replace missing with empty string for frames where no markers are observed
+                    plane_gaze = plane_gaze.with_columns(pl.col('markers').fill_null(''))
                 else:
                     for i in markers:
-                        # NB: by not providing on, merge is done on intersection of columns (so that is all timestamp and frame_idx columns, which is what we want)
-                        plane_gazes = plane_gazes.merge(markers[i], how='left', on='frame_idx')
+                        plane_gaze = _left_join(plane_gaze, markers[i], on='frame_idx')
                     # correct missing values in presence column to false
                     if export_config.markers_only_presence:
-                        for i in markers:
-                            plane_gazes[f'marker_{i}_presence'] = plane_gazes[f'marker_{i}_presence'].notnull()
+                        plane_gaze = plane_gaze.with_columns(pl.col(f'marker_{i}_presence').fill_null(False) for i in markers)
 
             # merge in head pose
             if export_config.include_head_pose:
-                for pln in planes:
-                    merge_cols = [c for c in ('timestamp','timestamp_VOR','frame_idx','frame_idx_VOR') if c in plane_gazes.columns and c in head_pose[pln].columns]
+                for pln in cs_planes:
+                    merge_cols = [c for c in ('timestamp','timestamp_VOR','frame_idx','frame_idx_VOR') if c in plane_gaze.collect_schema().names() and c in head_pose[pln].collect_schema().names()]
                     if not merge_cols:
                         merge_cols = ['frame_idx']
-                    plane_gazes = plane_gazes.merge(head_pose[pln], how='left', on=merge_cols)
+                    plane_gaze = _left_join(plane_gaze, head_pose[pln], on=merge_cols)
 
             # add scene and reference camera timestamp info, if present
-            ts = pd.read_csv(working_dir / r / gt_naming.frame_timestamps_fname,sep='\t').rename(columns={'timestamp':'frame_ts'})
-            plane_gazes = plane_gazes.merge(ts, how="left", on='frame_idx')
+            plane_gaze = _left_join(plane_gaze, frame_ts, on='frame_idx')
             to_move = 1
-            if 'frame_idx_VOR' in plane_gazes.columns:
-                ts = ts.rename(columns={'frame_idx':'frame_idx_VOR','frame_ts':'frame_ts_VOR'})
-                plane_gazes = plane_gazes.merge(ts, how="left", on='frame_idx_VOR')
+            if 'frame_idx_VOR' in plane_gaze.collect_schema().names():
+                ts = frame_ts.rename({'frame_idx':'frame_idx_VOR','frame_ts':'frame_ts_VOR'})
+                plane_gaze = _left_join(plane_gaze, ts, on='frame_idx_VOR')
                 column_info['frame_ts_VOR'] = 'scene camera frame timestamp (ms) after gaze to camera sync'
                 to_move += 1
-            if 'frame_idx_ref' in plane_gazes.columns:
-                ts = pd.read_csv(working_dir / study_config.sync_ref_recording / gt_naming.frame_timestamps_fname,sep='\t').rename(columns={'frame_idx':'frame_idx_ref','timestamp':'frame_ts_ref','timestamp_stretched':'frame_ts_ref_stretched'})
-                plane_gazes = plane_gazes.merge(ts, how="left", on='frame_idx_ref')
+            if 'frame_idx_ref' in plane_gaze.collect_schema().names():
+                if ref_frame_ts is None:
+                    ref_frame_ts = pl.read_csv(working_dir / study_config.sync_ref_recording / gt_naming.frame_timestamps_fname, separator='\t').lazy()
+                    ref_frame_ts = ref_frame_ts.rename({'frame_idx':'frame_idx_ref','timestamp':'frame_ts_ref','timestamp_stretched':'frame_ts_ref_stretched'}, strict=False)
+                ts = ref_frame_ts
+                plane_gaze = _left_join(plane_gaze, ts, on='frame_idx_ref')
                 column_info['frame_ts_ref'] = 'reference camera frame timestamp (ms)'
                 column_info['frame_ts_ref_stretched'] = 'reference camera frame timestamp (ms), stretched so that clocks run at same rate'
-                to_move += len([c for c in ts.columns if c.startswith('frame_ts_')])
+                to_move += len([c for c in ts.collect_schema().names() if c.startswith('frame_ts_')])
             # reorder to get ts columns in the right place
-            cols= plane_gazes.columns.to_list()
+            cols= plane_gaze.collect_schema().names()
             idx = max([cols.index(c) for c in cols if c.startswith('frame_idx')])+1
             cols= cols[:idx] + cols[-to_move:] + cols[idx:-to_move]
-            plane_gazes = plane_gazes[cols]
 
             # add trial numbers
             idx = max([cols.index(c) for c in cols if c.startswith('frame_ts')])+1
-            plane_gazes.insert(idx,'trial',np.int32(-1))
-            for i,e in enumerate(episodes[nm][1]):
-                sel = (plane_gazes['frame_idx'] >= e[0]) & (plane_gazes['frame_idx'] <= e[1])
-                plane_gazes.loc[sel,'trial'] = i+1
+            trial = pl.col('frame_idx').map_batches(lambda f, eps=episodes[nm][1]: pl.Series(_get_trial_numbers(f.to_numpy(), eps)), return_dtype=pl.Int32, is_elementwise=True)
+            cols.insert(idx, 'trial')
+            plane_gaze = plane_gaze.with_columns(trial.alias('trial')).select(cols)
             column_info['trial'] = 'trial number (-1 means not during trial)'
 
             # store
             # to add second header row with column information, turn column index into a multiindex
             if export_config.include_unit_header_row:
-                headers = list(zip(*[(c, column_info.get(c, "")) for c in plane_gazes.columns]))
+                headers = list(zip(*[(c, column_info.get(c, "")) for c in cols]))
             else:
-                headers = [[c for c in plane_gazes.columns]]
-            # write into df (use polars as that library saves to file waaay faster). Open file manually so we can write header ourselves
-            plane_gazes = pl.from_pandas(plane_gazes)
+                headers = [[c for c in cols]]
+            # NaNs are written the same as missing values
+            plane_gaze = plane_gaze.with_columns(pl.selectors.float().fill_nan(None))
+            # write to file in a streaming fashion. Open file manually so we can write header ourselves
             with open(export_path / f'{naming.gaze_export_prefix}{working_dir.name}_{r}_{nm}.tsv', 'w', encoding="utf-8", newline="") as f:
                 w = csv.writer(f, delimiter="\t", lineterminator="\n", quoting=csv.QUOTE_MINIMAL)
                 for h in headers:
                     w.writerow(h)
-                plane_gazes.write_csv(f, separator='\t', null_value='nan', float_precision=8, include_header=False)
-
-def export_gaze_offsets(export_path: pathlib.Path, working_dir: pathlib.Path, study_config: config.Study, export_config: GazeOffset):
+                f.flush()
+                plane_gaze.sink_csv(f, separator='\t', null_value='nan', float_precision=8, include_header=False)
+
+def _outer_join(frames: list[pl.LazyFrame]) -> pl.LazyFrame:
+    # equivalent of successively doing pandas' df.merge(other, how='outer') for the frames: join on all shared
+    # columns and sort on them. NB: the frames hold gaze samples and are sorted on timestamp, which identifies the
+    # sample. Instead of a full join followed by a sort, which needs all data in memory, the timestamps of all frames
+    # are merged in order and the frames are then joined to them one by one with an as-of join on exact timestamp
+    # matches. Both of these can be streamed
+    schemas = [df.collect_schema().names() for df in frames]
+    cols    = list(dict.fromkeys(c for s in schemas for c in s))
+    out     = pl.merge_sorted([df.select('timestamp') for df in frames], key='timestamp').unique(maintain_order=True)
+    for df,s in zip(frames,schemas):
+        # columns shared with a previously joined frame are filled in with this frame's values where missing
+        shared = [c for c in s if c!='timestamp' and c in out.collect_schema().names()]
+        out = out.join_asof(df, on='timestamp', strategy='backward', tolerance=0, suffix='_other')
+        out = out.with_columns(pl.coalesce(c, f'{c}_other') for c in shared).drop(f'{c}_other' for c in shared)
+    return out.select(cols)
+
+def _left_join(df: pl.LazyFrame, other: pl.LazyFrame, on: str|list[str]) -> pl.LazyFrame:
+    # equivalent of pandas' df.merge(other, how='left', on=on). NB: like pandas does when not all rows have a match,
+    # added integer columns are turned into floats
+    on = [on] if isinstance(on,str) else on
+    other = other.with_columns(pl.col(c).cast(pl.Float64) for c,t in other.collect_schema().items() if c not in on and t.is_integer())
+    return df.join(other, on=on, how='left', maintain_order='left')
+
+def _get_trial_numbers(frame_idxs: np.ndarray, episodes: list[list[int]]) -> np.ndarray:
+    # trial number (position in the list of episodes, 1-based) for each frame, -1 if not during a trial.
+    # NB: if episodes overlap, frames in the overlap get the number of the last of those episodes in the list
+    ivals = np.array(episodes, dtype='int64').reshape(-1,2)
+    order = np.argsort(ivals[:,0], kind='stable')
+    if np.any(ivals[order[:-1],1]>=ivals[order[1:],0]):
+        # overlapping episodes: assign in list order so that later episodes overwrite earlier ones
+        trial = np.full(frame_idxs.shape, -1, dtype='int32')
+        for i,e in enumerate(ivals):
+            trial[(frame_idxs>=e[0]) & (frame_idxs<=e[1])] = i+1
+        return trial
+    # no overlap, so a single search through the episode starts suffices
+    idx   = order[np.clip(np.searchsorted(ivals[order,0], frame_idxs, side='right')-1, 0, None)]
+    in_trial = (frame_idxs>=ivals[idx,0]) & (frame_idxs<=ivals[idx,1])
+    return np.where(in_trial, idx+1, -1).astype('int32')
+
+def export_gaze_offsets(export_path: pathlib.Path, working_dir: pathlib.Path, study_config: config.Study, export_config: GazeOffset, episode_graph: episode.EpisodeGraph|None = None):
     episodes_to_proc = process.get_specific_event_types(study_config, check_specific_fields=['gaze_offset_setup'])
     if not episodes_to_proc:
         raise ValueError('No episodes configured for gaze offset computation (need at least one episode with planes defined)')
@@ -441,6 +481,12 @@ def export_gaze_offsets(export_path: pathlib.Path, working_dir: pathlib.Path, st
         raise ValueError('None of the selected gaze offset planes are configured for the selected episodes')
     all_planes = {p for pl in episode_planes.values() for p in pl}
 
+    if episode_graph is None:
+        episode_graph = episode.EpisodeGraph(study_config, working_dir)
+
+    # frame timestamps of the reference recording, shared between recordings. Loaded when first needed
+    ref_frame_ts: pd.DataFrame|None = None
+
     # per recording, read the relevant files and put them all together
     for r in export_config.recs:
         # check if files needed for export are present, else skip
@@ -448,7 +494,7 @@ def export_gaze_offsets(export_path: pathlib.Path, working_dir: pathlib.Path, st
             warnings.warn(f'Not all gaze offset files found for recording {r} in session {working_dir.name}. Skipping...', process_pool.ProcessingWarning)
             continue
         # get episode coding
-        episodes = episode.load_episodes_from_all_recordings(study_config, working_dir/r, {cs['name'] for cs in episodes_to_proc})[0]
+        episodes = episode.load_episodes_from_all_recordings(study_config, working_dir/r, {cs['name'] for cs in episodes_to_proc}, episode_graph=episode_graph)[0]
         if not any(episodes[e][1] for e in episodes):
             warnings.warn(f'No coding for any of the events with gaze offset setup was found in the coding file for recording {r} in session {working_dir.name}. Skipping...', process_pool.ProcessingWarning)
             continue
@@ -466,6 +512,9 @@ def export_gaze_offsets(export_path: pathlib.Path, working_dir: pathlib.Path, st
                     cols[c] = f'{c[:pos]}_{p}{c[pos:]}'
             gaze_offsets[p] = gaze_offsets[p].rename(columns=cols)
 
+        # frame timestamps, shared between the coding streams
+        frame_ts = pd.read_csv(working_dir / r / gt_naming.frame_timestamps_fname,sep='\t').rename(columns={'timestamp':'frame_ts'})
+
         # rest per coding stream
         ori_gaze_offsets = copy.deepcopy(gaze_offsets)
         for cs in episodes_to_proc:
@@ -497,15 +546,16 @@ def export_gaze_offsets(export_path: pathlib.Path, working_dir: pathlib.Path, st
             gaze_offsets = gaze_offsets.dropna(axis=1, how='all')
 
             # add scene and reference camera timestamp info, if present
-            ts = pd.read_csv(working_dir / r / gt_naming.frame_timestamps_fname,sep='\t').rename(columns={'timestamp':'frame_ts'})
-            gaze_offsets = gaze_offsets.merge(ts, how="left", on='frame_idx')
+            gaze_offsets = gaze_offsets.merge(frame_ts, how="left", on='frame_idx')
             to_move = 1
             if 'frame_idx_VOR' in gaze_offsets.columns:
-                ts = ts.rename(columns={'frame_idx':'frame_idx_VOR','frame_ts':'frame_ts_VOR'})
+                ts = frame_ts.rename(columns={'frame_idx':'frame_idx_VOR','frame_ts':'frame_ts_VOR'})
                 gaze_offsets = gaze_offsets.merge(ts, how="left", on='frame_idx_VOR')
                 to_move += 1
             if 'frame_idx_ref' in gaze_offsets.columns:
-                ts = pd.read_csv(working_dir / study_config.sync_ref_recording / gt_naming.frame_timestamps_fname,sep='\t').rename(columns={'frame_idx':'frame_idx_ref','timestamp':'frame_ts_ref','timestamp_stretched':'frame_ts_ref_stretched'})
+                if ref_frame_ts is None:
+                    ref_frame_ts = pd.read_csv(working_dir / study_config.sync_ref_recording / gt_naming.frame_timestamps_fname,sep='\t').rename(columns={'frame_idx':'frame_idx_ref','timestamp':'frame_ts_ref','timestamp_stretched':'frame_ts_ref_stretched'})
+                ts = ref_frame_ts
                 gaze_offsets = gaze_offsets.merge(ts, how="left", on='frame_idx_ref')
                 to_move += len([c for c in ts.columns if c.startswith('frame_ts_')])
             # reorder to get ts columns in the right place
@@ -516,10 +566,7 @@ def export_gaze_offsets(export_path: pathlib.Path, working_dir: pathlib.Path, st
 
             # add trial numbers
             idx = max([cols.index(c) for c in cols if c.startswith('frame_ts')])+1
-            gaze_offsets.insert(idx,'trial',np.int32(-1))
-            for i,e in enumerate(episodes[nm][1]):
-                sel = (gaze_offsets[subset_var] >= e[0]) & (gaze_offsets[subset_var] <= e[1])
-                gaze_offsets.loc[sel,'trial'] = i+1
+            gaze_offsets.insert(idx,'trial',_get_trial_numbers(gaze_offsets[subset_var].to_numpy(), episodes[nm][1]))
 
             # store
             if export_config.include_unit_header_row:
@@ -562,19 +609,19 @@ def export_gaze_offsets(export_path: pathlib.Path, working_dir: pathlib.Path, st
                     w.writerow(h)
                 gaze_offsets.write_csv(f, separator='\t', null_value='nan', float_precision=8, include_header=False)
 
-def export_gazeOverlay_video(export_path: pathlib.Path, working_dir: pathlib.Path, export_config: GazeOverlayVideo):
+def export_gazeOverlay_video(export_path: pathlib.Path, working_dir: pathlib.Path, export_config: GazeOverlayVideo, strategy: _file_export.Strategy = 'copy'):
     for r in export_config.recs:
         inFile = working_dir/r/gt_naming.gaze_overlay_video_file
         if not inFile.is_file():
             continue
-        shutil.copy2(inFile, export_path / f'gazeOverlay_{working_dir.name}_{r}.mp4')
+        _file_export.export(inFile, export_path / f'gazeOverlay_{working_dir.name}_{r}.mp4', strategy)
 
-def export_mappedGaze_video(export_path: pathlib.Path, working_dir: pathlib.Path, export_config: OptionBase):
+def export_mappedGaze_video(export_path: pathlib.Path, working_dir: pathlib.Path, export_config: OptionBase, strategy: _file_export.Strategy = 'copy'):
     for r in export_config.recs:
         inFile = working_dir/r/naming.mapped_gaze_video
         if not inFile.is_file():
             continue
-        shutil.copy2(inFile, export_path / f'mappedGaze_{working_dir.name}_{r}.mp4')
+        _file_export.export(inFile, export_path / f'mappedGaze_{working_dir.name}_{r}.mp4', strategy)
 
 def export_validation(export_path: pathlib.Path, val_export_config: Validation):
     for nm in val_export_config.episodes:
@@ -1,11 +1,11 @@
 import pathlib
 
-from glassesTools import gaze_headref, gaze_worldref, naming as gt_naming, ocv, plane as gt_plane, pose as gt_pose, process_pool, propagating_thread
+from glassesTools import gaze_worldref, naming as gt_naming, ocv, plane as gt_plane, pose as gt_pose, process_pool, propagating_thread
 from glassesTools.gui import worldgaze as worldgaze_gui
 from glassesTools.gui.video_player import GUI
 
 from .. import config, episode, naming, plane, process, session
-from . import _pose_files
+from . import _gaze_files, _pose_files
 
 
 def run(working_dir: str|pathlib.Path, config_dir: str|pathlib.Path|None = None, show_visualization=False, show_planes=True, show_only_intervals=True, progress_indicator: process_pool.JobProgress|None=None, **study_settings):
@@ -79,7 +79,7 @@ def do_the_work(working_dir: pathlib.Path, config_dir: pathlib.Path, gui: GUI|No
     # load gaze data and poses
     processing_intervals = [e for p in mapping_setup for e in mapping_setup[p]] # NB: doesn't need to be sorted
     should_load_part = not gui or show_only_intervals
-    head_gazes = gaze_headref.read_dict_from_file(working_dir / gt_naming.gaze_data_fname, processing_intervals if should_load_part else None, ts_column_suffixes=['VOR', ''])[0]
+    head_gazes = _gaze_files.read_dict_from_file(working_dir, processing_intervals if should_load_part else None, ts_column_suffixes=['VOR', ''])[0]
     poses = {p:_pose_files.read_preferred_plane_pose(working_dir, p, mapping_setup[p] if should_load_part else None) for p in mapping_setup}
     visualization_poses = poses
     if gui is not None:
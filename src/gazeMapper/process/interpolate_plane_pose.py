@@ -1,8 +1,9 @@
 import pathlib
 
-from glassesTools import gaze_headref, naming as gt_naming, pose as gt_pose, process_pool, timestamps
+from glassesTools import naming as gt_naming, pose as gt_pose, process_pool, timestamps
 
 from .. import config, naming, process, session
+from . import _gaze_files
 
 
 def run(working_dir: str|pathlib.Path, config_dir: str|pathlib.Path|None = None, progress_indicator: process_pool.JobProgress|None=None, **study_settings):
@@ -33,7 +34,7 @@ def run(working_dir: str|pathlib.Path, config_dir: str|pathlib.Path|None = None,
     if not pose_files:
         raise FileNotFoundError(f'No plane pose files found in "{working_dir}". Run Detect Markers first.')
 
-    gazes = gaze_headref.read_dict_from_file(working_dir / gt_naming.gaze_data_fname, ts_column_suffixes=['VOR',''])[0]
+    gazes = _gaze_files.read_dict_from_file(working_dir, ts_column_suffixes=['VOR',''])[0]
     video_ts = timestamps.VideoTimestamps(working_dir / gt_naming.frame_timestamps_fname)
 
     total = sum(len(samples) for samples in gazes.values()) * len(pose_files)
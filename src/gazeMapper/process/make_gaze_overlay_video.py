@@ -1,9 +1,16 @@
 import pathlib
+import multiprocessing
+import cv2
+import numpy as np
 
-from glassesTools import gaze_overlay_video, naming as gt_naming, process_pool, propagating_thread, timestamps
+import ffpyplayer.tools
+from fractions import Fraction
+
+from glassesTools import gaze_headref, gaze_overlay_video, naming as gt_naming, ocv, process_pool, propagating_thread, timestamps, video_utils
 from glassesTools.gui import video_player
 
 from .. import config, process, session
+from . import _ffmpeg, _utils, _video_writer
 
 
 def run(working_dir: str|pathlib.Path, config_dir: str|pathlib.Path|None=None, show_visualization=False, progress_indicator: process_pool.JobProgress|None=None, **study_settings):
@@ -50,6 +57,36 @@ def do_the_work(working_dir: pathlib.Path, config_dir: pathlib.Path, gui: video_
     in_video = session.read_recording_info(working_dir, rec_def.type)[1]
     video_ts = timestamps.VideoTimestamps(working_dir / gt_naming.frame_timestamps_fname)
 
+    # prep progress indicator
+    progress_indicator.set_total(total:=video_ts.get_last()[0])
+    progress_indicator.set_intervals(step:=min(20,int(total/200)), step)
+
+    # render in segments in parallel, if wanted and possible
+    # NB: daemonic processes (such as the workers used by the GUI) cannot have children, and segments
+    # are joined using ffmpeg, so it is needed
+    if gui is None and study_config.overlay_video_num_segments>1 and not multiprocessing.current_process().daemon and _ffmpeg.is_available():
+        # update state: set to not run so that if we crash or cancel below the task is correctly marked as not run (video files are corrupt)
+        session.update_action_states(working_dir, process.Action.MAKE_GAZE_OVERLAY_VIDEO, process_pool.State.Not_Run, study_config)
+        out_file   = working_dir / gt_naming.gaze_overlay_video_file
+        boundaries = np.linspace(0, total+1, study_config.overlay_video_num_segments+1).round().astype('int')
+        segments   = [(int(s),int(e)-1) for s,e in zip(boundaries[:-1],boundaries[1:]) if e>s]
+        # NB: colors are provided in RGB, drawn in BGR
+        vid_pos_look   = (study_config.overlay_video_gaze_vid_pos_color[::-1], study_config.overlay_video_gaze_vid_pos_radius, study_config.overlay_video_gaze_vid_pos_thickness)
+        world_pos_look = (None if study_config.overlay_video_gaze_world_pos_color is None else study_config.overlay_video_gaze_world_pos_color[::-1], study_config.overlay_video_gaze_world_pos_radius, study_config.overlay_video_gaze_world_pos_thickness)
+        jobs = [(working_dir, in_video, s, out_file.with_stem(f'{out_file.stem}_segment_{i+1:02d}'), vid_pos_look, world_pos_look) for i,s in enumerate(segments)]
+        _utils.run_jobs(_render_segment, jobs, len(jobs), lambda i,_: progress_indicator.update(n=segments[i][1]-segments[i][0]+1))
+
+        # join segments, adding audio (if any) in the same pass
+        audio_args = None
+        if _ffmpeg.has_audio(in_video):
+            # transcode audio if source file is not mp4-style, since some audio formats allowed in e.g. avi and mkv are not allowed in mp4
+            audio_args = ['-i', str(in_video), '-map', '0:v:0', '-map', '1:a:0?', '-c:v', 'copy', *(['-c:a', 'copy'] if video_utils.is_isobmmf(in_video) else []), '-shortest']
+        _ffmpeg.concat(out_file, [j[3] for j in jobs], audio_args)
+
+        # update state
+        session.update_action_states(working_dir, process.Action.MAKE_GAZE_OVERLAY_VIDEO, process_pool.State.Completed, study_config)
+        return
+
     # set up gaze overlay video maker and run it
     video_maker = gaze_overlay_video.VideoMaker(working_dir, in_video, video_ts, working_dir / gt_naming.scene_camera_calibration_fname, working_dir / gt_naming.gaze_data_fname)
     video_maker.set_vid_pos_look(study_config.overlay_video_gaze_vid_pos_color, study_config.overlay_video_gaze_vid_pos_radius, study_config.overlay_video_gaze_vid_pos_thickness)
@@ -57,10 +94,6 @@ def do_the_work(working_dir: pathlib.Path, config_dir: pathlib.Path, gui: video_
     video_maker.attach_gui(gui)
     if gui is not None:
         gui.set_show_timeline(True, video_ts, window_id=gui.main_window_id)
-
-    # prep progress indicator
-    progress_indicator.set_total(total:=video_ts.get_last()[0])
-    progress_indicator.set_intervals(step:=min(20,int(total/200)), step)
     video_maker.set_progress_updater(progress_indicator.update)
 
     # update state: set to not run so that if we crash or cancel below the task is correctly marked as not run (video files are corrupt)
@@ -71,3 +104,77 @@ def do_the_work(working_dir: pathlib.Path, config_dir: pathlib.Path, gui: video_
 
     # update state
     session.update_action_states(working_dir, process.Action.MAKE_GAZE_OVERLAY_VIDEO, process_pool.State.Completed, study_config)
+
+
+def _render_segment(working_dir: pathlib.Path, in_video: pathlib.Path, segment: tuple[int,int], out_file: pathlib.Path, vid_pos_look: tuple, world_pos_look: tuple):
+    # NB: run in a worker process
+    # renders the frames of the segment (first and last frame, inclusive) as gaze_overlay_video.VideoMaker does, but
+    # without adding audio, which is done when the segments are joined. Only the gaze data for the segment is loaded
+    # and at most a few frames are held in memory, so that memory use does not grow with the length of the segment
+    video_ts    = timestamps.VideoTimestamps(working_dir / gt_naming.frame_timestamps_fname)
+    video       = _open_video_at(in_video, video_ts, segment[0])
+    cam_params  = ocv.CameraParams.read_from_file(working_dir / gt_naming.scene_camera_calibration_fname)
+    gazes       = gaze_headref.read_dict_from_file(working_dir / gt_naming.gaze_data_fname, [list(segment)])[0]
+
+    # set up output video
+    fps      = 1000/video_ts.get_IFI()
+    res      = (int(video.get_prop(cv2.CAP_PROP_FRAME_WIDTH)), int(video.get_prop(cv2.CAP_PROP_FRAME_HEIGHT)))
+    codec    = ffpyplayer.tools.get_format_codec(fmt=out_file.suffix[1:])
+    pix_fmt  = ffpyplayer.tools.get_best_pix_fmt('bgr24',ffpyplayer.tools.get_supported_pixfmts(codec))
+    fpsFrac  = Fraction(fps).limit_denominator(10000).as_integer_ratio()
+    out_opts = {'pix_fmt_in':'bgr24', 'pix_fmt_out':pix_fmt, 'width_in':res[0], 'height_in':res[1], 'frame_rate':fpsFrac}
+    vid_writer = _video_writer.QueuedVideoWriter(out_file, out_opts, 4)
+
+    try:
+        wanted_frame_idx = segment[0]
+        while True:
+            should_exit, frame, frame_idx, _ = video.read_frame(report_gap=True, wanted_frame_idx=wanted_frame_idx)
+            wanted_frame_idx = None
+            if should_exit or frame_idx>segment[1]:
+                break
+            if frame is None:
+                # we don't have a valid frame, use a fully black frame
+                frame = np.zeros((res[1],res[0],3), np.uint8)
+            for g in gazes.get(frame_idx, []):
+                g.draw(frame, cam_params, sub_pixel_fac=8,
+                       clr=vid_pos_look[0], radius=vid_pos_look[1], thickness=vid_pos_look[2],
+                       draw_3d_gaze_point=world_pos_look[0] is not None,
+                       world_clr=world_pos_look[0], world_radius=world_pos_look[1], world_thickness=world_pos_look[2])
+            # timestamps are relative to the start of the segment, so that segments can be concatenated
+            vid_writer.write_frame(frame, pts=(frame_idx-segment[0])/fps)
+    except:
+        # stop encoder thread. Errors while closing are ignored so that the original error is reported
+        try:
+            vid_writer.close()
+        except:
+            pass
+        raise
+    vid_writer.close()
+
+
+def _open_video_at(in_video: pathlib.Path, video_ts: timestamps.VideoTimestamps, frame_idx: int) -> ocv.CV2VideoReader:
+    # open the video such that reading frame frame_idx does not require decoding all frames before it. Seeking with
+    # OpenCV does not reliably land on the requested frame (e.g. for variable frame rate video), so the video is
+    # positioned about a second before the wanted frame, the frame landed on is determined from its timestamp, and the
+    # reader then spools to the wanted frame as usual. If the position cannot be established, the video is read from
+    # the start, so that frame indices are always identical to when the whole video is rendered
+    video = ocv.CV2VideoReader(in_video, video_ts.timestamps)
+    ifi   = video_ts.get_IFI()
+    if (seek_idx:=frame_idx-int(round(1000/ifi)))<=0:
+        return video
+    # reference point for relating OpenCV's timestamps to ours
+    ret, _ = video.cap.read()
+    ts0_ocv = video.get_prop(cv2.CAP_PROP_POS_MSEC)
+    if not ret or not video.set_prop(cv2.CAP_PROP_POS_FRAMES, seek_idx):
+        return ocv.CV2VideoReader(in_video, video_ts.timestamps)
+    ret, frame = video.cap.read()
+    ts_ocv = video.get_prop(cv2.CAP_PROP_POS_MSEC)
+    ts     = video.ts-video.ts[0]
+    idx    = int(np.argmin(np.abs(ts-(ts_ocv-ts0_ocv))))
+    if not ret or frame is None or idx>frame_idx or abs(ts[idx]-(ts_ocv-ts0_ocv))>ifi/2:
+        return ocv.CV2VideoReader(in_video, video_ts.timestamps)
+    # continue from the frame landed on
+    video.frame_idx     = idx
+    video._last_good_ts = (idx, ts_ocv, video.ts[idx])
+    video._cache        = (False, frame, idx, video.ts[idx])
+    return video
@@ -1,14 +1,11 @@
-import shutil
-import os
+import copy
 import pathlib
 import math
+import multiprocessing
 import cv2
 import numpy as np
-import subprocess
 import typing
 
-from ffpyplayer.writer import MediaWriter
-from ffpyplayer.pic import Image
 import ffpyplayer.tools
 from fractions import Fraction
 
@@ -16,6 +13,7 @@ from glassesTools import annotation, aruco, drawing, gaze_headref, gaze_worldref
 from glassesTools.gui import video_player
 
 from .. import config, episode, marker, naming, process, session, synchronization
+from . import _ffmpeg, _frame_source, _gaze_files, _overlay, _utils, _video_writer
 from .detect_markers import _get_plane_setup
 from .run_sync_function import _get_sync_function
 
@@ -52,41 +50,47 @@ def _needs_live_estimator(rec: str, rec_type: session.RecordingType, study_confi
     overlay_targets.update(study_config.mapped_video_show_gaze_vec_in_which or ())
     return bool((output_recs - {rec}) & overlay_targets)
 
-def _get_active_episode_indices(frame_idx: int, episodes: episode.EpisodeMap) -> list[tuple[str, int]]:
-    active: list[tuple[str, int]] = []
-    for name in episodes:
-        for idx, iv in enumerate(episodes[name][1]):
-            if len(iv)==1:
-                if frame_idx==iv[0]:
-                    active.append((name, idx))
-            elif iv[0] <= frame_idx <= iv[1]:
-                active.append((name, idx))
-    return active
 
+# settings used for making a draft of the mapped gaze video: a quick, lower quality version for checking the result.
+# Settings provided by the caller take precedence
+draft_settings = {
+    'mapped_video_preset': 'ultrafast',
+    'mapped_video_crf': 32,
+    'mapped_video_scale': .5,
+    'mapped_video_frame_stride': 2,
+}
 
-def run(working_dir: str|pathlib.Path, config_dir: str|pathlib.Path|None = None, show_visualization=False, progress_indicator: process_pool.JobProgress|None = None, **study_settings):
+def run(working_dir: str|pathlib.Path, config_dir: str|pathlib.Path|None = None, show_visualization=False, progress_indicator: process_pool.JobProgress|None = None, draft=False, **study_settings):
     # if show_visualization, the generated video(s) are shown as they are created in a viewer
+    # if draft, a draft version of the video(s) is made using draft_settings, which is stored alongside (does not replace)
+    # the normal video(s). Making a draft does not change the state of the MAKE_MAPPED_GAZE_VIDEO action
     working_dir  = pathlib.Path(working_dir) # working directory of a session, not of a recording
     if config_dir is None:
         config_dir = config.guess_config_dir(working_dir)
     config_dir  = pathlib.Path(config_dir)
     print(f'processing: {working_dir.name}')
+    if draft:
+        study_settings = draft_settings | study_settings
 
     if show_visualization:
         # We run processing in a separate thread (GUI needs to be on the main thread for OSX, see https://github.com/pthom/hello_imgui/issues/33)
         gui = video_player.GUI(use_thread = False)
         gui.add_window(working_dir.name)
 
-        proc_thread = propagating_thread.PropagatingThread(target=do_the_work, args=(working_dir, config_dir, gui, progress_indicator), kwargs=study_settings, cleanup_fun=gui.stop)
+        proc_thread = propagating_thread.PropagatingThread(target=do_the_work, args=(working_dir, config_dir, gui, progress_indicator), kwargs={'draft': draft, **study_settings}, cleanup_fun=gui.stop)
         proc_thread.start()
         gui.start()
         proc_thread.join()
     else:
-        do_the_work(working_dir, config_dir, None, progress_indicator, **study_settings)
+        do_the_work(working_dir, config_dir, None, progress_indicator, draft=draft, **study_settings)
 
-def do_the_work(working_dir: pathlib.Path, config_dir: pathlib.Path, gui: video_player.GUI|None, progress_indicator: process_pool.JobProgress|None, **study_settings):
+def do_the_work(working_dir: pathlib.Path, config_dir: pathlib.Path, gui: video_player.GUI|None, progress_indicator: process_pool.JobProgress|None, segment: tuple[int,int,int,int]|None = None, draft=False, **study_settings):
+    # if segment is provided (video set index, segment index, first frame, last frame), only the indicated frames of the
+    # lead video of the indicated video set are rendered, to a segment file. Used for rendering segments in parallel
     has_gui = gui is not None
     sub_pixel_fac = 8   # for anti-aliased drawing
+    text_boxes = _overlay.TextBoxCache(cv2.FONT_HERSHEY_PLAIN, 2, 2, margin=5)
+    video_file = naming.mapped_gaze_video_draft if draft else naming.mapped_gaze_video
 
     # progress indicator
     if progress_indicator is None:
@@ -123,12 +127,13 @@ def do_the_work(working_dir: pathlib.Path, config_dir: pathlib.Path, gui: video_
     recs = set(session_info.recordings)
     sync = None
     ref_frame_idxs: dict[str, list[int]] = {}
+    episode_graph = episode.EpisodeGraph(study_config, working_dir)
     for rec in recs:
         rec_def = session_info.recordings[rec].definition
         rec_working_dir = working_dir / rec
 
         # get coded interval(s), if any
-        episodes[rec], _, episode_source_refs[rec], imported_episodes[rec] = episode.load_episodes_from_all_recordings_with_info(study_config, rec_working_dir, error_if_unwanted_found=False, missing_other_coding_ok=True)
+        episodes[rec], _, episode_source_refs[rec], imported_episodes[rec] = episode.load_episodes_from_all_recordings_with_info(study_config, rec_working_dir, error_if_unwanted_found=False, missing_other_coding_ok=True, episode_graph=episode_graph)
         episodes[rec] = episode.copy_episode_map(empty_episodes) | episodes[rec]
         episode_source_refs[rec] = episode.copy_episode_source_refs(episode_source_refs[rec])
         for name in episodes[rec]:
@@ -140,7 +145,7 @@ def do_the_work(working_dir: pathlib.Path, config_dir: pathlib.Path, gui: video_
         # Read gaze data
         if rec_def.type==session.RecordingType.Eye_Tracker:
             # NB: we want to use synced gaze data for these videos, if available
-            gazes_head[rec] = gaze_headref.read_dict_from_file(rec_working_dir / gt_naming.gaze_data_fname, ts_column_suffixes=['ref', 'VOR', ''])[0]
+            gazes_head[rec] = _gaze_files.read_dict_from_file(rec_working_dir, ts_column_suffixes=['ref', 'VOR', ''])[0]
             # check we have timestamps synced to ref, if relevant
             if study_config.sync_ref_recording and rec!=study_config.sync_ref_recording:
                 if gazes_head[rec][next(iter(gazes_head[rec]))][0].timestamp_ref is None:
@@ -177,9 +182,9 @@ def do_the_work(working_dir: pathlib.Path, config_dir: pathlib.Path, gui: video_
         episodes_as_ref[ref_rec] = episode.copy_episode_map(episodes[ref_rec])
         for r in sync_recs:
             # for each frame in the reference video, get the corresponding frame in this recording
-            ref_frame_idxs[r] = synchronization.reference_frames_to_video(r, sync, videos_ts[ref_rec].indices, videos_ts[r].timestamps, videos_ts[ref_rec].timestamps, do_time_stretch, stretch_which)
+            ref_frame_idxs[r] = synchronization.reference_frames_to_video(r, sync, videos_ts[ref_rec].indices, videos_ts[r].timestamps, videos_ts[ref_rec].timestamps, do_time_stretch, stretch_which, working_dir / r)
             ref_frame_idxs[r] = synchronization.smooth_video_frames_indices(ref_frame_idxs[r])
-            episodes_as_ref[r] = synchronization.video_episode_dict_to_reference(r, sync, episodes[r], videos_ts[r].timestamps, videos_ts[ref_rec].timestamps, do_time_stretch, stretch_which)
+            episodes_as_ref[r] = synchronization.video_episode_dict_to_reference(r, sync, episodes[r], videos_ts[r].timestamps, videos_ts[ref_rec].timestamps, do_time_stretch, stretch_which, working_dir / r)
 
 
         # fix episodes with start or end points outside the reference video
@@ -204,6 +209,8 @@ def do_the_work(working_dir: pathlib.Path, config_dir: pathlib.Path, gui: video_
 
     # flatten the episodes for each recording, that's what the GUI and movie annotator want
     episodes_as_ref_flat = {r: _flatten_episodes(episodes_as_ref[r]) for r in episodes_as_ref}
+    # lookup of active episodes, queried for each rendered frame
+    active_episodes = {r: episode.ActiveEpisodeLookup(episodes_as_ref[r]) for r in episodes_as_ref}
 
     if study_config.sync_ref_recording and sync is not None:
         # check that all camera sync point frames of a recording are in the reference recordings sync frames (a recording may miss some, but the ones it has must be equal)
@@ -275,21 +282,39 @@ def do_the_work(working_dir: pathlib.Path, config_dir: pathlib.Path, gui: video_
             else:
                 vid_info[rec] = (*vid_info[rec][:2], 1000/videos_ts[rec].get_IFI(timestamps.Type.Normal))
 
+    # gaze projected to the planes by the GAZE_TO_PLANE action is reused where available, so that it only has to be
+    # computed for the gaze samples for which it is missing
+    stored_plane_gazes: dict[str, dict[int, list[dict[str, gaze_worldref.Gaze]]]] = {}
+    if process.mapped_video_uses_plane_gaze(study_config):
+        stored_plane_gazes = {rec: _get_stored_plane_gazes(working_dir / rec, list(planes), gazes_head[rec]) for rec in gazes_head if _can_reuse_plane_gazes(rec, session_info.recordings[rec].state, study_config)}
+
     video_sets: list[tuple[str, set[str], set[str]]] = []
     if study_config.sync_ref_recording:
         video_sets.append((study_config.sync_ref_recording,{r for r in study_config.mapped_video_make_which if r!=study_config.sync_ref_recording}, recs))
     else:
         video_sets.extend((r, set(), {r}) for r in study_config.mapped_video_make_which)
 
+    # output size (scaled, if wanted). NB: rounded to even sizes, as required by most pixel formats
+    out_size = {v: tuple(max(2, int(round(x*study_config.mapped_video_scale/2))*2) for x in vid_info[v][:2]) for v in vid_info}
+    # overlays are drawn on the scaled frames, so that their size and line thickness do not depend on the scale. Image
+    # positions computed at the video's resolution are scaled to the output, projections use scaled camera parameters
+    draw_scale = {v: np.array(out_size[v])/vid_info[v][:2] for v in vid_info}
+    draw_camera_params = {v: _scale_camera_params(camera_params[v], out_size[v]) for v in vid_info}
+    stride = study_config.mapped_video_frame_stride
+
     gui_window_ids: dict[str, int] = {}
     # per set of videos
     for vs_idx, (lead_vid, other_vids, proc_vids) in enumerate(video_sets):
-        vid_writer          : dict[str, MediaWriter]                        = {}
+        if segment is not None and vs_idx!=segment[0]:
+            continue
+        vid_writer          : dict[str, _video_writer.QueuedVideoWriter]    = {}
         frame               : dict[str, np.ndarray | None]                  = {}
         frame_idx           : dict[str, int | None]                         = {}
         frame_ts            : dict[str, float | None]                       = {}
         frame_info          : dict[str, dict[str, typing.Any] | None]       = {}
         ppose               : dict[str, dict[str, pose.Pose] | None]        = {}
+        # frames of the other videos are read through a frame source, so that each frame is decoded once
+        frame_sources       : dict[str, _frame_source.FrameSource]          = {v: _frame_source.FrameSource(pose_estimators[v], ref_frame_idxs[v], stride=stride) for v in proc_vids-set([lead_vid]) if v in pose_estimators}
 
         all_vids    = set([lead_vid]) | other_vids
         # videos to be written out may not be equal to all_vids, since user can configure
@@ -313,7 +338,7 @@ def do_the_work(working_dir: pathlib.Path, config_dir: pathlib.Path, gui: video_
                     gui_window_ids[v] = gui_obj.add_window(f'{working_dir.name}: {v}')
                 gui_obj.set_detachable(True)
                 gui_obj.set_show_timeline(True, videos_ts[lead_vid], episodes_as_ref_flat[v], gui_window_ids[v])
-                gui_obj.set_frame_size(vid_info[v][:2], gui_window_ids[v])
+                gui_obj.set_frame_size(out_size[v], gui_window_ids[v])
                 gui_obj.set_show_controls(True, gui_window_ids[v])
                 gui_obj.set_timecode_position('r', gui_window_ids[v])
                 gui_obj.set_show_play_percentage(True, gui_window_ids[v])
@@ -324,18 +349,43 @@ def do_the_work(working_dir: pathlib.Path, config_dir: pathlib.Path, gui: video_
         progress_indicator.set_total(total:=videos_ts[lead_vid].get_last()[0])
         progress_indicator.set_intervals(step:=min(20,int(total/200)), step)
 
-        # open output video files
+        # render in segments in parallel, if wanted and possible
+        # NB: daemonic processes (such as the workers used by the GUI) cannot have children, and segments
+        # are joined using ffmpeg, so it is needed
+        if segment is None and not has_gui and study_config.mapped_video_num_segments>1 and not multiprocessing.current_process().daemon and _ffmpeg.is_available():
+            # update state: set to not run so that if we crash or cancel below the task is correctly marked as not run (video files are corrupt)
+            if not draft:
+                session.update_action_states(working_dir, process.Action.MAKE_MAPPED_GAZE_VIDEO, process_pool.State.Not_Run, study_config)
+            audio_args = {v: _get_audio_args(v, lead_vid, in_videos, ref_frame_idxs, videos_ts) for v in write_vids}
+            segments = _get_segments(total+1, study_config.mapped_video_num_segments, [episodes_as_ref_flat[v] for v in write_vids], stride)
+            jobs = [(working_dir, config_dir, (vs_idx, i, s[0], s[1]), draft, study_settings) for i,s in enumerate(segments)]
+            _utils.run_jobs(_render_segment, jobs, len(jobs), lambda i,_: progress_indicator.update(n=segments[i][1]-segments[i][0]+1))
+            for v in write_vids:
+                # join segments and add audio in one pass
+                _ffmpeg.concat(working_dir / v / video_file, [working_dir / v / _get_segment_file_name(video_file, i) for i in range(len(segments))], None if audio_args[v] is None else [*audio_args[v], '-c:v', 'copy'])
+            continue
+
+        # if ffmpeg is on path and the source video has audio, the frames are encoded by ffmpeg, which adds the audio
+        # while writing the output video
+        audio_args = {v: _get_audio_args(v, lead_vid, in_videos, ref_frame_idxs, videos_ts) for v in write_vids} if segment is None else {}
+
+        # open output video files. Each is encoded on its own thread
         for v in write_vids:
-            # get which pixel format
-            codec    = ffpyplayer.tools.get_format_codec(fmt=pathlib.Path(naming.mapped_gaze_video).suffix[1:])
+            out_file = video_file if segment is None else _get_segment_file_name(video_file, segment[1])
+            # get which codec and pixel format
+            codec    = study_config.mapped_video_codec or ffpyplayer.tools.get_format_codec(fmt=pathlib.Path(video_file).suffix[1:])
             pix_fmt  = ffpyplayer.tools.get_best_pix_fmt('bgr24',ffpyplayer.tools.get_supported_pixfmts(codec))
             fpsFrac  = Fraction(vid_info[lead_vid][2]).limit_denominator(10000).as_integer_ratio()
+            lib_opts = {k:str(o) for k,o in (('preset',study_config.mapped_video_preset),('crf',study_config.mapped_video_crf)) if o is not None}
             # scene video
-            out_opts = {'pix_fmt_in':'bgr24', 'pix_fmt_out':pix_fmt, 'width_in':vid_info[v][0], 'height_in':vid_info[v][1], 'frame_rate':fpsFrac}
-            vid_writer[v] = MediaWriter(str(working_dir / v / naming.mapped_gaze_video), [out_opts], overwrite=True)
+            out_opts = {'pix_fmt_in':'bgr24', 'pix_fmt_out':pix_fmt, 'codec':codec, 'width_in':out_size[v][0], 'height_in':out_size[v][1], 'frame_rate':fpsFrac}
+            vid_writer[v] = _video_writer.QueuedVideoWriter(working_dir / v / out_file, out_opts, study_config.mapped_video_encode_queue_size, lib_opts, audio_args.get(v))
 
         # update state: set to not run so that if we crash or cancel below the task is correctly marked as not run (video files are corrupt)
-        session.update_action_states(working_dir, process.Action.MAKE_MAPPED_GAZE_VIDEO, process_pool.State.Not_Run, study_config)
+        if segment is None and not draft:
+            session.update_action_states(working_dir, process.Action.MAKE_MAPPED_GAZE_VIDEO, process_pool.State.Not_Run, study_config)
+        # when rendering a segment, timestamps are relative to the start of the segment, so that segments can be concatenated
+        pts_offset = 0 if segment is None else segment[2]
 
         # now make the video
         def n_digit(value):
@@ -346,173 +396,196 @@ def do_the_work(working_dir: pathlib.Path, config_dir: pathlib.Path, gui: video_
         timestamp_width |= {v: n_digit_timestamp(videos_ts[v].get_timestamp(max(ref_frame_idxs[v]))) for v in other_vids}
         frame_idx_width = {lead_vid: n_digit(videos_ts[lead_vid].get_last()[0])}
         frame_idx_width |= {v: n_digit(max(ref_frame_idxs[v])) for v in other_vids}
-        should_exit = False
-        while True:
-            if should_exit:
-                break
-            status, ppose[lead_vid], _, _, (frame[lead_vid], frame_idx[lead_vid], frame_ts[lead_vid], frame_info[lead_vid]) = \
-                pose_estimators[lead_vid].process_one_frame()
-            # TODO: if there is a discontinuity, fill in the missing frames so audio stays in sync
-            # check if we're done
-            if status==pose.Status.Finished:
-                break
-            # NB: no need to handle pose.Status.Skip, since we didn't provide the pose estimator with any analysis intervals (we want to process the whole video)
-            lead_frame_idx = typing.cast(int, frame_idx[lead_vid])
-            lead_frame_ts = typing.cast(float, frame_ts[lead_vid])
-
-            for v in proc_vids-set([lead_vid]):
-                # find corresponding frame
-                fr_idx_this = ref_frame_idxs[v][lead_frame_idx]
-
-                if fr_idx_this==-1:
-                    _, ppose[v], _, _, (frame[v], frame_idx[v], frame_ts[v], frame_info[v]) = \
-                        None, None, None, None, (None, None, None, None)
-                else:
-                    # read it
-                    _, ppose[v], _, _, (frame[v], frame_idx[v], frame_ts[v], frame_info[v]) = \
-                        pose_estimators[v].process_one_frame(fr_idx_this)
-
-            for v in write_vids:
-                if frame[v] is None:
-                    # we don't have a valid frame, use a fully black frame
-                    frame[v] = np.zeros((vid_info[v][1],vid_info[v][0],3), np.uint8)   # black image
-            ROI_offsets = {
-                v: (frame_info[v]['offset_x'], frame_info[v]['offset_y'])
-                if frame_info[v] is not None and 'offset_x' in frame_info[v] and 'offset_y' in frame_info[v]
-                else (0,0)
-                for v in write_vids
-            }
-
-            # draw gaze on the video
-            for v in proc_vids:
-                if study_config.mapped_video_recording_colors is None or v not in study_config.mapped_video_recording_colors:
-                    continue
-                clr = study_config.mapped_video_recording_colors[v][::-1]  # RGB -> BGR
-                poses_this = ppose[v]
-                # draw gaze associated with this recording. As wanted, drawn on this but also other videos
-                if v in gazes_head and lead_frame_idx in gazes_head[v]:
-                    for g in gazes_head[v][lead_frame_idx]:
-                        if v in write_vids:
-                            g.draw(frame[v], sub_pixel_fac=sub_pixel_fac, clr=clr, draw_3d_gaze_point=False)
-
-                        # check if we need gaze on plane for drawing on any of the videos
-                        plane_gaze_on_this_video = v in write_vids and study_config.mapped_video_show_gaze_on_plane_in_which is not None and v in study_config.mapped_video_show_gaze_on_plane_in_which
-                        plane_gaze_or_pose_on_other_video = bool(
-                            (write_vids - {v}) & set(study_config.mapped_video_show_gaze_on_plane_in_which or ())
-                            or (write_vids - {v}) & set(study_config.mapped_video_show_gaze_vec_in_which or ())
-                        )
-                        if not poses_this or not (plane_gaze_on_this_video or plane_gaze_or_pose_on_other_video):
-                            continue
-
-                        # collect gaze on all planes for which pose or homography is available
-                        plane_gazes: dict[str, tuple[float,float,gaze_worldref.Gaze]] = {}
-                        for pl in poses_this:
-                            if poses_this[pl].pose_successful() or poses_this[pl].homography_successful():
-                                # turn into position on board
-                                plane_gaze = gaze_worldref.from_head(poses_this[pl], g, camera_params[v])
-                                plane_gazes[pl] = (gaze_worldref.distance_from_plane(plane_gaze, planes[pl]), poses_this[pl].pose_reprojection_error if poses_this[pl].pose_successful() else np.nan, plane_gaze)
-
-                        # find the plane to which gaze is closest
-                        best = None if not plane_gazes else sorted(plane_gazes.keys(), key=lambda d: (sum(plane_gazes[d][0:2])/2 if not np.isnan(plane_gazes[d][1]) else plane_gazes[d][0]) if plane_gazes[d][0]<=study_config.mapped_video_gaze_to_plane_margin else math.inf)
-                        # check if gaze is not too far outside all planes
-                        if best is None:
-                            continue
-
-                        # draw on current video
-                        if study_config.mapped_video_show_gaze_on_plane_in_which is not None and v in study_config.mapped_video_show_gaze_on_plane_in_which:
-                            plane_gazes[best[0]][2].draw_on_world_video(frame[v], camera_params[v], ROI_offsets[v], sub_pixel_fac, poses_this[best[0]], study_config.mapped_video_projected_vidPos_color, study_config.mapped_video_projected_world_pos_color, study_config.mapped_video_projected_left_ray_color, study_config.mapped_video_projected_right_ray_color, study_config.mapped_video_projected_average_ray_color)
+        try:
+            should_exit = False
+            while True:
+                if should_exit:
+                    break
+                # NB: for a segment, the first frame is read by spooling the video to it, so that frame indices are
+                # identical to when the whole video is rendered. Likewise, when only every nth frame is rendered, the
+                # video is spooled to the next frame to render, skipped frames are not processed
+                wanted_frame_idx = None
+                if frame_idx.get(lead_vid) is None:
+                    if segment is not None:
+                        wanted_frame_idx = segment[2]
+                elif stride>1:
+                    if (wanted_frame_idx:=typing.cast(int, frame_idx[lead_vid])+stride)>total:
+                        break
+                status, ppose[lead_vid], _, _, (frame[lead_vid], frame_idx[lead_vid], frame_ts[lead_vid], frame_info[lead_vid]) = \
+                    pose_estimators[lead_vid].process_one_frame(wanted_frame_idx)
+                # TODO: if there is a discontinuity, fill in the missing frames so audio stays in sync
+                # check if we're done
+                if status==pose.Status.Finished or (segment is not None and frame_idx[lead_vid]>segment[3]):
+                    break
+                # NB: no need to handle pose.Status.Skip, since we didn't provide the pose estimator with any analysis intervals (we want to process the whole video)
+                lead_frame_idx = typing.cast(int, frame_idx[lead_vid])
+                lead_frame_ts = typing.cast(float, frame_ts[lead_vid])
+
+                for v in proc_vids-set([lead_vid]):
+                    # find corresponding frame
+                    fr_idx_this = ref_frame_idxs[v][lead_frame_idx]
+
+                    if fr_idx_this==-1 or v not in frame_sources:
+                        # no corresponding frame, or frame not needed (no pose estimator needed for this recording)
+                        _, ppose[v], _, _, (frame[v], frame_idx[v], frame_ts[v], frame_info[v]) = \
+                            None, None, None, None, (None, None, None, None)
+                    else:
+                        # read it
+                        _, ppose[v], _, _, (frame[v], frame_idx[v], frame_ts[v], frame_info[v]) = \
+                            frame_sources[v].get(lead_frame_idx)
 
-                        # also draw on other recordings, if so configured
-                        # depending on configuration also includes gaze vector with origin at the camera
-                        for vo in write_vids-set([v]):
-                            poses_other = ppose[vo]
-                            if poses_other is None:
+                for v in write_vids:
+                    if frame[v] is None:
+                        # we don't have a valid frame, use a fully black frame
+                        frame[v] = np.zeros((out_size[v][1],out_size[v][0],3), np.uint8)   # black image
+                    elif (frame[v].shape[1],frame[v].shape[0])!=out_size[v]:
+                        # scale (if wanted), before drawing the overlays
+                        frame[v] = cv2.resize(frame[v], out_size[v], interpolation=cv2.INTER_AREA)
+                ROI_offsets = {
+                    v: (frame_info[v]['offset_x'], frame_info[v]['offset_y'])
+                    if frame_info[v] is not None and 'offset_x' in frame_info[v] and 'offset_y' in frame_info[v]
+                    else (0,0)
+                    for v in write_vids
+                }
+
+                # draw gaze on the video
+                for v in proc_vids:
+                    if study_config.mapped_video_recording_colors is None or v not in study_config.mapped_video_recording_colors:
+                        continue
+                    clr = study_config.mapped_video_recording_colors[v][::-1]  # RGB -> BGR
+                    poses_this = ppose[v]
+                    # draw gaze associated with this recording. As wanted, drawn on this but also other videos
+                    if v in gazes_head and lead_frame_idx in gazes_head[v]:
+                        for gi,g in enumerate(gazes_head[v][lead_frame_idx]):
+                            if v in write_vids:
+                                # NB: as gaze_headref.Gaze.draw(), at the scaled position
+                                drawing.openCVCircle(frame[v], _scale_point(g.gaze_pos_vid, draw_scale[v]), 8, clr, 2, sub_pixel_fac)
+
+                            # check if we need gaze on plane for drawing on any of the videos
+                            plane_gaze_on_this_video = v in write_vids and study_config.mapped_video_show_gaze_on_plane_in_which is not None and v in study_config.mapped_video_show_gaze_on_plane_in_which
+                            plane_gaze_or_pose_on_other_video = bool(
+                                (write_vids - {v}) & set(study_config.mapped_video_show_gaze_on_plane_in_which or ())
+                                or (write_vids - {v}) & set(study_config.mapped_video_show_gaze_vec_in_which or ())
+                            )
+                            if not poses_this or not (plane_gaze_on_this_video or plane_gaze_or_pose_on_other_video):
                                 continue
-                            matched_plane = next((pl for pl in best if pl in poses_other and (poses_other[pl].pose_successful() or poses_other[pl].homography_successful())), None)
-                            if matched_plane is None:
+
+                            # collect gaze on all planes for which pose or homography is available
+                            plane_gazes: dict[str, tuple[float,float,gaze_worldref.Gaze]] = {}
+                            stored = stored_plane_gazes[v][lead_frame_idx][gi] if v in stored_plane_gazes else {}
+                            for pl in poses_this:
+                                if poses_this[pl].pose_successful() or poses_this[pl].homography_successful():
+                                    # turn into position on board, if not already available
+                                    plane_gaze = stored[pl] if pl in stored else gaze_worldref.from_head(poses_this[pl], g, camera_params[v])
+                                    plane_gazes[pl] = (gaze_worldref.distance_from_plane(plane_gaze, planes[pl]), poses_this[pl].pose_reprojection_error if poses_this[pl].pose_successful() else np.nan, plane_gaze)
+
+                            # find the plane to which gaze is closest
+                            best = None if not plane_gazes else sorted(plane_gazes.keys(), key=lambda d: (sum(plane_gazes[d][0:2])/2 if not np.isnan(plane_gazes[d][1]) else plane_gazes[d][0]) if plane_gazes[d][0]<=study_config.mapped_video_gaze_to_plane_margin else math.inf)
+                            # check if gaze is not too far outside all planes
+                            if best is None:
                                 continue
-                            # draw gaze point, camera position, and gaze vector between them on the other video, as configured
-                            # and as possible (camera position and gaze vector require pose, not only homography)
-                            draw_gaze_on_other_video(frame[vo],
-                                                     ROI_offsets[vo],
-                                                     poses_this[matched_plane], poses_other[matched_plane],
-                                                     plane_gazes[matched_plane][2],
-                                                     camera_params[vo], clr,
-                                                     study_config.mapped_video_which_gaze_type_on_plane,
-                                                     study_config.mapped_video_which_gaze_type_on_plane_allow_fallback,
-                                                     study_config.mapped_video_show_gaze_on_plane_in_which is not None and vo in study_config.mapped_video_show_gaze_on_plane_in_which,
-                                                     study_config.mapped_video_show_gaze_vec_in_which is not None and vo in study_config.mapped_video_show_gaze_vec_in_which,
-                                                     sub_pixel_fac)
-
-                # Draw camera position on other videos, if so configured
-                if not poses_this or study_config.mapped_video_show_camera_in_which is None:
-                    continue
-                for vo in (write_vids - {v}) & set(study_config.mapped_video_show_camera_in_which):
-                    poses_other = ppose[vo]
-                    if poses_other is None:
-                        continue
-                    matched_plane = next((pl for pl in poses_this if pl in poses_other and poses_this[pl].pose_successful() and poses_other[pl].pose_successful()), None)
-                    if matched_plane is None:
+
+                            # draw on current video
+                            if study_config.mapped_video_show_gaze_on_plane_in_which is not None and v in study_config.mapped_video_show_gaze_on_plane_in_which:
+                                draw_gaze_on_world_video(frame[v], plane_gazes[best[0]][2], poses_this[best[0]], camera_params[v], draw_camera_params[v], ROI_offsets[v], draw_scale[v], sub_pixel_fac, study_config)
+
+                            # also draw on other recordings, if so configured
+                            # depending on configuration also includes gaze vector with origin at the camera
+                            for vo in write_vids-set([v]):
+                                poses_other = ppose[vo]
+                                if poses_other is None:
+                                    continue
+                                matched_plane = next((pl for pl in best if pl in poses_other and (poses_other[pl].pose_successful() or poses_other[pl].homography_successful())), None)
+                                if matched_plane is None:
+                                    continue
+                                # draw gaze point, camera position, and gaze vector between them on the other video, as configured
+                                # and as possible (camera position and gaze vector require pose, not only homography)
+                                draw_gaze_on_other_video(frame[vo],
+                                                         ROI_offsets[vo],
+                                                         poses_this[matched_plane], poses_other[matched_plane],
+                                                         plane_gazes[matched_plane][2],
+                                                         camera_params[vo], clr,
+                                                         study_config.mapped_video_which_gaze_type_on_plane,
+                                                         study_config.mapped_video_which_gaze_type_on_plane_allow_fallback,
+                                                         study_config.mapped_video_show_gaze_on_plane_in_which is not None and vo in study_config.mapped_video_show_gaze_on_plane_in_which,
+                                                         study_config.mapped_video_show_gaze_vec_in_which is not None and vo in study_config.mapped_video_show_gaze_vec_in_which,
+                                                         sub_pixel_fac, draw_scale[vo])
+
+                    # Draw camera position on other videos, if so configured
+                    if not poses_this or study_config.mapped_video_show_camera_in_which is None:
                         continue
-                    draw_camera_on_other_video(frame[vo], ROI_offsets[vo], poses_this[matched_plane], poses_other[matched_plane], camera_params[vo], clr, sub_pixel_fac)
+                    for vo in (write_vids - {v}) & set(study_config.mapped_video_show_camera_in_which):
+                        poses_other = ppose[vo]
+                        if poses_other is None:
+                            continue
+                        matched_plane = next((pl for pl in poses_this if pl in poses_other and poses_this[pl].pose_successful() and poses_other[pl].pose_successful()), None)
+                        if matched_plane is None:
+                            continue
+                        draw_camera_on_other_video(frame[vo], ROI_offsets[vo], poses_this[matched_plane], poses_other[matched_plane], camera_params[vo], clr, sub_pixel_fac, draw_scale[vo])
 
 
-            # print info on frame and submit to to be encoded
-            for v in write_vids:
-                out_frame = typing.cast(np.ndarray, frame[v])
-                # timecode and frame number
-                if v==lead_vid and videos_ts[lead_vid].has_stretched:
-                    # for reference video, if we have stretched timestamps, print those too
-                    texts = [f'{lead_frame_ts/1000.:{timestamp_width[lead_vid]}.3f} ({videos_ts[lead_vid].get_timestamp(lead_frame_idx, timestamps.Type.Stretched)/1000.:{timestamp_width[lead_vid]}.3f})']
-                else:
-                    texts = [f'{lead_frame_ts/1000.:{timestamp_width[lead_vid]}.3f}']
-                texts[0] += f' [{lead_frame_idx:{frame_idx_width[lead_vid]}d}]'
-                frame_colors: list[tuple[int, int, int]] = [(0,0,0)]
-                if v in other_vids:
-                    if frame_ts[v] is None:
-                        texts.append('no frame')
-                    else:
-                        texts.append(f'{frame_ts[v]/1000.:{timestamp_width[v]}.3f} [{frame_idx[v]:{frame_idx_width[v]}d}]')
-                    frame_colors.append((128,128,128))
-                # events, if any
-                for e, idx in _get_active_episode_indices(lead_frame_idx, episodes_as_ref[v]):
-                    texts.append(f'{e} {episodes_seq_nrs[v][e][idx]}')
-                    frame_colors.append(episode_colors[v][e][::-1])
-                # now print them all
-                text_sizes: list[tuple[int,int]]= []
-                baselines : list[int]           = []
-                for t in texts:
-                    t, b = cv2.getTextSize(t,cv2.FONT_HERSHEY_PLAIN,2,2)
-                    text_sizes.append((t[0], t[1]))
-                    baselines.append(b)
-                max_height = max(text_sizes, key=lambda x: x[1])[1]
-                x_end = 0
-                margin = 5
-                for t,f,ts,b in zip(texts,frame_colors,text_sizes,baselines):
-                    x_advance = ts[0]+margin
-                    cv2.rectangle(out_frame,(x_end,out_frame.shape[0]),(x_end+x_advance,out_frame.shape[0]-max_height-b-margin), f, -1)
-                    cv2.putText(out_frame, t, (x_end+margin, out_frame.shape[0]-margin), cv2.FONT_HERSHEY_PLAIN, 2, (0,255,255), 2)
-                    x_end += x_advance
-
-                # submit frame to be encoded
-                img = Image(plane_buffers=[out_frame.flatten().tobytes()], pix_fmt='bgr24', size=(out_frame.shape[1], out_frame.shape[0]))
-                vid_writer[v].write_frame(img=img, pts=lead_frame_idx/vid_info[lead_vid][2])
-            progress_indicator.update()
-
-            # update gui, if any
-            if has_gui:
-                gui_obj = typing.cast(video_player.GUI, gui)
+                # print info on frame and submit to to be encoded
                 for v in write_vids:
-                    gui_obj.update_image(frame[v], lead_frame_ts/1000., lead_frame_idx, window_id=gui_window_ids[v])
-
-                requests = gui_obj.get_requests()
-                for r,_ in requests:
-                    if r=='exit':   # only requests we need to handle
-                        should_exit = True
-                        break
-                    if r=='close':
-                        has_gui = False
-                        gui_obj.stop()
+                    out_frame = typing.cast(np.ndarray, frame[v])
+                    # timecode and frame number
+                    if v==lead_vid and videos_ts[lead_vid].has_stretched:
+                        # for reference video, if we have stretched timestamps, print those too
+                        texts = [f'{lead_frame_ts/1000.:{timestamp_width[lead_vid]}.3f} ({videos_ts[lead_vid].get_timestamp(lead_frame_idx, timestamps.Type.Stretched)/1000.:{timestamp_width[lead_vid]}.3f})']
+                    else:
+                        texts = [f'{lead_frame_ts/1000.:{timestamp_width[lead_vid]}.3f}']
+                    texts[0] += f' [{lead_frame_idx:{frame_idx_width[lead_vid]}d}]'
+                    frame_colors: list[tuple[int, int, int]] = [(0,0,0)]
+                    is_static   : list[bool]                 = [False]  # static texts are drawn using cached patches
+                    if v in other_vids:
+                        if frame_ts[v] is None:
+                            texts.append('no frame')
+                            is_static.append(True)
+                        else:
+                            texts.append(f'{frame_ts[v]/1000.:{timestamp_width[v]}.3f} [{frame_idx[v]:{frame_idx_width[v]}d}]')
+                            is_static.append(False)
+                        frame_colors.append((128,128,128))
+                    # events, if any
+                    for e, idx in active_episodes[v].get_active(lead_frame_idx):
+                        texts.append(f'{e} {episodes_seq_nrs[v][e][idx]}')
+                        frame_colors.append(episode_colors[v][e][::-1])
+                        is_static.append(True)
+                    # now print them all
+                    baselines : list[int] = []
+                    max_height = 0
+                    for t in texts:
+                        t, b = text_boxes.get_text_size(t)
+                        max_height = max(max_height, t[1])
+                        baselines.append(b)
+                    x_end = 0
+                    for t,f,b,st in zip(texts,frame_colors,baselines,is_static):
+                        x_end += text_boxes.draw(out_frame, t, x_end, max_height, b, f, (0,255,255), use_cache=st)
+
+                    # submit frame to be encoded. NB: the writer copies the frame into one of its own buffers
+                    vid_writer[v].write_frame(out_frame, pts=(lead_frame_idx-pts_offset)/vid_info[lead_vid][2])
+                progress_indicator.update(n=stride)
+
+                # update gui, if any
+                if has_gui:
+                    gui_obj = typing.cast(video_player.GUI, gui)
+                    for v in write_vids:
+                        gui_obj.update_image(frame[v], lead_frame_ts/1000., lead_frame_idx, window_id=gui_window_ids[v])
+
+                    requests = gui_obj.get_requests()
+                    for r,_ in requests:
+                        if r=='exit':   # only requests we need to handle
+                            should_exit = True
+                            break
+                        if r=='close':
+                            has_gui = False
+                            gui_obj.stop()
+        except:
+            # stop encoder threads. Errors while closing are ignored so that the original error is reported
+            for v in vid_writer:
+                try:
+                    vid_writer[v].close()
+                except:
+                    pass
+            raise
 
         # done with this set of videos
         # clean up as needed (close GUI when nothing to show anymore)
@@ -522,57 +595,131 @@ def do_the_work(working_dir: pathlib.Path, config_dir: pathlib.Path, gui: video_
         for v in write_vids:
             vid_writer[v].close()
 
-        # if ffmpeg is on path, add audio to scene and optionally board video
-        if shutil.which('ffmpeg') is not None:
-            for v in write_vids:
-                rec_working_dir = working_dir / v
-                file = rec_working_dir / naming.mapped_gaze_video
-
-                # check if source file has audio
-                command = ['ffprobe',
-                    '-loglevel', 'error',
-                    '-select_streams', 'a',
-                    '-show_entries', 'stream=codec_type',
-                    '-of', 'csv=p=0',
-                    f'{in_videos[v]}']
-                proc = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-                out, err = proc.communicate()
-                if err or out.decode().strip()!='audio':
-                    # file does not have audio, nothing to do, skip
-                    continue
-                # move file to temp name
-                tempName = file.parent / (file.stem + '_temp' + file.suffix)
-                shutil.move(file, tempName)
-
-                # add audio
-                if v==lead_vid:
-                    cmd_str = ' '.join(['ffmpeg', '-hide_banner', '-loglevel', 'error', '-y', '-i', f'"{tempName}"', '-i', f'"{in_videos[v]}"', '-vcodec', 'copy', '-acodec', 'copy', '-map', '0:v:0', '-map', '1:a:0?', '-shortest', f'"{file}"'])
-                else:
-                    inputs = ['ffmpeg', '-hide_banner', '-loglevel', 'error', '-y', '-i', f'"{tempName}"', '-i', f'"{in_videos[v]}"']
-
-                    first_frame = ref_frame_idxs[v][0]
-                    if first_frame==-1:
-                        # video starts later, we need to delay audio when copying
-                        frame_off = int(np.argmax(np.array(ref_frame_idxs[v])>-1))
-                        t_off = videos_ts[lead_vid].get_timestamp(frame_off, timestamps.Type.Stretched if videos_ts[lead_vid].has_stretched else timestamps.Type.Normal)
-                        filt = f'[1:a]adelay=delays={t_off:.9f}:all=1[a];[a]apad[audio];'
-                    else:
-                        t_off = videos_ts[v].get_timestamp(first_frame)
-                        filt = f'[1:a]atrim=start={t_off/1000},asetpts=PTS-STARTPTS[a];[a]apad[audio];'
-                    cmd_str = ' '.join(inputs + ['-filter_complex', f'"{filt}"', '-map', '0:v', '-map', '[audio]', '-c:v', 'copy', '-shortest', f'"{file}"'])
-                os.system(cmd_str)
-
-                # clean up
-                if file.exists():
-                    tempName.unlink(missing_ok=True)
-                else:
-                    # something failed. Put file without audio back under output name
-                    shutil.move(tempName, file)
+        if segment is not None:
+            # done, rest is done by the caller once all segments are rendered
+            return
 
     # update state
-    session.update_action_states(working_dir, process.Action.MAKE_MAPPED_GAZE_VIDEO, process_pool.State.Completed, study_config)
+    if not draft:
+        session.update_action_states(working_dir, process.Action.MAKE_MAPPED_GAZE_VIDEO, process_pool.State.Completed, study_config)
+
 
-def draw_gaze_on_other_video(frame_other, ROI_offset, pose_this: pose.Pose, pose_other: pose.Pose, plane_gaze: gaze_worldref.Gaze, camera_params_other, clr, which_gaze_on_plane, which_gaze_on_plane_allow_fallback, do_draw_gaze, do_draw_gaze_vec, sub_pixel_fac):
+def _can_reuse_plane_gazes(rec: str, rec_action_states: dict[process.Action, process_pool.State], study_config: config.Study) -> bool:
+    # gaze on the planes as stored by GAZE_TO_PLANE can only be reused if it is up to date (files may be left over from
+    # before the recording was e.g. resynchronized or markers were redetected), and if it was computed from the same
+    # plane poses as drawn here: GAZE_TO_PLANE uses interpolated plane poses if so configured, while this video uses the
+    # plane poses estimated for each frame
+    if rec_action_states.get(process.Action.GAZE_TO_PLANE)!=process_pool.State.Completed:
+        return False
+    return not process.config_has_plane_pose_interpolation(study_config, rec)
+
+def _get_stored_plane_gazes(rec_working_dir: pathlib.Path, plane_names: list[str], gazes_head: dict[int, list[gaze_headref.Gaze]]) -> dict[int, list[dict[str, gaze_worldref.Gaze]]]:
+    # get gaze on the planes as stored by GAZE_TO_PLANE, for each sample in gazes_head (so per frame, per gaze sample
+    # a dict with the gaze on each plane for which it is available). Samples are matched on their original timestamp:
+    # the timestamp column of the gaze-to-plane file holds the timestamp of the gaze data file, also when GAZE_TO_PLANE
+    # used VOR-synchronized timestamps (these are stored in the timestamp_VOR column)
+    head_gazes = [g for f in gazes_head for g in gazes_head[f]]
+    ts = np.array([g.timestamp_ori for g in head_gazes], dtype='float')
+    matched: list[dict[str, gaze_worldref.Gaze]] = [{} for _ in head_gazes]
+    for p in plane_names:
+        if not (file:=rec_working_dir / f'{naming.world_gaze_prefix}{p}.tsv').is_file():
+            continue
+        plane_gazes = [g for gs in gaze_worldref.read_dict_from_file(file).values() for g in gs]
+        if not plane_gazes or not ts.size:
+            continue
+        plane_ts = np.array([g.timestamp for g in plane_gazes], dtype='float')
+        order    = np.argsort(plane_ts)
+        plane_ts = plane_ts[order]
+        # find closest stored sample for each sample, accept if timestamps are equal (up to precision with which they are stored)
+        idx  = np.searchsorted(plane_ts, ts)
+        prev = np.clip(idx-1, 0, plane_ts.size-1)
+        nxt  = np.clip(idx  , 0, plane_ts.size-1)
+        idx  = np.where(np.abs(plane_ts[prev]-ts)<=np.abs(plane_ts[nxt]-ts), prev, nxt)
+        for i in np.nonzero(np.abs(plane_ts[idx]-ts)<.001)[0]:
+            matched[i][p] = plane_gazes[order[idx[i]]]
+    # organize in same structure as input
+    out: dict[int, list[dict[str, gaze_worldref.Gaze]]] = {}
+    i = 0
+    for f in gazes_head:
+        out[f] = matched[i:i+len(gazes_head[f])]
+        i += len(gazes_head[f])
+    return out
+
+def _get_audio_args(v: str, lead_vid: str, in_videos: dict[str, pathlib.Path], ref_frame_idxs: dict[str, list[int]], videos_ts: dict[str, timestamps.VideoTimestamps]) -> list[str]|None:
+    # get ffmpeg arguments for adding the audio of the source video to the mapped gaze video (which should be the first input).
+    # None if ffmpeg is not on path or the source video has no audio. The video codec is left to the caller
+    if not _ffmpeg.is_available() or not _ffmpeg.has_audio(in_videos[v]):
+        return None
+
+    if v==lead_vid:
+        # NB: audio is not stream copied, as then ffmpeg (at least version 6) may end the output early when the video
+        # frames are piped in
+        return ['-i', str(in_videos[v]), '-map', '0:v:0', '-map', '1:a:0?', '-shortest']
+
+    first_frame = ref_frame_idxs[v][0]
+    if first_frame==-1:
+        # video starts later, we need to delay audio when copying
+        frame_off = int(np.argmax(np.array(ref_frame_idxs[v])>-1))
+        t_off = videos_ts[lead_vid].get_timestamp(frame_off, timestamps.Type.Stretched if videos_ts[lead_vid].has_stretched else timestamps.Type.Normal)
+        filt = f'[1:a]adelay=delays={t_off:.9f}:all=1[a];[a]apad[audio];'
+    else:
+        t_off = videos_ts[v].get_timestamp(first_frame)
+        filt = f'[1:a]atrim=start={t_off/1000},asetpts=PTS-STARTPTS[a];[a]apad[audio];'
+    return ['-i', str(in_videos[v]), '-filter_complex', filt, '-map', '0:v', '-map', '[audio]', '-shortest']
+
+def _get_segments(n_frames: int, n_segments: int, episodes: list[dict[str, tuple[annotation.EventType, list[int]]]], stride: int = 1) -> list[tuple[int,int]]:
+    # split the video in n_segments segments of about equal length. Segment boundaries are moved to a nearby
+    # episode boundary, if any, so that episodes are not split over multiple segments. If only every nth frame
+    # is rendered, segments start at a rendered frame
+    edges = np.unique([i+(k%2) for eps in episodes for e in eps for k,i in enumerate(eps[e][1])])
+    boundaries = np.linspace(0, n_frames, n_segments+1).round().astype('int')
+    max_shift = n_frames/n_segments/10
+    for b in range(1,n_segments):
+        if not edges.size:
+            break
+        nearest = edges[np.abs(edges-boundaries[b]).argmin()]
+        if abs(nearest-boundaries[b])<=max_shift:
+            boundaries[b] = nearest
+    if stride>1:
+        boundaries[1:-1] = np.ceil(boundaries[1:-1]/stride).astype('int')*stride
+    return [(int(s),int(e)-1) for s,e in zip(boundaries[:-1],boundaries[1:]) if e>s]
+
+def _get_segment_file_name(video_file: str, seg_idx: int) -> str:
+    file = pathlib.Path(video_file)
+    return f'{file.stem}_segment_{seg_idx+1:02d}{file.suffix}'
+
+def _render_segment(working_dir: pathlib.Path, config_dir: pathlib.Path, segment: tuple[int,int,int,int], draft: bool, study_settings: dict[str, typing.Any]):
+    # NB: run in a worker process
+    do_the_work(working_dir, config_dir, None, process_pool.JobProgress(printer=lambda _: None), segment=segment, draft=draft, **study_settings)
+
+
+def _scale_point(point: np.ndarray, scale: np.ndarray) -> np.ndarray:
+    # from a position in the video frame to a position in the scaled output frame
+    return np.asarray(point, dtype='float')*scale
+
+def _scale_camera_params(camera_params: ocv.CameraParams, out_size: tuple[int,int]) -> ocv.CameraParams:
+    # camera parameters for projecting into a frame scaled to out_size
+    if not camera_params.has_intrinsics() or camera_params.resolution is None or tuple(camera_params.resolution)==tuple(out_size):
+        return camera_params
+    scale = np.array(out_size)/camera_params.resolution
+    camera_mtx = None if camera_params.camera_mtx is None else camera_params.camera_mtx*np.array([[scale[0]],[scale[1]],[1.]])
+    colmap_camera = {}
+    if camera_params.has_colmap_camera():
+        cam = copy.deepcopy(camera_params.colmap_camera)
+        cam.rescale(*out_size)
+        colmap_camera = cam.todict()
+    return ocv.CameraParams(np.array(out_size), camera_mtx, camera_params.distort_coeffs, camera_params.rotation_vec, camera_params.position, colmap_camera)
+
+def draw_gaze_on_world_video(frame, plane_gaze: gaze_worldref.Gaze, pose_this: pose.Pose, camera_params, camera_params_scaled, ROI_offset, scale, sub_pixel_fac, study_config: config.Study):
+    if camera_params.has_intrinsics():
+        plane_gaze.draw_on_world_video(frame, camera_params_scaled, tuple(_scale_point(ROI_offset, scale)), sub_pixel_fac, pose_this, study_config.mapped_video_projected_vidPos_color, study_config.mapped_video_projected_world_pos_color, study_config.mapped_video_projected_left_ray_color, study_config.mapped_video_projected_right_ray_color, study_config.mapped_video_projected_average_ray_color)
+    elif pose_this.homography_successful():
+        # NB: as in gaze_worldref.Gaze.draw_on_world_video(). The homography maps to positions in the video frame,
+        # which need to be scaled
+        gaze_pos = pose_this.plane_to_cam_homography(plane_gaze.gazePosPlane2D_vidPos_homography, camera_params, ROI_offset)
+        drawing.openCVCircle(frame, _scale_point(gaze_pos, scale), 3, study_config.mapped_video_projected_vidPos_color, -1, sub_pixel_fac)
+
+def draw_gaze_on_other_video(frame_other, ROI_offset, pose_this: pose.Pose, pose_other: pose.Pose, plane_gaze: gaze_worldref.Gaze, camera_params_other, clr, which_gaze_on_plane, which_gaze_on_plane_allow_fallback, do_draw_gaze, do_draw_gaze_vec, sub_pixel_fac, scale):
     if not do_draw_gaze and not do_draw_gaze_vec:
         # nothing to do
         return
@@ -590,7 +737,7 @@ def draw_gaze_on_other_video(frame_other, ROI_offset, pose_this: pose.Pose, pose
         if not do_draw_gaze:
             return
         # use homography
-        gaze_pos_other = pose_other.plane_to_cam_homography(gaze_point_plane, camera_params_other, ROI_offset)
+        gaze_pos_other = _scale_point(pose_other.plane_to_cam_homography(gaze_point_plane, camera_params_other, ROI_offset), scale)
         drawing.openCVCircle(frame_other, gaze_pos_other, 8, clr, 2, sub_pixel_fac)
         # can only do gaze position on plane with homography, so, exit
         return
@@ -601,7 +748,7 @@ def draw_gaze_on_other_video(frame_other, ROI_offset, pose_this: pose.Pose, pose
     # it won't be visible and projecting it anyway yields a nonsensical result
     if gaze_ok := pose_other.world_frame_to_cam(gaze_point_plane)[2]>0:
         # project from plane to camera
-        gaze_pos_other = pose_other.plane_to_cam_pose(gaze_point_plane, camera_params_other, ROI_offset)
+        gaze_pos_other = _scale_point(pose_other.plane_to_cam_pose(gaze_point_plane, camera_params_other, ROI_offset), scale)
         # draw on the other video
         if do_draw_gaze:
             drawing.openCVCircle(frame_other, gaze_pos_other, 8, clr, 2, sub_pixel_fac)
@@ -615,14 +762,14 @@ def draw_gaze_on_other_video(frame_other, ROI_offset, pose_this: pose.Pose, pose
             # and projecting it anyway yields a nonsensical result
             return
         # draw on the other video
-        cam_pos_other = pose_other.plane_to_cam_pose(cam_pos_world_this, camera_params_other, ROI_offset)
+        cam_pos_other = _scale_point(pose_other.plane_to_cam_pose(cam_pos_world_this, camera_params_other, ROI_offset), scale)
         # and draw line connecting the camera and the gaze point
         if gaze_ok and do_draw_gaze_vec and gaze_pos_other is not None:
             drawing.openCVLine(frame_other, gaze_pos_other, cam_pos_other, clr, 5, sub_pixel_fac)
 
 
 
-def draw_camera_on_other_video(frame_other, ROI_offset, pose_this: pose.Pose, pose_other: pose.Pose, camera_params_other, clr, sub_pixel_fac):
+def draw_camera_on_other_video(frame_other, ROI_offset, pose_this: pose.Pose, pose_other: pose.Pose, camera_params_other, clr, sub_pixel_fac, scale):
     if not pose_this.pose_successful() or not pose_other.pose_successful():
         return
 
@@ -630,5 +777,5 @@ def draw_camera_on_other_video(frame_other, ROI_offset, pose_this: pose.Pose, po
     if pose_other.world_frame_to_cam(cam_pos_world_this)[2] <= 0:
         return
 
-    cam_pos_other = pose_other.plane_to_cam_pose(cam_pos_world_this, camera_params_other, ROI_offset)
+    cam_pos_other = _scale_point(pose_other.plane_to_cam_pose(cam_pos_world_this, camera_params_other, ROI_offset), scale)
     drawing.openCVCircle(frame_other, cam_pos_other, 3, clr, 1, sub_pixel_fac)
\ No newline at end of file
@@ -1,16 +1,17 @@
 import pathlib
+import matplotlib
 import numpy as np
 import pandas as pd
 
-from glassesTools import annotation, fixation_classification, naming as gt_naming, process_pool, validation
+from glassesTools import annotation, gaze_worldref, naming as gt_naming, process_pool
 from glassesTools.validation import assign_intervals, compute_offsets
 
 from .. import config, episode, naming, plane, process, session
-from . import _pose_files
+from . import _fixation_cache, _fixation_classification, _marker_presence, _pose_files, _utils
 
 
 stopAllProcessing = False
-def run(working_dir: str|pathlib.Path, config_dir: str|pathlib.Path|None=None, progress_indicator: process_pool.JobProgress|None=None, **study_settings):
+def run(working_dir: str|pathlib.Path, config_dir: str|pathlib.Path|None=None, progress_indicator: process_pool.JobProgress|None=None, plots_only=False, **study_settings):
     working_dir = pathlib.Path(working_dir)
     if config_dir is None:
         config_dir = config.guess_config_dir(working_dir)
@@ -43,13 +44,20 @@ def run(working_dir: str|pathlib.Path, config_dir: str|pathlib.Path|None=None, p
     if not any(episodes[e][1] for e in episodes):
         raise RuntimeError(f'There are no {annotation.tooltip_map[annotation.EventType.Validate]} episodes coded for session "{working_dir.parent.name}", recording "{working_dir.name}", nothing to process')
 
+    # plots can be deferred so that the numeric results are available quickly, they are then made in a separate run with plots_only=True
+    do_plots = plots_only or not study_config.validate_defer_plots
+
     # prep progress indicator
-    total = 2*len(episodes) + sum(len(episodes[e][1]) for e in episodes)*3
+    total = (1 if plots_only else 2)*len(episodes) + sum(len(episodes[e][1]) for e in episodes)*3
     progress_indicator.set_total(total)
     progress_indicator.set_intervals(int(total/200), int(total/200))
     progress_indicator.update(n=0)  # ensure a complete hover text appears before first processing step is finished
 
-    # per plane, run the glassesValidator steps
+    # per event, get setup. The validation episodes are then processed in parallel
+    event_setups: dict[str, tuple[config.EventSetup, plane.Definition, pd.DataFrame|None, tuple|None]] = {}
+    # keys of the cached fixation classification results, per episode of events that need fixation classification.
+    # NB: computed here so that the plane gaze file is read once, not in each worker
+    cache_keys: dict[str, list[str]] = {}
     for e in episodes:
         # find corresponding coding config
         cs = [cs for cs in val_events if cs['name']==e][0]
@@ -61,86 +69,152 @@ def run(working_dir: str|pathlib.Path, config_dir: str|pathlib.Path|None=None, p
             raise ValueError(f'Plane {p} is not a {plane.Type.GlassesValidator.value} plane, cannot be used for validation')
         validation_plane = plane.get_plane_from_definition(plane_def, config_dir/p)
 
-        plot_limits = [[validation_plane.bbox[0]-validation_plane.marker_size, validation_plane.bbox[2]+validation_plane.marker_size],
-                       [validation_plane.bbox[1]-validation_plane.marker_size, validation_plane.bbox[3]+validation_plane.marker_size]]
-        background_image = (validation_plane.get_ref_image(as_RGB=True),
-                            np.array([validation_plane.bbox[x] for x in (0,2,3,1)]))
-        targets = {t_id: np.append(validation_plane.targets[t_id].center, 0.) for t_id in validation_plane.targets}   # get centers of targets
-
         # use user-coded intervals if available else find intervals
-        has_override = False
+        target_coding = None
+        marker_observations = None
         fname_override = working_dir/f'{naming.validation_prefix}{e}_fixation_assignment_override.tsv'
         if fname_override.exists():
             target_coding = pd.read_csv(fname_override, delimiter='\t', dtype={'target':int, 'marker_interval':int},index_col='target')
-            has_override = True
+        elif plots_only and not (working_dir/f'{naming.validation_prefix}{e}_fixation_assignment.tsv').is_file():
+            raise FileNotFoundError(f'No validation results found for validation event "{e}", run the {process.Action.VALIDATE.displayable_name} action first before making plots')
         elif validation_plane.is_dynamic():
-            marker_observations_per_target, markers_per_target = validation.dynamic.get_marker_observations(validation_plane, working_dir, e)
+            presence, markers_per_target = _marker_presence.read_validation_targets(validation_plane, working_dir, e)
+            marker_observations = (_marker_presence.to_observations_per_target(presence), markers_per_target)
         else:
-            fixation_classification.from_plane_gaze(working_dir/f'{naming.world_gaze_prefix}{p}.tsv',
-                                                    episodes[e][1],
-                                                    working_dir,
-                                                    I2MC_settings_override=cs['validation_setup']['I2MC_settings'],
-                                                    filename_stem=f'{naming.validation_prefix}{e}_fixations',
-                                                    plot_limits=plot_limits)
+            cache_keys[e] = _fixation_cache.get_keys(working_dir/f'{naming.world_gaze_prefix}{p}.tsv', episodes[e][1], cs['validation_setup']['I2MC_settings'], _get_plot_limits(validation_plane))
+        event_setups[e] = (cs, plane_def, target_coding, marker_observations)
         progress_indicator.update()
 
-        # assign intervals
-        for idx,_ in enumerate(episodes[e][1]):
-            if has_override:
-                other_intervals = None
-                selected_intervals = target_coding[target_coding['marker_interval']==idx+1].copy()
-                selected_intervals = selected_intervals.rename(columns={'start_timestamp':'startT', 'end_timestamp':'endT'})
-            elif validation_plane.is_dynamic():
-                selected_intervals, other_intervals = \
-                    assign_intervals.dynamic_markers(marker_observations_per_target,
-                                                    markers_per_target,
-                                                    working_dir/gt_naming.frame_timestamps_fname,
-                                                    episodes[e][1][idx],
-                                                    cs['validation_setup']['dynamic_skip_first_duration'],
-                                                    cs['validation_setup']['dynamic_max_gap_duration'],
-                                                    cs['validation_setup']['dynamic_min_duration'],
-                                                    e)
-            else:
-                fix_file = working_dir / f'{naming.validation_prefix}{e}{naming.val_fixation_infix}{idx+1:02d}.tsv'
-                selected_intervals, other_intervals = \
-                    assign_intervals.distance(targets,
-                                            fix_file,
-                                            do_global_shift=cs['validation_setup']['do_global_shift'],
-                                            max_dist_fac=cs['validation_setup']['max_dist_fac'])
-            progress_indicator.update()
-
-            # plot output
-            assign_intervals.plot(selected_intervals,
-                                other_intervals,
-                                targets,
-                                working_dir/f'{naming.world_gaze_prefix}{p}.tsv',
-                                episodes[e][1][idx],
+    # classify fixations (if needed) and assign intervals, per episode
+    jobs = [(working_dir, config_dir, e, idx, episodes[e][1], *event_setups[e], cache_keys[e][idx] if e in cache_keys else None, do_plots, plots_only) for e in episodes for idx,_ in enumerate(episodes[e][1])]
+    def _store_assigned_intervals(i: int, selected_intervals: pd.DataFrame|None):
+        # store output to file
+        if selected_intervals is None:
+            progress_indicator.update(n=3)
+            return
+        e, idx = jobs[i][2:4]
+        assign_intervals.to_tsv(selected_intervals,
                                 working_dir,
                                 filename_stem=f'{naming.validation_prefix}{e}_fixation_assignment',
-                                iteration=idx,
-                                background_image=background_image,
-                                plot_limits=plot_limits)
-            progress_indicator.update()
-
-            # store output to file
-            assign_intervals.to_tsv(selected_intervals,
-                                    working_dir,
-                                    filename_stem=f'{naming.validation_prefix}{e}_fixation_assignment',
-                                    iteration=idx)
-            progress_indicator.update()
-
-        compute_offsets.compute(working_dir/f'{naming.world_gaze_prefix}{p}.tsv',
-                                _pose_files.get_preferred_plane_pose_file(working_dir, p)[0],
-                                working_dir/f'{naming.validation_prefix}{e}_fixation_assignment{("_override" if has_override else "")}.tsv',
-                                episodes[e][1],
-                                targets,
-                                validation_plane.config['distance']*10.,    # cm -> mm
-                                working_dir,
-                                filename=f'{naming.validation_prefix}{e}_data_quality.tsv',
-                                d_types=cs['validation_setup']['data_types'],
-                                allow_data_type_fallback=cs['validation_setup']['allow_data_type_fallback'],
-                                include_data_loss=cs['validation_setup']['include_data_loss'])
-        progress_indicator.update()
+                                iteration=idx)
+        progress_indicator.update(n=3)
+    _utils.run_jobs(_process_episode, jobs, study_config.validate_num_workers, _store_assigned_intervals, _init_worker)
+    # all episodes are processed, remove cached fixation classification results that are no longer used
+    _fixation_cache.prune(working_dir, {k for e in cache_keys for k in cache_keys[e]})
+    if plots_only:
+        return
+
+    # compute data quality, per event
+    jobs = [(working_dir, config_dir, e, episodes[e][1], *event_setups[e][:2], event_setups[e][2] is not None) for e in episodes]
+    _utils.run_jobs(_compute_data_quality, jobs, study_config.validate_num_workers, lambda *_: progress_indicator.update())
 
     # update state
     session.update_action_states(working_dir, process.Action.VALIDATE, process_pool.State.Completed, study_config)
+
+
+def make_plots(working_dir: str|pathlib.Path, config_dir: str|pathlib.Path|None=None, progress_indicator: process_pool.JobProgress|None=None, **study_settings):
+    # make the plots of a previous run of the VALIDATE action that was done with validate_defer_plots set
+    run(working_dir, config_dir, progress_indicator, plots_only=True, **study_settings)
+
+
+def _init_worker():
+    # plots are only stored to file, so use non-interactive backend in worker processes. NB: not done when
+    # jobs are run in the calling process, so as to not change the caller's matplotlib backend
+    matplotlib.use('Agg')
+
+
+def _get_plot_limits(validation_plane):
+    return [[validation_plane.bbox[0]-validation_plane.marker_size, validation_plane.bbox[2]+validation_plane.marker_size],
+            [validation_plane.bbox[1]-validation_plane.marker_size, validation_plane.bbox[3]+validation_plane.marker_size]]
+
+
+def _get_plane_info(plane_def: plane.Definition, config_dir: pathlib.Path):
+    validation_plane = plane.get_plane_from_definition(plane_def, config_dir/plane_def.name)
+    plot_limits = _get_plot_limits(validation_plane)
+    background_image = (validation_plane.get_ref_image(as_RGB=True),
+                        np.array([validation_plane.bbox[x] for x in (0,2,3,1)]))
+    targets = {t_id: np.append(validation_plane.targets[t_id].center, 0.) for t_id in validation_plane.targets}   # get centers of targets
+    return validation_plane, plot_limits, background_image, targets
+
+
+def _process_episode(working_dir: pathlib.Path, config_dir: pathlib.Path, e: str, idx: int, intervals: list[list[int]], cs: config.EventSetup, plane_def: plane.Definition, target_coding: pd.DataFrame|None, marker_observations: tuple|None, cache_key: str|None, do_plots: bool, plots_only: bool) -> pd.DataFrame|None:
+    # NB: run in a worker process, so can only take picklable arguments
+    validation_plane, plot_limits, background_image, targets = _get_plane_info(plane_def, config_dir)
+    p = plane_def.name
+
+    # assign intervals
+    if target_coding is not None:
+        other_intervals = None
+        selected_intervals = target_coding[target_coding['marker_interval']==idx+1].copy()
+        selected_intervals = selected_intervals.rename(columns={'start_timestamp':'startT', 'end_timestamp':'endT'})
+    elif validation_plane.is_dynamic():
+        marker_observations_per_target, markers_per_target = marker_observations
+        selected_intervals, other_intervals = \
+            assign_intervals.dynamic_markers(marker_observations_per_target,
+                                            markers_per_target,
+                                            working_dir/gt_naming.frame_timestamps_fname,
+                                            intervals[idx],
+                                            cs['validation_setup']['dynamic_skip_first_duration'],
+                                            cs['validation_setup']['dynamic_max_gap_duration'],
+                                            cs['validation_setup']['dynamic_min_duration'],
+                                            e)
+    else:
+        # classify fixations for this episode. The gaze data shown in the fixation plot is stored next to the
+        # fixations, so that the plot can be made later without rerunning the classification.
+        # Results are cached, classification is only run if the inputs for this episode changed
+        output_stem   = working_dir / f'{naming.validation_prefix}{e}{naming.val_fixation_infix}{idx+1:02d}'
+        fix_file      = output_stem.with_name(f'{output_stem.name}.tsv')
+        plot_data_file= output_stem.with_name(f'{output_stem.name}{naming.val_fixation_plot_data_suffix}.tsv')
+        plot_file     = output_stem.with_name(f'{output_stem.name}.png')
+        suffixes      = ['.png'] if plots_only else ['.tsv', f'{naming.val_fixation_plot_data_suffix}.tsv'] + (['.png'] if do_plots else [])
+        if not _fixation_cache.restore(working_dir, cache_key, output_stem, suffixes):
+            if plots_only:
+                if not plot_data_file.is_file():
+                    raise FileNotFoundError(f'The data for plotting the fixations of validation event "{e}" (episode {idx+1}) was not found, run the {process.Action.VALIDATE.displayable_name} action again before making plots')
+                fixations, plot_data = _fixation_classification.read_file(fix_file), _fixation_classification.read_file(plot_data_file)
+            else:
+                gazes = gaze_worldref.read_dict_from_file(working_dir/f'{naming.world_gaze_prefix}{p}.tsv')
+                fixations, plot_data = _fixation_classification.classify(gazes, intervals[idx], cs['validation_setup']['I2MC_settings'])
+                _fixation_classification.write_fixations(fixations, fix_file)
+                _fixation_classification.write_plot_data(plot_data, plot_data_file)
+            if do_plots:
+                _fixation_classification.plot(fixations, plot_data, plot_limits, plot_file)
+            _fixation_cache.store(working_dir, cache_key, output_stem, suffixes)
+        selected_intervals, other_intervals = \
+            assign_intervals.distance(targets,
+                                    fix_file,
+                                    do_global_shift=cs['validation_setup']['do_global_shift'],
+                                    max_dist_fac=cs['validation_setup']['max_dist_fac'])
+
+    # plot output
+    if do_plots:
+        assign_intervals.plot(selected_intervals,
+                            other_intervals,
+                            targets,
+                            working_dir/f'{naming.world_gaze_prefix}{p}.tsv',
+                            intervals[idx],
+                            working_dir,
+                            filename_stem=f'{naming.validation_prefix}{e}_fixation_assignment',
+                            iteration=idx,
+                            background_image=background_image,
+                            plot_limits=plot_limits)
+
+    # NB: output is stored to file by the caller, since episodes have to be appended to the file in order
+    return None if plots_only else selected_intervals
+
+
+def _compute_data_quality(working_dir: pathlib.Path, config_dir: pathlib.Path, e: str, intervals: list[list[int]], cs: config.EventSetup, plane_def: plane.Definition, has_override: bool):
+    # NB: run in a worker process, so can only take picklable arguments
+    validation_plane, _, _, targets = _get_plane_info(plane_def, config_dir)
+    p = plane_def.name
+    compute_offsets.compute(working_dir/f'{naming.world_gaze_prefix}{p}.tsv',
+                            _pose_files.get_preferred_plane_pose_file(working_dir, p)[0],
+                            working_dir/f'{naming.validation_prefix}{e}_fixation_assignment{("_override" if has_override else "")}.tsv',
+                            intervals,
+                            targets,
+                            validation_plane.config['distance']*10.,    # cm -> mm
+                            working_dir,
+                            filename=f'{naming.validation_prefix}{e}_data_quality.tsv',
+                            d_types=cs['validation_setup']['data_types'],
+                            allow_data_type_fallback=cs['validation_setup']['allow_data_type_fallback'],
+                            include_data_loss=cs['validation_setup']['include_data_loss'])
@@ -1,10 +1,10 @@
 import pathlib
 import numpy as np
 import pandas as pd
-import polars as pl
 from collections import defaultdict
 import sys
 import time
+import warnings
 
 isMacOS = sys.platform.startswith("darwin")
 if isMacOS:
@@ -13,13 +13,20 @@ if isMacOS:
 from glassesTools import annotation, gaze_headref, naming as gt_naming, ocv, pose, process_pool, propagating_thread, timestamps, video_utils
 from glassesTools.gui.signal_sync import GUI, TargetPos
 
-from . import _utils
+from . import _gaze_files
 from .. import config, episode, naming, process, session
 
 
-def run(working_dir: str|pathlib.Path, config_dir: str|pathlib.Path|None = None, **study_settings):
+def run(working_dir: str|pathlib.Path, config_dir: str|pathlib.Path|None = None, no_gui=False, force_gui=False, **study_settings) -> list[int]:
     # apply_average: if True: the average offset for all VOR sync episodes will be applied to the timestamps
     # if False, the VOR offset for the first episode will be applied, the rest are taken as checks
+    # no_gui: if True, only automatic offset estimation is performed. Episodes for which the estimate is not
+    # reliable (or all episodes, if automatic estimation is not enabled) are left for review in the GUI during
+    # a next run, and are returned so that the caller can schedule that run
+    # force_gui: if True, all episodes are shown in the GUI, also when automatic offset estimation found all
+    # estimates to be reliable. The automatic estimates are then the starting point in the GUI
+    if no_gui and force_gui:
+        raise ValueError('no_gui and force_gui cannot both be set')
     working_dir = pathlib.Path(working_dir)
     if config_dir is None:
         config_dir = config.guess_config_dir(working_dir)
@@ -27,23 +34,63 @@ def run(working_dir: str|pathlib.Path, config_dir: str|pathlib.Path|None = None,
 
     print(f'processing: {working_dir.parent.name}/{working_dir.name}')
 
+    # with automatic offset estimation, the GUI is only needed for episodes for which the estimate is not reliable
+    study_config = config.read_study_config_with_overrides(config_dir, {config.OverrideLevel.Session: working_dir.parent, config.OverrideLevel.Recording: working_dir}, **study_settings)
+    episodes_to_review = None
+    if process.config_has_automatic_et_sync(study_config, working_dir.name):
+        episodes_to_review = do_the_automatic_work(working_dir, study_config, apply=not force_gui)
+        if force_gui:
+            episodes_to_review = None   # review all
+        elif not episodes_to_review:
+            return []
+        elif no_gui:
+            warnings.warn(f'The automatically estimated offset is not reliable for VOR sync episode(s) {", ".join(str(i) for i in episodes_to_review)}. Run sync_et_to_cam again with the GUI to review these episodes.', process_pool.ProcessingWarning)
+            return episodes_to_review
+    elif no_gui:
+        # nothing can be done without GUI
+        warnings.warn('Automatic offset estimation (sync_setup.auto_estimate) is not enabled for all ET sync events of this recording. Run sync_et_to_cam with the GUI to set the offsets.', process_pool.ProcessingWarning)
+        return list(range(len(_get_episodes(study_config, working_dir, _get_sync_events(study_config, working_dir.name)))))
+
     # We run processing in a separate thread (GUI needs to be on the main thread for OSX, see https://github.com/pthom/hello_imgui/issues/33)
     gui = GUI(use_thread = False)
 
-    proc_thread = propagating_thread.PropagatingThread(target=do_the_work, args=(working_dir, config_dir, gui), kwargs=study_settings, cleanup_fun=gui.stop)
+    proc_thread = propagating_thread.PropagatingThread(target=do_the_work, args=(working_dir, config_dir, gui, episodes_to_review), kwargs=study_settings, cleanup_fun=gui.stop)
     proc_thread.start()
     gui.start()
     proc_thread.join()
+    return []
 
 
-def do_the_work(working_dir: pathlib.Path, config_dir: pathlib.Path, gui: GUI, **study_settings):
-    # get settings for the study
-    study_config = config.read_study_config_with_overrides(config_dir, {config.OverrideLevel.Session: working_dir.parent, config.OverrideLevel.Recording: working_dir}, **study_settings)
-
-    # check there is a sync setup
+def _get_sync_events(study_config: config.Study, rec_name: str) -> list[config.EventSetup]:
     sync_events = process.get_specific_event_types(study_config, annotation.EventType.Sync_ET_Data)
     # remove events that are not configured for this recording
-    sync_events = [cs for cs in sync_events if cs['which_recordings'] is None or working_dir.name in cs['which_recordings']]
+    return [cs for cs in sync_events if cs['which_recordings'] is None or rec_name in cs['which_recordings']]
+
+def _get_episodes(study_config: config.Study, working_dir: pathlib.Path, sync_events: list[config.EventSetup]) -> list[tuple[str, list[int]]]:
+    episodes = episode.load_episodes_from_all_recordings(study_config, working_dir, {cs['name'] for cs in sync_events})[0]
+    # flatten into list of tuples for easier processing
+    return [(e, v) for e in episodes for v in episodes[e][1]]
+
+def _read_VOR_sync(VOR_sync_file: pathlib.Path, n_episodes: int) -> pd.DataFrame:
+    VOR_sync = pd.read_csv(VOR_sync_file, index_col=0, delimiter='\t')
+    # make sure we have the expected number of intervals
+    VOR_sync = VOR_sync.drop([v for v in VOR_sync.index if v not in range(n_episodes)])
+    for i in [v for v in range(n_episodes) if v not in VOR_sync.index]:
+        VOR_sync.loc[i] = np.nan
+    # files made before automatic estimation was available do not have a quality column
+    # NB: quality is nan for offsets that were set using the GUI
+    if 'quality' not in VOR_sync.columns:
+        VOR_sync['quality'] = np.nan
+    return VOR_sync
+
+def _get_episodes_to_review(VOR_sync: pd.DataFrame, episodes: list[tuple[str, list[int]]], sync_events: list[config.EventSetup]) -> list[int]:
+    min_quality = {cs['name']: cs['sync_setup'].get('auto_min_quality', .8) for cs in sync_events}
+    return [i for i,(e,_) in enumerate(episodes) if VOR_sync.loc[i, 'quality']<min_quality[e]]
+
+
+def _load_data(working_dir: pathlib.Path, study_config: config.Study):
+    # check there is a sync setup
+    sync_events = _get_sync_events(study_config, working_dir.name)
     if not sync_events:
         raise ValueError('No ET sync events are configured for the study, nothing to process')
 
@@ -53,12 +100,12 @@ def do_the_work(working_dir: pathlib.Path, config_dir: pathlib.Path, gui: GUI, *
         raise ValueError(f'You can only run sync_et_to_cam on eye tracker recordings, not on a {str(rec_def.type).split(".")[1]} recording')
 
     # get interval coding
-    episodes = episode.load_episodes_from_all_recordings(study_config, working_dir, {cs['name'] for cs in sync_events})[0]
-    if not episodes or not any(episodes[e][1] for e in episodes):
+    episodes = _get_episodes(study_config, working_dir, sync_events)
+    if not episodes:
         raise RuntimeError(f'No {annotation.tooltip_map[annotation.EventType.Sync_ET_Data]}s found for this recording. Run code_episodes and code at least one {annotation.tooltip_map[annotation.EventType.Sync_ET_Data]}.')
 
     # Read gaze data
-    gazes = gaze_headref.read_dict_from_file(working_dir / gt_naming.gaze_data_fname, [v for e in episodes for v in episodes[e][1]])[0]
+    gazes = gaze_headref.read_dict_from_file(working_dir / gt_naming.gaze_data_fname, [v for _,v in episodes])[0]
     # time info
     video_ts = timestamps.VideoTimestamps(working_dir / gt_naming.frame_timestamps_fname)
 
@@ -76,7 +123,7 @@ def do_the_work(working_dir: pathlib.Path, config_dir: pathlib.Path, gui: GUI, *
                 pln_file = working_dir/f'{naming.plane_pose_prefix}{pln}.tsv'
                 if not pln_file.is_file():
                     raise FileNotFoundError(f'A planePose file for the {pln} plane is not found, but is needed. Run detect_markers to create this file.')
-                poses = pose.read_dict_from_file(pln_file, episodes[nm][1])
+                poses = pose.read_dict_from_file(pln_file, [v for e,v in episodes if e==nm])
 
                 # get camera calibration info
                 camera_params = ocv.CameraParams.read_from_file(working_dir / gt_naming.scene_camera_calibration_fname)
@@ -92,24 +139,105 @@ def do_the_work(working_dir: pathlib.Path, config_dir: pathlib.Path, gui: GUI, *
                 df['cam_pos'] = [x for x in df[['target_x','target_y']].values]
                 target_positions[nm] = {idx:TargetPos(video_ts.get_timestamp(idx), **kwargs) for idx,kwargs in zip(df['frame_idx'].values,df[['frame_idx','cam_pos']].to_dict(orient='records'))}
 
-    # flatten into list of tuples for easier processing
-    episodes = [(e, v) for e in episodes for v in episodes[e][1]]
-
     # get previous sync settings, if any
     VOR_sync_file = working_dir / naming.VOR_sync_file
     if VOR_sync_file.is_file():
-        VOR_sync = pd.read_csv(VOR_sync_file, index_col=0, delimiter='\t')
-        # make sure we have the expected number of intervals
-        VOR_sync.drop([v for v in VOR_sync.index if v not in range(len(episodes))])
-        for i in [v for v in range(len(episodes)) if v not in VOR_sync.index]:
-            VOR_sync.loc[i] = np.nan
+        VOR_sync = _read_VOR_sync(VOR_sync_file, len(episodes))
     else:
-        VOR_sync = pd.DataFrame(columns=['offset_t'], dtype=float, index=pd.Index(list(range(len(episodes))),name='interval'))
+        VOR_sync = pd.DataFrame(columns=['offset_t','quality'], dtype=float, index=pd.Index(list(range(len(episodes))),name='interval'))
     VOR_sync_original = VOR_sync.copy() if VOR_sync_file.is_file() else None
 
+    return sync_events, episodes, gazes, target_positions, video_ts, VOR_sync, VOR_sync_original
+
+def _get_episode_data(episode: tuple[str, list[int]], gazes: dict[int, list[gaze_headref.Gaze]], target_positions: dict[str, dict[int, TargetPos]]) -> tuple[dict[int, list[gaze_headref.Gaze]], dict[int, TargetPos]]:
+    e,(start, end) = episode
+    ep_gaze  = {fr:gazes              [fr] for fr in      gazes          if fr>=start and fr<=end}
+    ep_t_pos = {fr:target_positions[e][fr] for fr in target_positions[e] if fr>=start and fr<=end}
+    if not ep_gaze:
+        raise RuntimeError(f'No gaze data found between frames {start} and {end}')
+    if not ep_t_pos:
+        raise RuntimeError(f'No target/scene camera data found between frames {start} and {end} for episode "{e}"')
+    return ep_gaze, ep_t_pos
+
+
+def estimate_offset(gazes: dict[int, list[gaze_headref.Gaze]], target_positions: dict[int, TargetPos], max_offset: float, step: float = 1.) -> tuple[float, float]:
+    # Estimate the offset (s) to add to the gaze timestamps such that the gaze signal best lines up with the target
+    # position signal, by maximizing the correlation between the gaze and target velocity. During VOR, the eyes
+    # counterroll in the head such that gaze stays on the target, so both signals should be identical once synced.
+    # Returns the offset and the correlation at that offset (quality of the estimate). step is the resolution (ms)
+    # of the search
+    g_ts  = np.array([s.timestamp       for fr in gazes for s in gazes[fr]],'float')
+    g_pos = np.array([s.gaze_pos_vid    for fr in gazes for s in gazes[fr]],'float').reshape(-1,2)
+    t_ts  = np.array([target_positions[fr].timestamp for fr in target_positions],'float')
+    t_pos = np.array([target_positions[fr].cam_pos   for fr in target_positions],'float').reshape(-1,2)
+    g_ok  = ~np.isnan(g_pos).any(axis=1)
+    g_ts, g_pos = g_ts[g_ok], g_pos[g_ok]
+    if g_ts.size<2 or t_ts.size<2:
+        return np.nan, 0.
+
+    # target velocity on a regular time grid
+    t_grid  = np.arange(t_ts[0], t_ts[-1], step)
+    t_vel   = np.gradient(np.column_stack([np.interp(t_grid, t_ts, t_pos[:,c]) for c in range(2)]), axis=0)
+    # for each candidate offset, get gaze velocity on the same grid and correlate (only where the signals overlap)
+    lags    = np.arange(-round(max_offset*1000./step), round(max_offset*1000./step)+1)
+    corrs   = np.full(lags.shape, np.nan)
+    for i,lag in enumerate(lags):
+        g_t     = t_grid-lag*step
+        sel     = (g_t>=g_ts[0]) & (g_t<=g_ts[-1])
+        if np.count_nonzero(sel)<3:
+            continue
+        g_vel   = np.gradient(np.column_stack([np.interp(g_t[sel], g_ts, g_pos[:,c]) for c in range(2)]), axis=0)
+        tv      = t_vel[sel]-t_vel[sel].mean(axis=0)
+        gv      = g_vel     -g_vel     .mean(axis=0)
+        denom   = np.sqrt((tv**2).sum()*(gv**2).sum())
+        if denom>0:
+            corrs[i] = (tv*gv).sum()/denom
+    if np.all(np.isnan(corrs)):
+        return np.nan, 0.
+
+    # find peak, refine with parabolic interpolation
+    i_max   = np.nanargmax(corrs)
+    lag     = float(lags[i_max])
+    if 0<i_max<len(lags)-1 and not np.isnan(corrs[i_max-1]) and not np.isnan(corrs[i_max+1]):
+        denom = corrs[i_max-1]-2*corrs[i_max]+corrs[i_max+1]
+        if denom<0:
+            lag += .5*(corrs[i_max-1]-corrs[i_max+1])/denom
+    return float(lag*step/1000.), float(corrs[i_max])  # ms -> s
+
+
+def do_the_automatic_work(working_dir: pathlib.Path, study_config: config.Study, apply=True) -> list[int]:
+    # returns the episodes whose offset estimate is not reliable and needs to be reviewed in the GUI.
+    # If there are none, the sync is applied (unless apply is False, e.g. because all episodes will be reviewed)
+    sync_events, episodes, gazes, target_positions, video_ts, VOR_sync, VOR_sync_original = _load_data(working_dir, study_config)
+    max_offset = {cs['name']: cs['sync_setup'].get('auto_max_offset', .5) for cs in sync_events}
+
+    # estimate offset for all episodes, except those for which the offset was set using the GUI
+    for ival,ep in enumerate(episodes):
+        if not np.isnan(VOR_sync.loc[ival, 'offset_t']) and np.isnan(VOR_sync.loc[ival, 'quality']):
+            continue
+        ep_gaze, ep_t_pos = _get_episode_data(ep, gazes, target_positions)
+        VOR_sync.loc[ival, ['offset_t','quality']] = estimate_offset(ep_gaze, ep_t_pos, max_offset[ep[0]])
+
+    if (episodes_to_review:=_get_episodes_to_review(VOR_sync, episodes, sync_events)) or not apply:
+        # store what we have so that it can be used as starting point in the GUI
+        VOR_sync.to_csv(working_dir / naming.VOR_sync_file, sep='\t', float_format="%.4f")
+        return episodes_to_review
+
+    _store_and_apply(working_dir, study_config, sync_events, video_ts, VOR_sync, VOR_sync_original)
+    return []
+
+
+def do_the_work(working_dir: pathlib.Path, config_dir: pathlib.Path, gui: GUI, episodes_to_review: list[int]|None=None, **study_settings):
+    # get settings for the study
+    study_config = config.read_study_config_with_overrides(config_dir, {config.OverrideLevel.Session: working_dir.parent, config.OverrideLevel.Recording: working_dir}, **study_settings)
+
+    sync_events, episodes, gazes, target_positions, video_ts, VOR_sync, VOR_sync_original = _load_data(working_dir, study_config)
+    if episodes_to_review is None:
+        episodes_to_review = list(range(len(episodes)))
+
     # show
     has_requested_focus = not isMacOS # False only if on Mac OS, else True since its a no-op
-    ival = 0
+    i = 0
     need_to_load = True
     while True:
         if gui.is_running() and not has_requested_focus:
@@ -118,17 +246,14 @@ def do_the_work(working_dir: pathlib.Path, config_dir: pathlib.Path, gui: GUI, *
 
         if gui.is_running() and need_to_load:
             # select data
-            e,(start, end) = episodes[ival]
-            plot_gaze  = {fr:gazes              [fr] for fr in      gazes          if fr>=start and fr<=end}
-            plot_t_pos = {fr:target_positions[e][fr] for fr in target_positions[e] if fr>=start and fr<=end}
-            if not plot_gaze:
-                raise RuntimeError(f'No gaze data found between frames {start} and {end}')
-            if not plot_t_pos:
-                raise RuntimeError(f'No target/scene camera data found between frames {start} and {end} for episode "{e}"')
+            ival = episodes_to_review[i]
+            plot_gaze, plot_t_pos = _get_episode_data(episodes[ival], gazes, target_positions)
             # determine initial offset
             toff = VOR_sync.loc[ival, 'offset_t']
             if np.isnan(toff):
                 toff = VOR_sync.loc[ival-1, 'offset_t'] if ival>0 else 0.
+                if np.isnan(toff):
+                    toff = 0.
             # submit to GUI
             gui.set_data(f'{working_dir.parent.name}, {working_dir.name}', ival, plot_gaze, plot_t_pos, offset_t=toff)
             need_to_load = False
@@ -141,11 +266,12 @@ def do_the_work(working_dir: pathlib.Path, config_dir: pathlib.Path, gui: GUI, *
         if closed:
             break
         if is_done:
-            # store offset
+            # store offset, flag as set using the GUI
             VOR_sync.loc[ival, 'offset_t'] = gui.offset_t
+            VOR_sync.loc[ival, 'quality'] = np.nan
             # move to next interval, if any
-            ival += 1
-            if ival>len(episodes)-1:
+            i += 1
+            if i>len(episodes_to_review)-1:
                 # no more episodes, we're done
                 break
             else:
@@ -153,6 +279,10 @@ def do_the_work(working_dir: pathlib.Path, config_dir: pathlib.Path, gui: GUI, *
 
     gui.stop()
 
+    _store_and_apply(working_dir, study_config, sync_events, video_ts, VOR_sync, VOR_sync_original)
+
+
+def _store_and_apply(working_dir: pathlib.Path, study_config: config.Study, sync_events: list[config.EventSetup], video_ts: timestamps.VideoTimestamps, VOR_sync: pd.DataFrame, VOR_sync_original: pd.DataFrame|None):
     # early exit if nothing has changed
     if VOR_sync_original is not None and VOR_sync.equals(VOR_sync_original):
         if session.get_action_states(working_dir, True)[process.Action.SYNC_ET_TO_CAM]==process_pool.State.Completed:
@@ -161,7 +291,7 @@ def do_the_work(working_dir: pathlib.Path, config_dir: pathlib.Path, gui: GUI, *
         return
 
     # store to file
-    VOR_sync.to_csv(VOR_sync_file, sep='\t', float_format="%.4f") # .1 ms resolution
+    VOR_sync.to_csv(working_dir / naming.VOR_sync_file, sep='\t', float_format="%.4f") # .1 ms resolution
 
     # apply offset to gaze
     if len(set(cs['sync_setup']['use_average'] for cs in sync_events))!=1:
@@ -169,16 +299,12 @@ def do_the_work(working_dir: pathlib.Path, config_dir: pathlib.Path, gui: GUI, *
     if sync_events[0]['sync_setup']['use_average']:
         toff = VOR_sync['offset_t'].mean()
     else:
-        toff = VOR_sync.iloc[0,'offset_t']
-    # just read whole gaze dataframe so we can apply things vectorized
-    df = pd.read_csv(working_dir / gt_naming.gaze_data_fname, delimiter='\t', index_col=False)
+        toff = VOR_sync['offset_t'].iloc[0]
     # resync gaze timestamps using VOR, and get correct scene camera frame numbers
-    ts_VOR = df['timestamp'].to_numpy() + toff*1000.   # s -> ms
+    ts_VOR = _gaze_files.read_timestamps(working_dir, ['']) + toff*1000.   # s -> ms
     fr_VOR = video_utils.timestamps_to_frame_number(ts_VOR,video_ts.timestamps,trim=True)['frame_idx'].to_numpy()
-    # write into df (use polars as that library saves to file waaay faster)
-    df = _utils.insert_ts_fridx_in_df(df, gaze_headref.Gaze, 'VOR', ts_VOR, fr_VOR)
-    df = pl.from_pandas(df)
-    df.write_csv(working_dir / gt_naming.gaze_data_fname, separator='\t', null_value='nan', float_precision=8)
+    # store alongside the gaze data file
+    _gaze_files.write_sync_columns(working_dir, 'VOR', ts_VOR, fr_VOR)
 
     # update state
-    session.update_action_states(working_dir, process.Action.SYNC_ET_TO_CAM, process_pool.State.Completed, study_config)
\ No newline at end of file
+    session.update_action_states(working_dir, process.Action.SYNC_ET_TO_CAM, process_pool.State.Completed, study_config)
@@ -1,12 +1,11 @@
 import pathlib
 import numpy as np
 import pandas as pd
-import polars as pl
 
-from glassesTools import annotation, gaze_headref, naming, process_pool, timestamps
+from glassesTools import annotation, naming, process_pool, timestamps
 
 
-from . import _utils
+from . import _gaze_files
 from .. import config, process, session, synchronization
 
 
@@ -61,6 +60,8 @@ def run(working_dir: str|pathlib.Path, config_dir: str|pathlib.Path|None = None,
 
     # early exit if nothing has changed
     if sync_original is not None and len(sync)==len(sync_original) and np.all(np.isclose(sync.values, sync_original.values, atol=0.0, equal_nan=True)):
+        # ensure frame maps are available (e.g. sync was done with an older version of gazeMapper), nothing is written if they are up to date
+        _write_frame_maps(working_dir, recs, sync, video_ts_ref, study_config)
         if session.get_action_states(working_dir, False)[process.Action.SYNC_TO_REFERENCE]==process_pool.State.Completed:
             return
         session.update_action_states(working_dir, process.Action.SYNC_TO_REFERENCE, process_pool.State.Completed, study_config, unchanged=True)
@@ -74,17 +75,16 @@ def run(working_dir: str|pathlib.Path, config_dir: str|pathlib.Path|None = None,
         rec_def = study_config.session_def.get_recording_def(r)
         has_gaze_data = rec_def.type==session.RecordingType.Eye_Tracker
 
-        # just read whole gaze dataframe so we can apply things vectorized
+        # read only the timestamps so we can apply things vectorized
         if has_gaze_data:
-            df = pd.read_csv(working_dir / r / naming.gaze_data_fname, delimiter='\t', index_col=False)
-            ts_col = 'timestamp_VOR' if 'timestamp_VOR' in df else 'timestamp'
+            ts = _gaze_files.read_timestamps(working_dir / r, ['VOR', ''])
         else:
             # stretch video timestamps instead
             ts_file = working_dir / r / naming.frame_timestamps_fname
             df = pd.read_csv(ts_file, delimiter='\t', index_col='frame_idx')
-            ts_col = 'timestamp'
+            ts = df['timestamp'].to_numpy()
         # get gaze timestamps and camera frame numbers _in reference video timeline_
-        ts_ref, ref_vid_ts, fr_ref = synchronization.apply_sync(r, sync, df[ts_col].to_numpy(), video_ts_ref.timestamps,
+        ts_ref, ref_vid_ts, fr_ref = synchronization.apply_sync(r, sync, ts, video_ts_ref.timestamps,
                                                                 study_config.sync_ref_do_time_stretch, study_config.sync_ref_stretch_which)
 
         # make and store new video time signal
@@ -102,11 +102,9 @@ def run(working_dir: str|pathlib.Path, config_dir: str|pathlib.Path|None = None,
             if should_store:
                 vid_ts_df.to_csv(ref_vid_ts_file, sep='\t', float_format="%.8f")
 
-        # write into df (use polars as that library saves to file waaay faster)
+        # store alongside the gaze data file, or write into video timestamps file
         if has_gaze_data:
-            df = _utils.insert_ts_fridx_in_df(df, gaze_headref.Gaze, 'ref', ts_ref, fr_ref)
-            df = pl.from_pandas(df)
-            df.write_csv(working_dir / r / naming.gaze_data_fname, separator='\t', null_value='nan', float_precision=8)
+            _gaze_files.write_sync_columns(working_dir / r, 'ref', ts_ref, fr_ref)
         else:
             if 'timestamp_ref' not in df.columns:
                 # doesn't exist, insert
@@ -115,5 +113,15 @@ def run(working_dir: str|pathlib.Path, config_dir: str|pathlib.Path|None = None,
                 df['timestamp_ref'] = ts_ref
             df.to_csv(ts_file, sep='\t', float_format="%.8f")
 
+    # store frame correspondence between the reference and each recording, for quick lookup
+    _write_frame_maps(working_dir, recs, sync, video_ts_ref, study_config)
+
     # update state
-    session.update_action_states(working_dir, process.Action.SYNC_TO_REFERENCE, process_pool.State.Completed, study_config)
\ No newline at end of file
+    session.update_action_states(working_dir, process.Action.SYNC_TO_REFERENCE, process_pool.State.Completed, study_config)
+
+
+def _write_frame_maps(working_dir: pathlib.Path, recs: list[str], sync: pd.DataFrame, video_ts_ref: timestamps.VideoTimestamps, study_config: config.Study):
+    for r in recs:
+        video_ts = timestamps.VideoTimestamps(working_dir / r / naming.frame_timestamps_fname)
+        synchronization.write_frame_maps(working_dir / r, r, sync, video_ts.timestamps, video_ts_ref.timestamps,
+                                         study_config.sync_ref_do_time_stretch, study_config.sync_ref_stretch_which)
\ No newline at end of file
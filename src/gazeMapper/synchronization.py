@@ -1,6 +1,7 @@
 import numpy as np
 import pandas as pd
 import pathlib
+import hashlib
 from typing import overload
 
 from glassesTools import annotation, naming as gt_naming, timestamps, video_utils
@@ -87,6 +88,12 @@ def get_sync_for_recs(working_dir: str|pathlib.Path, recs: str|list[str], ref_re
                 sync.loc[(r,ival),'stretch_fac']   = sync.loc[(r,ival),'diff_offset'].mean()/sync.loc[(r,ival),'t_ref_elapsed'].mean()
     return sync
 
+def _get_interval_indices(timestamps: np.ndarray, sync_points: np.ndarray) -> np.ndarray:
+    # determine for each timestamp which interval between sync points it falls in. The first
+    # interval extends to the start of the data and the last interval to the end of the data.
+    # A timestamp exactly on a sync point belongs to the interval that starts at that sync point
+    return np.searchsorted(sync_points[1:-1], timestamps, side='right')
+
 def apply_sync(rec: str,
                sync: pd.DataFrame,
                data_timestamps: np.ndarray|None,
@@ -95,52 +102,30 @@ def apply_sync(rec: str,
                stretch_which: str):
     reference_video_timestamps  = np.array(reference_video_timestamps).copy()
     new_reference_video_timestamps = reference_video_timestamps.copy()
-    rt_start, rt_end            = reference_video_timestamps.min(), reference_video_timestamps.max()
     if has_data_ts := data_timestamps is not None:
         data_timestamps     = np.array(data_timestamps).copy()
-        dt_start, dt_end    = data_timestamps.min(), data_timestamps.max()
         new_data_timestamps = data_timestamps.copy()
-    else:
-        dt_start, dt_end    = None, None
-    num_reference_episodes      = sync.loc[rec].shape[0]
     if do_time_stretch:
-        rec_sync = sync.loc[rec]
-        for ival in range(num_reference_episodes-1):
-            # set up the problem - piecewise linear scale
-            # 1. get known good location for this interval, and the stretch factor
-            t_ref_start  = rec_sync.loc[ival,'t_ref' ]*1000.   # s -> ms
-            t_ref_end    = rec_sync.loc[ival+1,'t_ref' ]*1000. # s -> ms
-            t_this_start = rec_sync.loc[ival,'t_this']*1000.   # s -> ms
-            t_this_end   = rec_sync.loc[ival+1,'t_this']*1000. # s -> ms
-            stretch_fac  = rec_sync.loc[ival,'stretch_fac']
-            # 2. determine the timeline ranges for this interval
-            if ival==0:
-                # first interval, apply all the way from start of data/reference
-                d_start = dt_start
-                r_start = rt_start
-            else:
-                d_start = t_this_start
-                r_start = t_ref_start
-            if ival==num_reference_episodes-2:  # NB: zero-based indexing
-                # last interval, apply all the way to end of data/reference
-                d_end = dt_end
-                r_end = rt_end
-            else:
-                d_end = t_this_end
-                r_end = t_ref_end
-            # calculate new timestamps
+        # piecewise linear scale between the sync points. Look up for each timestamp the interval
+        # it falls in, and then apply the parameters of that interval to all timestamps at once
+        rec_sync    = sync.loc[rec]
+        t_ref       = rec_sync['t_ref' ].to_numpy(dtype='float')*1000.   # s -> ms
+        t_this      = rec_sync['t_this'].to_numpy(dtype='float')*1000.   # s -> ms
+        offset      = rec_sync['offset'].to_numpy(dtype='float')[:-1]*1000. # s -> ms
+        stretch_fac = rec_sync['stretch_fac'].to_numpy(dtype='float')[:-1]
+        if len(stretch_fac)>0:
             if stretch_which=='ref':
                 # 1. first translate gaze ts to reference timestamps
                 if has_data_ts:
-                    data_sel = (data_timestamps >= d_start) & (data_timestamps <= d_end)
-                    new_data_timestamps[data_sel] += rec_sync.loc[ival,'offset']*1000.   # s -> ms
+                    ival = _get_interval_indices(data_timestamps, t_this)
+                    new_data_timestamps = data_timestamps + offset[ival]
                 # 2. apply scaling
-                ref_sel = (reference_video_timestamps >= r_start) & (reference_video_timestamps <= r_end)
-                new_reference_video_timestamps[ref_sel] = (reference_video_timestamps[ref_sel]-t_ref_start)*(1-stretch_fac)+t_ref_start
+                ival = _get_interval_indices(reference_video_timestamps, t_ref)
+                new_reference_video_timestamps = (reference_video_timestamps-t_ref[ival])*(1-stretch_fac[ival])+t_ref[ival]
             elif stretch_which=='other':
                 if has_data_ts:
-                    data_sel = (data_timestamps >= d_start) & (data_timestamps <= d_end)
-                    new_data_timestamps[data_sel] = t_ref_start+(data_timestamps[data_sel]-t_this_start)/(1-stretch_fac)
+                    ival = _get_interval_indices(data_timestamps, t_this)
+                    new_data_timestamps = t_ref[ival]+(data_timestamps-t_this[ival])/(1-stretch_fac[ival])
                 # else nothing to do...
     else:
         if has_data_ts:
@@ -148,6 +133,7 @@ def apply_sync(rec: str,
     if has_data_ts:
         fr_ref = video_utils.timestamps_to_frame_number(new_data_timestamps,new_reference_video_timestamps,trim=True)['frame_idx'].to_numpy(copy=True)
     else:
+        new_data_timestamps = None
         fr_ref = None
     return new_data_timestamps, new_reference_video_timestamps, fr_ref
 
@@ -186,18 +172,22 @@ def get_episode_frame_indices_from_other_video(working_dir: str|pathlib.Path, ev
         return None
     video_ts_other = timestamps.VideoTimestamps(working_dir.parent / other_rec / gt_naming.frame_timestamps_fname)
     video_ts       = timestamps.VideoTimestamps(working_dir / gt_naming.frame_timestamps_fname)
+    video_ts_ref   = video_ts if rec==ref_rec else video_ts_other if other_rec==ref_rec else timestamps.VideoTimestamps(working_dir.parent / ref_rec / gt_naming.frame_timestamps_fname)
+    return other_video_frame_indices_to_video(working_dir.parent, other_episodes[event][1], rec, other_rec, ref_rec, sync, video_ts, video_ts_other, video_ts_ref, do_time_stretch, stretch_which, extra_fr)
+
+def other_video_frame_indices_to_video(session_dir: str|pathlib.Path, fr_idxs: list[list[int]], rec: str, other_rec: str, ref_rec: str, sync: pd.DataFrame, video_ts: timestamps.VideoTimestamps, video_ts_other: timestamps.VideoTimestamps, video_ts_ref: timestamps.VideoTimestamps, do_time_stretch: bool, stretch_which: str, extra_fr=0) -> list[list[int]]:
+    session_dir = pathlib.Path(session_dir)
     def _check_bounds(eps: list[list[int]], max_i: int) -> list[list[int]]:
         return [[max(0,ep[0]), min(ep[1], max_i)] for ep in eps if not all([x==-1 for x in ep])]
     # if one of the recordings is the reference recording, we can directly go from reference to this recording
     if other_rec==ref_rec:
-        frame_idx = reference_frames_to_video(rec, sync, other_episodes[event][1], video_ts.timestamps, video_ts_other.timestamps, do_time_stretch, stretch_which)
+        frame_idx = reference_frames_to_video(rec, sync, fr_idxs, video_ts.timestamps, video_ts_other.timestamps, do_time_stretch, stretch_which, session_dir / rec)
     elif rec==ref_rec:
-        frame_idx = video_frames_to_reference(other_rec, sync, other_episodes[event][1], video_ts_other.timestamps, video_ts.timestamps, do_time_stretch, stretch_which)
+        frame_idx = video_frames_to_reference(other_rec, sync, fr_idxs, video_ts_other.timestamps, video_ts.timestamps, do_time_stretch, stretch_which, session_dir / other_rec)
     else:
         # else we need to go from other_rec to ref_rec and then from ref_rec to this recording. Do so with a function that does not clip, nor quantize to the frames in the reference video
         # so that we do not lose precision or range
-        video_ts_ref = timestamps.VideoTimestamps(working_dir.parent / ref_rec / gt_naming.frame_timestamps_fname)
-        frame_idx = video_frames_to_other_video(other_rec, rec, sync, other_episodes[event][1], video_ts_other.timestamps, video_ts.timestamps, video_ts_ref.timestamps, do_time_stretch, stretch_which)
+        frame_idx = video_frames_to_other_video(other_rec, rec, sync, fr_idxs, video_ts_other.timestamps, video_ts.timestamps, video_ts_ref.timestamps, do_time_stretch, stretch_which)
     # remove out of range
     frame_idx = _check_bounds(frame_idx, video_ts.indices[-1])
     return [[i+e for i,e in zip(ifs, [-extra_fr, extra_fr])] for ifs in frame_idx]   # expand by extra_fr frames on each edge
@@ -209,24 +199,61 @@ def video_episode_dict_to_reference(rec: str,
                                     this_video_ts: list[float] | np.ndarray,
                                     video_ts_ref: list[float] | np.ndarray,
                                     do_time_stretch: bool,
-                                    stretch_which: str) -> episode.EpisodeMap:
+                                    stretch_which: str,
+                                    rec_dir: str|pathlib.Path|None = None) -> episode.EpisodeMap:
     return {
         event: (
             episodes[event][0],
-            video_frames_to_reference(rec, sync, episodes[event][1], this_video_ts, video_ts_ref, do_time_stretch, stretch_which),
+            video_frames_to_reference(rec, sync, episodes[event][1], this_video_ts, video_ts_ref, do_time_stretch, stretch_which, rec_dir),
         )
         for event in episodes
     }
 
 
-@overload
-def reference_frames_to_video(rec: str, sync: pd.DataFrame, fr_idxs: list[int], video_ts: list[float]|np.ndarray, video_ts_ref: list[float]|np.ndarray, do_time_stretch: bool, stretch_which: str) -> list[int]: ...
-@overload
-def reference_frames_to_video(rec: str, sync: pd.DataFrame, fr_idxs: list[list[int]], video_ts: list[float]|np.ndarray, video_ts_ref: list[float]|np.ndarray, do_time_stretch: bool, stretch_which: str) -> list[list[int]]: ...
-def reference_frames_to_video(rec: str, sync: pd.DataFrame, fr_idxs: list[int]|list[list[int]], this_video_ts: list[float]|np.ndarray, video_ts_ref: list[float]|np.ndarray, do_time_stretch: bool, stretch_which: str) -> list[int]|list[list[int]]:
-    if not fr_idxs:
-        return []
+def _get_frame_map_key(rec: str, sync: pd.DataFrame, this_video_ts: list[float]|np.ndarray, video_ts_ref: list[float]|np.ndarray, do_time_stretch: bool, stretch_which: str) -> np.ndarray:
+    # fingerprint of everything that goes into the frame correspondence maps, used to detect stale stored maps
+    h = hashlib.sha1()
+    h.update(sync.loc[rec].to_numpy(dtype='float').tobytes())
+    h.update(f'{bool(do_time_stretch)}_{stretch_which}'.encode())
+    h.update(np.asarray(this_video_ts, dtype='float').tobytes())
+    h.update(np.asarray(video_ts_ref, dtype='float').tobytes())
+    return np.frombuffer(h.digest(), dtype='int32')
 
+def _read_frame_maps(rec_dir: str|pathlib.Path, key: np.ndarray, n_ref: int, n_this: int) -> tuple[np.ndarray, np.ndarray]|None:
+    # file layout: key, reference->this video frame map, this video->reference frame map
+    frame_map_file = pathlib.Path(rec_dir) / naming.ref_frame_map_file
+    if not frame_map_file.is_file():
+        return None
+    try:
+        frame_maps = np.load(frame_map_file, mmap_mode='r')
+    except (OSError, ValueError):
+        return None
+    if frame_maps.dtype!=np.int32 or frame_maps.size!=key.size+n_ref+n_this or not np.array_equal(frame_maps[:key.size], key):
+        # stale
+        return None
+    return frame_maps[key.size:key.size+n_ref], frame_maps[key.size+n_ref:]
+
+def write_frame_maps(rec_dir: str|pathlib.Path, rec: str, sync: pd.DataFrame, this_video_ts: list[float]|np.ndarray, video_ts_ref: list[float]|np.ndarray, do_time_stretch: bool, stretch_which: str):
+    key = _get_frame_map_key(rec, sync, this_video_ts, video_ts_ref, do_time_stretch, stretch_which)
+    if _read_frame_maps(rec_dir, key, len(video_ts_ref), len(this_video_ts)) is not None:
+        # up to date, nothing to do
+        return
+    ref_to_this = get_reference_to_video_frame_map(rec, sync, this_video_ts, video_ts_ref, do_time_stretch, stretch_which)
+    this_to_ref = get_video_to_reference_frame_map(rec, sync, this_video_ts, video_ts_ref, do_time_stretch, stretch_which)
+    np.save(pathlib.Path(rec_dir) / naming.ref_frame_map_file, np.concatenate((key, ref_to_this, this_to_ref)).astype('int32'))
+
+def _get_frame_map(rec: str, sync: pd.DataFrame, this_video_ts: list[float]|np.ndarray, video_ts_ref: list[float]|np.ndarray, do_time_stretch: bool, stretch_which: str, rec_dir: str|pathlib.Path|None, to_reference: bool) -> np.ndarray:
+    # use frame map stored by SYNC_TO_REFERENCE if available and up to date, else compute
+    if rec_dir is not None:
+        key = _get_frame_map_key(rec, sync, this_video_ts, video_ts_ref, do_time_stretch, stretch_which)
+        if (frame_maps:=_read_frame_maps(rec_dir, key, len(video_ts_ref), len(this_video_ts))) is not None:
+            return frame_maps[1 if to_reference else 0]
+    if to_reference:
+        return get_video_to_reference_frame_map(rec, sync, this_video_ts, video_ts_ref, do_time_stretch, stretch_which)
+    else:
+        return get_reference_to_video_frame_map(rec, sync, this_video_ts, video_ts_ref, do_time_stretch, stretch_which)
+
+def get_reference_to_video_frame_map(rec: str, sync: pd.DataFrame, this_video_ts: list[float]|np.ndarray, video_ts_ref: list[float]|np.ndarray, do_time_stretch: bool, stretch_which: str) -> np.ndarray:
     # get the video's timestamps in time of the reference video
     this_video_ts_ref, video_ts_ref, _ = apply_sync(rec, sync, this_video_ts, video_ts_ref, do_time_stretch, stretch_which)
 
@@ -241,17 +268,9 @@ def reference_frames_to_video(rec: str, sync: pd.DataFrame, fr_idxs: list[int]|l
         # If the first reference timestamp is only about one frame early, keep it.
         if video_ts_ref[1]-video_ts_ref[0] < ifi*1.2:
             fr_idx_ref[0] = fr_idx_ref[1]-1
+    return fr_idx_ref
 
-    return fr_idx_ref[fr_idxs].tolist()
-
-@overload
-def video_frames_to_reference(rec: str, sync: pd.DataFrame, fr_idxs: list[int], video_ts: list[float]|np.ndarray, video_ts_ref: list[float]|np.ndarray, do_time_stretch: bool, stretch_which: str) -> list[int]: ...
-@overload
-def video_frames_to_reference(rec: str, sync: pd.DataFrame, fr_idxs: list[list[int]], video_ts: list[float]|np.ndarray, video_ts_ref: list[float]|np.ndarray, do_time_stretch: bool, stretch_which: str) -> list[list[int]]: ...
-def video_frames_to_reference(rec: str, sync: pd.DataFrame, fr_idxs: list[int]|list[list[int]], this_video_ts: list[float]|np.ndarray, video_ts_ref: list[float]|np.ndarray, do_time_stretch: bool, stretch_which: str) -> list[int]|list[list[int]]:
-    if not fr_idxs:
-        return []
-
+def get_video_to_reference_frame_map(rec: str, sync: pd.DataFrame, this_video_ts: list[float]|np.ndarray, video_ts_ref: list[float]|np.ndarray, do_time_stretch: bool, stretch_which: str) -> np.ndarray:
     # get the video's timestamps in time of the reference video
     this_video_ts_ref, video_ts_ref, _ = apply_sync(rec, sync, this_video_ts, video_ts_ref, do_time_stretch, stretch_which)
 
@@ -260,7 +279,30 @@ def video_frames_to_reference(rec: str, sync: pd.DataFrame, fr_idxs: list[int]|l
     fr_idx = video_utils.timestamps_to_frame_number(this_video_ts_ref, video_ts_ref, trim=True)['frame_idx'].to_numpy(copy=True)
     fr_idx[this_video_ts_ref<video_ts_ref[0]] = -1
     # NB: no need to check for timestamps beyond the reference video's end here; trim=True already ensures that these are marked as invalid.
+    return fr_idx
+
+@overload
+def reference_frames_to_video(rec: str, sync: pd.DataFrame, fr_idxs: list[int], video_ts: list[float]|np.ndarray, video_ts_ref: list[float]|np.ndarray, do_time_stretch: bool, stretch_which: str, rec_dir: str|pathlib.Path|None=None) -> list[int]: ...
+@overload
+def reference_frames_to_video(rec: str, sync: pd.DataFrame, fr_idxs: list[list[int]], video_ts: list[float]|np.ndarray, video_ts_ref: list[float]|np.ndarray, do_time_stretch: bool, stretch_which: str, rec_dir: str|pathlib.Path|None=None) -> list[list[int]]: ...
+def reference_frames_to_video(rec: str, sync: pd.DataFrame, fr_idxs: list[int]|list[list[int]], this_video_ts: list[float]|np.ndarray, video_ts_ref: list[float]|np.ndarray, do_time_stretch: bool, stretch_which: str, rec_dir: str|pathlib.Path|None=None) -> list[int]|list[list[int]]:
+    if not fr_idxs:
+        return []
+
+    # NB: rec_dir is the working directory of the recording, where the frame maps stored by SYNC_TO_REFERENCE are looked for
+    fr_idx_ref = _get_frame_map(rec, sync, this_video_ts, video_ts_ref, do_time_stretch, stretch_which, rec_dir, to_reference=False)
+    return fr_idx_ref[fr_idxs].tolist()
+
+@overload
+def video_frames_to_reference(rec: str, sync: pd.DataFrame, fr_idxs: list[int], video_ts: list[float]|np.ndarray, video_ts_ref: list[float]|np.ndarray, do_time_stretch: bool, stretch_which: str, rec_dir: str|pathlib.Path|None=None) -> list[int]: ...
+@overload
+def video_frames_to_reference(rec: str, sync: pd.DataFrame, fr_idxs: list[list[int]], video_ts: list[float]|np.ndarray, video_ts_ref: list[float]|np.ndarray, do_time_stretch: bool, stretch_which: str, rec_dir: str|pathlib.Path|None=None) -> list[list[int]]: ...
+def video_frames_to_reference(rec: str, sync: pd.DataFrame, fr_idxs: list[int]|list[list[int]], this_video_ts: list[float]|np.ndarray, video_ts_ref: list[float]|np.ndarray, do_time_stretch: bool, stretch_which: str, rec_dir: str|pathlib.Path|None=None) -> list[int]|list[list[int]]:
+    if not fr_idxs:
+        return []
 
+    # NB: rec_dir is the working directory of the recording, where the frame maps stored by SYNC_TO_REFERENCE are looked for
+    fr_idx = _get_frame_map(rec, sync, this_video_ts, video_ts_ref, do_time_stretch, stretch_which, rec_dir, to_reference=True)
     return fr_idx[fr_idxs].tolist()
 
 @overload
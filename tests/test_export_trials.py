@@ -0,0 +1,205 @@
+# Regression tests for the trial and gaze offset exports. Trial numbers used to be assigned by looping over the
+# episodes, and the exports were made with pandas. The exports of a synthetic session are compared to the files in
+# data/export_trials, which were made with that original pandas implementation
+import pathlib
+import types
+import numpy as np
+import pandas as pd
+import polars as pl
+import pytest
+from hypothesis import given, settings, strategies as st
+
+from glassesTools import annotation, naming as gt_naming
+
+from gazeMapper import naming
+from gazeMapper.process import export_trials
+
+
+_expected_dir = pathlib.Path(__file__).parent / 'data' / 'export_trials'
+
+
+def _get_trial_numbers_old(frame_idxs: np.ndarray, episodes: list[list[int]]) -> np.ndarray:
+    # original implementation in export_plane_gaze() and export_gaze_offsets()
+    df = pd.DataFrame({'frame_idx': frame_idxs})
+    df.insert(1,'trial',np.int32(-1))
+    for i,e in enumerate(episodes):
+        sel = (df['frame_idx'] >= e[0]) & (df['frame_idx'] <= e[1])
+        df.loc[sel,'trial'] = i+1
+    return df['trial'].to_numpy()
+
+@st.composite
+def _episodes_and_frames(draw):
+    # non-overlapping episodes of one frame or longer, in order of occurrence as in a coding file
+    n_ep   = draw(st.integers(1, 8))
+    starts = sorted(draw(st.lists(st.integers(0, 2000), min_size=n_ep, max_size=n_ep, unique=True)))
+    ends   = [draw(st.integers(s, n-1)) for s,n in zip(starts, starts[1:]+[2100])]
+    frames = np.array(draw(st.lists(st.integers(-10, 2200), max_size=300)), dtype='int64')
+    return [[s,e] for s,e in zip(starts,ends)], frames
+
+
+@settings(max_examples=300, deadline=None)
+@given(data=_episodes_and_frames())
+def test_trial_numbers_same_as_old(data):
+    episodes, frames = data
+    new = export_trials._get_trial_numbers(frames, episodes)
+    assert new.dtype==np.int32
+    np.testing.assert_array_equal(new, _get_trial_numbers_old(frames, episodes))
+
+
+@settings(max_examples=100, deadline=None)
+@given(data=_episodes_and_frames(), seed=st.integers(0, 2**32-1))
+def test_trial_numbers_unordered_episodes(data, seed: int):
+    # trial numbers follow the order of the episode list, not the order in time
+    episodes, frames = data
+    episodes = [episodes[i] for i in np.random.default_rng(seed).permutation(len(episodes))]
+    np.testing.assert_array_equal(export_trials._get_trial_numbers(frames, episodes), _get_trial_numbers_old(frames, episodes))
+
+
+@st.composite
+def _overlapping_episodes_and_frames(draw):
+    # episodes that may overlap or contain each other, in any order
+    episodes = []
+    for _ in range(draw(st.integers(1, 8))):
+        s = draw(st.integers(0, 2000))
+        episodes.append([s, draw(st.integers(s, s+300))])
+    frames = np.array(draw(st.lists(st.integers(-10, 2400), max_size=300)), dtype='int64')
+    return episodes, frames
+
+
+@settings(max_examples=300, deadline=None)
+@given(data=_overlapping_episodes_and_frames())
+def test_trial_numbers_overlapping_episodes(data):
+    # frames in multiple episodes get the number of the last of those episodes in the list
+    episodes, frames = data
+    np.testing.assert_array_equal(export_trials._get_trial_numbers(frames, episodes), _get_trial_numbers_old(frames, episodes))
+
+
+def test_trial_numbers_overlap_last_wins():
+    frames = np.arange(0, 40, 5)
+    np.testing.assert_array_equal(export_trials._get_trial_numbers(frames, [[10,30],[0,15],[20,20]]), [2, 2, 2, 2, 3, 1, 1, -1])
+
+
+# synthetic session: a recording with two planes, and a reference recording it is synced to
+_episodes = {
+    'trial'        : (annotation.EventType.Trial   , [[10,30],[45,70],[100,115]]),
+    'trial_short'  : (annotation.EventType.Trial   , [[0,12]]),
+    'trial_none'   : (annotation.EventType.Trial   , []),
+    'validate'     : (annotation.EventType.Validate, [[20,35],[95,100]]),
+    'validate_ref' : (annotation.EventType.Validate, [[120,160]]),
+}
+# NB: planes of the first event are in a list instead of a set, so that the order of the plane columns is stable
+_coding_setup = [
+    {'name': 'trial'       , 'event_type': annotation.EventType.Trial   , 'planes': ['plane1','plane2'], 'which_recordings': set()},
+    {'name': 'trial_short' , 'event_type': annotation.EventType.Trial   , 'planes': {'plane1'}, 'which_recordings': set()},
+    {'name': 'trial_none'  , 'event_type': annotation.EventType.Trial   , 'planes': {'plane2'}, 'which_recordings': set()},
+    {'name': 'validate'    , 'event_type': annotation.EventType.Validate, 'planes': set(), 'gaze_offset_setup': {'plane1': {}, 'plane2': {}}, 'which_recordings': set()},
+    {'name': 'validate_ref', 'event_type': annotation.EventType.Validate, 'planes': set(), 'gaze_offset_setup': {'plane1': {}}, 'which_recordings': {'ref'}},
+]
+
+class _EpisodeGraph:
+    def get_episodes_with_info(self, rec: str, episode_subset: set[str]|None, *args):
+        return {e:v for e,v in _episodes.items() if episode_subset is None or e in episode_subset}, set(), {}, {}
+
+def _write_tsv(df: pd.DataFrame, file: pathlib.Path):
+    df.to_csv(file, sep='\t', na_rep='nan', index=False)
+
+def _make_session(working_dir: pathlib.Path):
+    (working_dir / 'rec').mkdir(parents=True)
+    (working_dir / 'ref').mkdir()
+    # frame timestamps: recording at 25 Hz, reference at 50 Hz. The reference recording is shorter, so that some
+    # samples have no reference frame
+    fr = np.arange(120)
+    _write_tsv(pd.DataFrame({'frame_idx': fr, 'timestamp': fr*40.}), working_dir / 'rec' / gt_naming.frame_timestamps_fname)
+    fr = np.arange(230)
+    _write_tsv(pd.DataFrame({'frame_idx': fr, 'timestamp': fr*20., 'timestamp_stretched': fr*20.02}), working_dir / 'ref' / gt_naming.frame_timestamps_fname)
+
+    # two gaze samples per frame, the second plane misses every 7th frame
+    fr = np.repeat(np.arange(120), 2)
+    ts = fr*40.+np.tile([0.,20.], 120)
+    s  = np.arange(fr.size)
+    base = pd.DataFrame({'timestamp': ts, 'timestamp_VOR': ts-45., 'timestamp_ref': ts*.999+3., 'frame_idx': fr, 'frame_idx_VOR': fr-2, 'frame_idx_ref': 2*fr+1})
+    for i,p in enumerate(('plane1','plane2')):
+        df = base.copy()
+        df['gazePosCamWorld_x'] = np.round(np.sin(s/10.+i)*100., 3)
+        df['gazePosCamWorld_y'] = np.round(np.cos(s/10.+i)*50., 3)
+        df['gazePosCamWorld_z'] = 600.+i
+        df['gazePosPlane2D_vidPos_ray_x'] = np.round(np.sin(s/7.+i)*80., 3)
+        df['gazePosPlane2D_vidPos_ray_y'] = np.round(np.cos(s/7.+i)*40., 3)
+        df.loc[s%11==3, ['gazePosPlane2D_vidPos_ray_x','gazePosPlane2D_vidPos_ray_y']] = np.nan
+        if p=='plane2':
+            df = df[fr%7!=0]
+        _write_tsv(df, working_dir / 'rec' / f'{naming.world_gaze_prefix}{p}.tsv')
+
+        # gaze offsets, one target per plane
+        df = base[['timestamp','timestamp_ref','frame_idx','frame_idx_ref']].copy()
+        df['episode'] = pd.Series(None, index=df.index, dtype='object')
+        df.loc[df['frame_idx'].between(20,35) | df['frame_idx'].between(95,100), 'episode'] = 'validate'
+        if p=='plane1':
+            df.loc[df['frame_idx_ref'].between(120,160), 'episode'] = 'validate_ref'
+        df = df[df['episode'].notna()].copy()
+        ds = np.arange(len(df))
+        df[f'offset_target_{i+1}_pose_vidpos_ray']   = np.round(np.abs(np.sin(ds/5.))+.1*i, 4)
+        df[f'offset_x_target_{i+1}_pose_vidpos_ray'] = np.round(np.sin(ds/5.), 4)
+        df[f'offset_y_target_{i+1}_pose_vidpos_ray'] = np.round(np.cos(ds/5.)*.1, 4)
+        _write_tsv(df, working_dir / 'rec' / f'{naming.gaze_offset_prefix}{p}.tsv')
+
+def _study_config():
+    return types.SimpleNamespace(coding_setup=_coding_setup, sync_ref_recording='ref', individual_markers=[])
+
+_plane_gaze_cases = {
+    'plane_gaze'        : dict(),
+    'plane_gaze_3D_only': dict(include_unit_header_row=False, include_2D=False, include_3D=True),
+}
+_cases = [*_plane_gaze_cases, 'gaze_offsets']
+
+def _export(case: str, working_dir: pathlib.Path, export_path: pathlib.Path):
+    export_path.mkdir()
+    if case in _plane_gaze_cases:
+        export_config = export_trials.PlaneGaze(True, True, [working_dir.name], ['rec'], include_head_ref_gaze=False, include_markers=False, **_plane_gaze_cases[case])
+        export_trials.export_plane_gaze(export_path, working_dir, _study_config(), export_config, _EpisodeGraph())
+    else:
+        export_config = export_trials.GazeOffset(True, True, [working_dir.name], ['rec'])
+        export_trials.export_gaze_offsets(export_path, working_dir, _study_config(), export_config, _EpisodeGraph())
+
+def _read_export(file: pathlib.Path, n_header_rows: int) -> tuple[list[str], pd.DataFrame]:
+    # header rows as text, data parsed so that the comparison does not depend on how floats are formatted
+    with open(file, encoding='utf-8') as f:
+        header = [f.readline() for _ in range(n_header_rows)]
+    return header, pd.read_csv(file, sep='\t', skiprows=n_header_rows, header=None)
+
+
+@pytest.mark.parametrize('case', _cases)
+def test_export_same_as_old(case: str, tmp_path: pathlib.Path):
+    working_dir = tmp_path / 'session'
+    _make_session(working_dir)
+    _export(case, working_dir, tmp_path / 'export')
+
+    n_header_rows = 2 if _plane_gaze_cases.get(case, {}).get('include_unit_header_row', True) else 1
+    expected = sorted(f.name for f in (_expected_dir / case).iterdir())
+    assert sorted(f.name for f in (tmp_path / 'export').iterdir())==expected
+    for f in expected:
+        exp_header, exp = _read_export(_expected_dir / case / f, n_header_rows)
+        header, df = _read_export(tmp_path / 'export' / f, n_header_rows)
+        assert header==exp_header, f
+        pd.testing.assert_frame_equal(df, exp, obj=f)
+
+
+def _outer_join_old(frames: list[pl.LazyFrame]) -> pl.DataFrame:
+    # previous implementation: successive full joins, each followed by a sort
+    df = frames[0]
+    for other in frames[1:]:
+        on = [c for c in df.collect_schema().names() if c in other.collect_schema().names()]
+        df = df.join(other, on=on, how='full', coalesce=True).sort(on, nulls_last=True, maintain_order=True)
+    return df.collect()
+
+def test_outer_join_same_as_old():
+    # head-referenced gaze, and plane gaze for two planes that each miss some samples
+    ts = np.arange(60)*20.+7.
+    fr = np.arange(60)//2
+    head  = pl.LazyFrame({'timestamp': ts, 'timestamp_VOR': ts-3., 'frame_idx': fr, 'frame_idx_VOR': fr-1, 'gaze_pos_vid_x': ts/3.})
+    planes = [pl.LazyFrame({'timestamp': ts[sel], 'timestamp_VOR': ts[sel]-3., 'frame_idx': fr[sel], 'frame_idx_VOR': fr[sel]-1, f'gazePos_plane{i}_x': ts[sel]/5.+i})
+              for i,sel in enumerate((np.arange(60)%7!=0, np.arange(60)%5!=0))]
+    for frames in (planes, [head.join(pl.concat([df.select('frame_idx') for df in planes]).unique(), on='frame_idx', how='semi', maintain_order='left'), *planes]):
+        new = export_trials._outer_join(frames).collect()
+        assert new.columns==_outer_join_old(frames).columns
+        assert new.equals(_outer_join_old(frames))
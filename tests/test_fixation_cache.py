@@ -0,0 +1,40 @@
+# Tests the keys of the cached fixation classification results, which should only change for the classification
+# intervals whose inputs changed
+import pathlib
+import numpy as np
+import pandas as pd
+
+from gazeMapper.process import _fixation_cache
+
+
+_intervals = [[0, 20], [30, 100], [200, -1]]
+
+def _write_plane_gaze(file: pathlib.Path, n_samples: int=500, changed_frame: int|None=None):
+    fr = np.arange(n_samples)//2
+    x  = np.sin(np.arange(n_samples)/10.)
+    if changed_frame is not None:
+        x[fr==changed_frame] += 1.
+    pd.DataFrame({'timestamp': np.arange(n_samples)*4., 'frame_idx': fr, 'gazePosPlane2D_vidPos_ray_x': x, 'gazePosPlane2D_vidPos_ray_y': np.cos(np.arange(n_samples)/10.)}).to_csv(file, sep='\t', index=False)
+
+
+def test_keys(tmp_path: pathlib.Path):
+    file = tmp_path / 'planeGaze_plane.tsv'
+    _write_plane_gaze(file)
+    keys = _fixation_cache.get_keys(file, _intervals, None, [[0., 1.], [0., 1.]])
+    assert len(set(keys))==len(_intervals)
+    assert _fixation_cache.get_keys(file, _intervals[1:], None, [[0., 1.], [0., 1.]])==keys[1:]
+
+    # changed samples only change the key of the interval they are in
+    _write_plane_gaze(file, changed_frame=50)
+    changed = _fixation_cache.get_keys(file, _intervals, None, [[0., 1.], [0., 1.]])
+    assert [k==c for k,c in zip(keys,changed)]==[True, False, True]
+
+    # extra samples at the end are part of the last interval, which runs until the end of the recording
+    _write_plane_gaze(file, n_samples=520)
+    extended = _fixation_cache.get_keys(file, _intervals, None, [[0., 1.], [0., 1.]])
+    assert [k==e for k,e in zip(keys,extended)]==[True, True, False]
+
+    # settings change all keys
+    _write_plane_gaze(file)
+    assert not set(keys) & set(_fixation_cache.get_keys(file, _intervals, {'windowtime': .2}, [[0., 1.], [0., 1.]]))
+    assert not set(keys) & set(_fixation_cache.get_keys(file, _intervals, None, [[0., 2.], [0., 1.]]))
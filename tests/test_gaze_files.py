@@ -0,0 +1,36 @@
+# Tests reading gaze data along with the synchronization columns stored in sidecar files
+import pathlib
+import numpy as np
+import pandas as pd
+import pytest
+
+from glassesTools import naming as gt_naming
+
+from gazeMapper.process import _gaze_files
+
+
+def _write_gaze(rec_dir: pathlib.Path, n: int):
+    ts = np.arange(n)*20.
+    pd.DataFrame({'timestamp': ts, 'frame_idx': np.arange(n)//2, 'gaze_pos_vid_x': ts/10., 'gaze_pos_vid_y': ts/20.}).to_csv(rec_dir / gt_naming.gaze_data_fname, sep='\t', index=False)
+    return ts
+
+
+def test_read_timestamps(tmp_path: pathlib.Path):
+    ts = _write_gaze(tmp_path, 50)
+    np.testing.assert_array_equal(_gaze_files.read_timestamps(tmp_path, ['VOR', '']), ts)
+    _gaze_files.write_sync_columns(tmp_path, 'VOR', ts+12.5, np.round((ts+12.5)/40.).astype('int'))
+    np.testing.assert_allclose(_gaze_files.read_timestamps(tmp_path, ['VOR', '']), ts+12.5)
+    np.testing.assert_array_equal(_gaze_files.read_timestamps(tmp_path, ['']), ts)
+
+
+def test_stale_sync_columns(tmp_path: pathlib.Path):
+    # gaze data imported again after synchronization, with a different number of samples
+    ts = _write_gaze(tmp_path, 50)
+    _gaze_files.write_sync_columns(tmp_path, 'VOR', ts+12.5, np.round((ts+12.5)/40.).astype('int'))
+    _write_gaze(tmp_path, 60)
+    with pytest.raises(RuntimeError, match='Rerun the synchronization'):
+        _gaze_files.read_timestamps(tmp_path, ['VOR', ''])
+    with pytest.raises(RuntimeError, match='Rerun the synchronization'):
+        _gaze_files.read_dataframe(tmp_path)
+    with pytest.raises(RuntimeError, match='Rerun the synchronization'):
+        _gaze_files.scan_dataframe(tmp_path).collect()
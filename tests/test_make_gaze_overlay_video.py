@@ -0,0 +1,46 @@
+# Tests that a segment of the gaze overlay video reads the same frames when the video is opened at the start of the
+# segment, as when the video is read from the start
+import pathlib
+import cv2
+import numpy as np
+import pandas as pd
+import pytest
+
+from glassesTools import naming as gt_naming, ocv, timestamps
+
+from gazeMapper.process import make_gaze_overlay_video
+
+
+_n_frames = 150
+
+@pytest.fixture(scope='module')
+def video(tmp_path_factory: pytest.TempPathFactory) -> tuple[pathlib.Path, timestamps.VideoTimestamps]:
+    path = tmp_path_factory.mktemp('video')
+    writer = cv2.VideoWriter(str(path / 'video.mp4'), cv2.VideoWriter_fourcc(*'mp4v'), 25, (64,48))
+    for i in range(_n_frames):
+        frame = np.zeros((48,64,3), np.uint8)
+        cv2.putText(frame, str(i), (2,30), cv2.FONT_HERSHEY_SIMPLEX, .6, (255,255,255), 1)
+        writer.write(frame)
+    writer.release()
+    pd.DataFrame({'frame_idx': np.arange(_n_frames), 'timestamp': np.arange(_n_frames)*40.+12.}).to_csv(path / gt_naming.frame_timestamps_fname, sep='\t', index=False)
+    return path / 'video.mp4', timestamps.VideoTimestamps(path / gt_naming.frame_timestamps_fname)
+
+
+@pytest.mark.parametrize('start', [0, 10, 25, 26, 77, 140, _n_frames-1])
+def test_open_video_at(video: tuple[pathlib.Path, timestamps.VideoTimestamps], start: int):
+    in_video, video_ts = video
+    expected = ocv.CV2VideoReader(in_video, video_ts.timestamps)
+    reader   = make_gaze_overlay_video._open_video_at(in_video, video_ts, start)
+    if start>25:
+        # positioned without reading all frames before
+        assert 0<reader.frame_idx<=start
+    wanted_frame_idx = start
+    while True:
+        should_exit, frame, frame_idx, frame_ts = reader.read_frame(wanted_frame_idx=wanted_frame_idx)
+        exp = expected.read_frame(wanted_frame_idx=wanted_frame_idx)
+        wanted_frame_idx = None
+        assert should_exit==exp[0]
+        if should_exit:
+            break
+        assert (frame_idx, frame_ts)==exp[2:]
+        np.testing.assert_array_equal(frame, exp[1])
@@ -0,0 +1,96 @@
+# Tests reuse of the gaze on planes stored by GAZE_TO_PLANE, drawing on scaled frames, and adding audio while
+# writing, when making the mapped gaze video
+import pathlib
+import subprocess
+import numpy as np
+import pandas as pd
+import pytest
+
+from glassesTools import gaze_worldref, naming as gt_naming, ocv, transforms
+
+from gazeMapper import naming
+from gazeMapper.process import _ffmpeg, _gaze_files, _video_writer, make_mapped_gaze_video
+
+
+def _make_recording(rec_dir: pathlib.Path, vor_offset: float|None):
+    # gaze data at 50 Hz for a 25 Hz scene camera, optionally VOR-synced with a time shift that is not a multiple of
+    # the sampling interval. The plane gaze file is written like GAZE_TO_PLANE does, from gaze read with the
+    # VOR-synced timestamps if available
+    rec_dir.mkdir()
+    ts = np.arange(100)*20.+3.
+    fr = np.arange(100)//2
+    pd.DataFrame({'timestamp': ts, 'frame_idx': fr, 'gaze_pos_vid_x': ts/10., 'gaze_pos_vid_y': ts/20.}).to_csv(rec_dir / gt_naming.gaze_data_fname, sep='\t', index=False)
+    if vor_offset is not None:
+        _gaze_files.write_sync_columns(rec_dir, 'VOR', ts+vor_offset, np.round((ts+vor_offset)/40.).astype('int'))
+    gazes_head = _gaze_files.read_dict_from_file(rec_dir, ts_column_suffixes=['VOR', ''])[0]
+    # plane gaze for all but the first frame
+    plane_gazes = [gaze_worldref.Gaze(g.timestamp, g.frame_idx, g.timestamp_ori, g.frame_idx_ori, g.timestamp_VOR, g.frame_idx_VOR, gazePosPlane2D_vidPos_ray=np.array([g.timestamp_ori, 1.]))
+                   for f in gazes_head for g in gazes_head[f] if g.frame_idx_ori>0]
+    gaze_worldref.write_dict_to_file(plane_gazes, rec_dir / f'{naming.world_gaze_prefix}plane.tsv')
+
+
+@pytest.mark.parametrize('vor_offset', [None, 12.3])
+def test_get_stored_plane_gazes(vor_offset: float|None, tmp_path: pathlib.Path):
+    rec_dir = tmp_path / 'rec'
+    _make_recording(rec_dir, vor_offset)
+    # as read by make_mapped_gaze_video
+    gazes_head = _gaze_files.read_dict_from_file(rec_dir, ts_column_suffixes=['ref', 'VOR', ''])[0]
+    stored = make_mapped_gaze_video._get_stored_plane_gazes(rec_dir, ['plane', 'missing_plane'], gazes_head)
+
+    assert list(stored)==list(gazes_head)
+    for f in gazes_head:
+        assert len(stored[f])==len(gazes_head[f])
+        for g,s in zip(gazes_head[f],stored[f]):
+            if g.frame_idx_ori==0:
+                assert not s
+            else:
+                assert list(s)==['plane']
+                assert s['plane'].gazePosPlane2D_vidPos_ray[0]==pytest.approx(g.timestamp_ori)
+
+
+@pytest.mark.parametrize('distort_coeffs', [np.zeros(5), np.array([-.3, .1, .001, -.002, 0.])])
+def test_scale_camera_params(distort_coeffs: np.ndarray):
+    # projecting with camera parameters for the scaled frame gives the scaled position in the video frame
+    camera_params = ocv.CameraParams(np.array([1920, 1080]), np.array([[1100., 0., 955.], [0., 1105., 545.], [0., 0., 1.]]), distort_coeffs)
+    out_size = (960, 540)
+    scaled = make_mapped_gaze_video._scale_camera_params(camera_params, out_size)
+    scale = np.array(out_size)/camera_params.resolution
+    points = np.array([[0., 0., 500.], [-120., 80., 600.], [300., -150., 450.]])
+    expected = make_mapped_gaze_video._scale_point(transforms.project_points(points, camera_params), scale)
+    np.testing.assert_allclose(transforms.project_points(points, scaled), expected, atol=1e-6)
+    # unscaled and uncalibrated cameras need no change
+    assert make_mapped_gaze_video._scale_camera_params(camera_params, (1920, 1080)) is camera_params
+    assert not make_mapped_gaze_video._scale_camera_params(ocv.CameraParams(None, None), out_size).has_intrinsics()
+
+
+@pytest.mark.skipif(not _ffmpeg.is_available(), reason='ffmpeg not available')
+@pytest.mark.parametrize('stride', [1, 2])
+def test_write_with_audio(stride: int, tmp_path: pathlib.Path):
+    # frames are piped to ffmpeg, which adds the audio while writing. With a frame stride, the skipped frames are
+    # filled in so that the video has the same duration
+    audio_file = tmp_path / 'audio.m4a'
+    subprocess.run(['ffmpeg', '-loglevel', 'error', '-f', 'lavfi', '-i', 'sine=frequency=440:duration=3', str(audio_file)], check=True)
+    out_file = tmp_path / 'video.mp4'
+    out_opts = {'pix_fmt_in':'bgr24', 'pix_fmt_out':'yuv420p', 'codec':'libx264', 'width_in':64, 'height_in':48, 'frame_rate':(25,1)}
+    audio_args = ['-i', str(audio_file), '-map', '0:v:0', '-map', '1:a:0?', '-shortest']
+    writer = _video_writer.QueuedVideoWriter(out_file, out_opts, 4, {'preset': 'ultrafast'}, audio_args)
+    frame = np.zeros((48,64,3), np.uint8)
+    for i in range(0,49,stride):
+        frame[:] = i*5
+        writer.write_frame(frame, pts=i/25)
+    writer.close()
+
+    assert _ffmpeg.has_audio(out_file)
+    command = ['ffprobe', '-loglevel', 'error', '-count_frames', '-select_streams', 'v', '-show_entries', 'stream=nb_read_frames', '-of', 'csv=p=0', str(out_file)]
+    assert int(subprocess.run(command, check=True, stdout=subprocess.PIPE).stdout)==49
+
+
+@pytest.mark.skipif(not _ffmpeg.is_available(), reason='ffmpeg not available')
+def test_write_with_audio_failure(tmp_path: pathlib.Path):
+    # ffmpeg errors are raised
+    out_opts = {'pix_fmt_in':'bgr24', 'pix_fmt_out':'yuv420p', 'codec':'libx264', 'width_in':64, 'height_in':48, 'frame_rate':(25,1)}
+    writer = _video_writer.QueuedVideoWriter(tmp_path / 'video.mp4', out_opts, 4, None, ['-i', str(tmp_path / 'missing.m4a'), '-map', '0:v:0', '-map', '1:a:0'])
+    with pytest.raises(RuntimeError, match='missing.m4a'):
+        for i in range(10):
+            writer.write_frame(np.zeros((48,64,3), np.uint8), pts=i/25)
+        writer.close()
@@ -0,0 +1,88 @@
+# Tests reading marker presence from the presence index written by DETECT_MARKERS, and from the marker detection
+# files it falls back to
+import os
+import pathlib
+import types
+import cv2
+import numpy as np
+import pandas as pd
+import pytest
+
+from glassesTools import marker as gt_marker
+
+from gazeMapper.process import _marker_presence
+
+
+_dict_id = cv2.aruco.DICT_4X4_250
+# marker -> frames in which it was detected. Marker 4 was never detected, so has no detection file
+_detections = {
+    1: [10, 11, 12, 20, 21],
+    2: [12, 13, 14, 15],
+    3: [40, 41, 45],
+    4: [],
+}
+
+
+def _write_detections(working_dir: pathlib.Path, detections: dict[int, list[int]]):
+    markers = {gt_marker.MarkerID(m, _dict_id): [types.SimpleNamespace(frame_idx=f) for f in frs] for m,frs in detections.items()}
+    for m,frs in detections.items():
+        if frs:
+            pd.DataFrame({'frame_idx': frs, 'R_vec_x': 0.}).to_csv(gt_marker.get_file_name(m, _dict_id, working_dir), sep='\t', index=False)
+    return markers
+
+
+@pytest.fixture
+def working_dir(tmp_path: pathlib.Path) -> pathlib.Path:
+    _marker_presence.write_index(tmp_path, _write_detections(tmp_path, _detections))
+    return tmp_path
+
+
+def _check_same(a: _marker_presence.Presence, b: _marker_presence.Presence):
+    assert a.markers==b.markers
+    for m in a.markers:
+        np.testing.assert_array_equal(a.get_frames(m), b.get_frames(m))
+
+
+def test_read_index(working_dir: pathlib.Path):
+    markers = [gt_marker.MarkerID(m, _dict_id) for m in (3,1,2)]
+    presence = _marker_presence.read(markers, working_dir)
+    _check_same(presence, _marker_presence.read_from_files(markers, working_dir))
+    for m in markers:
+        np.testing.assert_array_equal(presence.get_frames(m), _detections[m.m_id])
+
+
+def test_read_stale_index(working_dir: pathlib.Path):
+    # marker detection files written after the index: the index is not used
+    _write_detections(working_dir, {1: [100, 101]})
+    index_file = working_dir / 'markerPresence.npz'
+    os.utime(index_file, (index_file.stat().st_atime, index_file.stat().st_mtime-10))
+    markers = [gt_marker.MarkerID(m, _dict_id) for m in (1,2)]
+    presence = _marker_presence.read(markers, working_dir)
+    np.testing.assert_array_equal(presence.get_frames(markers[0]), [100, 101])
+    np.testing.assert_array_equal(presence.get_frames(markers[1]), _detections[2])
+
+
+def _validation_plane(markers_per_target: dict[int, list[int]]):
+    # the parts of a glassesTools validation.Plane used here
+    return types.SimpleNamespace(dynamic_markers={m: (t, None) for t,ms in markers_per_target.items() for m in ms}, aruco_dict_id=_dict_id)
+
+
+def test_read_validation_targets(working_dir: pathlib.Path):
+    # target 7 is shown with two markers, present when either is. Target 9's marker was never detected
+    presence, markers_per_target = _marker_presence.read_validation_targets(_validation_plane({5: [3], 7: [1,2], 9: [4]}), working_dir, 'validate', missing_ok=True)
+    assert markers_per_target=={5: [gt_marker.MarkerID(3, _dict_id)], 7: [gt_marker.MarkerID(1, _dict_id), gt_marker.MarkerID(2, _dict_id)], 9: [gt_marker.MarkerID(4, _dict_id)]}
+    assert presence.markers==[5, 7]
+    np.testing.assert_array_equal(presence.get_frames(5), [40, 41, 45])
+    np.testing.assert_array_equal(presence.get_frames(7), [10, 11, 12, 13, 14, 15, 20, 21])
+
+    # same format as validation.dynamic.get_marker_observations()
+    expected = gt_marker.code_for_presence(gt_marker.read_dataframe_from_file(1, _dict_id, working_dir).set_index('frame_idx'), allow_failed=True)
+    expected = expected.combine_first(gt_marker.code_for_presence(gt_marker.read_dataframe_from_file(2, _dict_id, working_dir).set_index('frame_idx'), allow_failed=True))
+    observations = _marker_presence.to_observations_per_target(presence)
+    assert list(observations)==[5, 7]
+    pd.testing.assert_frame_equal(observations[7], expected, check_index_type=False)
+
+
+def test_read_validation_targets_missing(working_dir: pathlib.Path):
+    with pytest.raises(FileNotFoundError):
+        _marker_presence.read_validation_targets(_validation_plane({5: [3], 9: [4]}), working_dir, 'validate')
@@ -0,0 +1,62 @@
+# Tests the fixation classification of the validation, which stores the gaze data shown in the fixation plot so that
+# the plot can be made later without rerunning the classification. Output should be the same as that of
+# glassesTools.fixation_classification.from_plane_gaze()
+import pathlib
+import numpy as np
+import pandas as pd
+import pytest
+
+import I2MC
+from glassesTools import fixation_classification, gaze_worldref
+
+from gazeMapper.process import _fixation_classification
+
+
+def _make_plane_gaze(signals: set[str]) -> dict[int, list[gaze_worldref.Gaze]]:
+    # 10 s of 50 Hz gaze data, fixating a new position every second, with some data loss
+    rng = np.random.default_rng(1)
+    ts  = np.arange(500)*20.
+    pos = np.repeat(rng.uniform(-200., 200., (10,2)), 50, axis=0)+rng.normal(0., 1., (500,2))
+    pos[120:130] = np.nan
+    nan = np.full(2, np.nan)
+    gazes = [gaze_worldref.Gaze(t, i//2,
+                                gazePosPlane2DLeft=p-3. if 'binocular' in signals else nan,
+                                gazePosPlane2DRight=p+3. if 'binocular' in signals else nan,
+                                gazePosPlane2D_vidPos_ray=p if 'ray' in signals else nan,
+                                gazePosPlane2D_vidPos_homography=p+5.)
+             for i,(t,p) in enumerate(zip(ts,pos))]
+    out: dict[int, list[gaze_worldref.Gaze]] = {}
+    for g in gazes:
+        out.setdefault(g.frame_idx, []).append(g)
+    return out
+
+
+@pytest.mark.parametrize('signals', [{'ray'}, set(), {'ray','binocular'}])
+def test_same_as_glassesTools(signals: set[str], tmp_path: pathlib.Path, monkeypatch: pytest.MonkeyPatch):
+    gazes       = _make_plane_gaze(signals)
+    interval    = [20, 200]
+    plot_limits = [[-250., 250.], [-250., 250.]]
+
+    # capture what is plotted
+    plotted = []
+    plot = I2MC.plot.data_and_fixations
+    def _capture(data, fix, **kwargs):
+        plotted.append((pd.DataFrame(data), pd.DataFrame(fix)))
+        return plot(data, fix, **kwargs)
+    monkeypatch.setattr(I2MC.plot, 'data_and_fixations', _capture)
+
+    # NB: I2MC's clustering uses numpy's global random state
+    np.random.seed(2)
+    fixation_classification.from_plane_gaze(gazes, [interval], tmp_path, filename_stem='gt', plot_limits=plot_limits)
+    np.random.seed(2)
+    fixations, plot_data = _fixation_classification.classify(gazes, interval, None)
+    _fixation_classification.write_fixations(fixations, tmp_path / 'fixations.tsv')
+    assert (tmp_path / 'fixations.tsv').read_text()==(tmp_path / 'gt_interval_01.tsv').read_text()
+
+    # plot, from the stored data
+    _fixation_classification.write_plot_data(plot_data, tmp_path / 'plot_data.tsv')
+    _fixation_classification.plot(_fixation_classification.read_file(tmp_path / 'fixations.tsv'), _fixation_classification.read_file(tmp_path / 'plot_data.tsv'), plot_limits, tmp_path / 'fixations.png')
+    assert (tmp_path / 'fixations.png').is_file()
+    (exp_data, exp_fix), (data, fix) = plotted
+    pd.testing.assert_frame_equal(data, exp_data[['time','average_X','average_Y']], check_dtype=False)
+    pd.testing.assert_frame_equal(fix[['startT','endT','xpos','ypos']], exp_fix[['startT','endT','xpos','ypos']], check_dtype=False, atol=1e-3)
@@ -0,0 +1,172 @@
+# Compares synchronization.apply_sync against the implementation it replaced, which looped over all sync intervals
+# and selected the timestamps falling in each with a boolean mask. Both should give identical results, except for
+# data timestamps that fall exactly on an interior sync point when stretch_which=='ref' (see test_ref_on_sync_point)
+import numpy as np
+import pandas as pd
+import pytest
+from hypothesis import given, settings, strategies as st, HealthCheck
+
+from glassesTools import video_utils
+
+from gazeMapper import synchronization
+
+
+def _apply_sync_old(rec: str, sync: pd.DataFrame, data_timestamps: np.ndarray|None, reference_video_timestamps: np.ndarray, do_time_stretch, stretch_which: str):
+    # implementation of synchronization.apply_sync() before it was vectorized
+    reference_video_timestamps  = np.array(reference_video_timestamps).copy()
+    new_reference_video_timestamps = reference_video_timestamps.copy()
+    rt_start, rt_end            = reference_video_timestamps.min(), reference_video_timestamps.max()
+    if has_data_ts := data_timestamps is not None:
+        data_timestamps     = np.array(data_timestamps).copy()
+        dt_start, dt_end    = data_timestamps.min(), data_timestamps.max()
+        new_data_timestamps = data_timestamps.copy()
+    else:
+        dt_start, dt_end    = None, None
+    num_reference_episodes      = sync.loc[rec].shape[0]
+    if do_time_stretch:
+        rec_sync = sync.loc[rec]
+        for ival in range(num_reference_episodes-1):
+            t_ref_start  = rec_sync.loc[ival,'t_ref' ]*1000.
+            t_ref_end    = rec_sync.loc[ival+1,'t_ref' ]*1000.
+            t_this_start = rec_sync.loc[ival,'t_this']*1000.
+            t_this_end   = rec_sync.loc[ival+1,'t_this']*1000.
+            stretch_fac  = rec_sync.loc[ival,'stretch_fac']
+            if ival==0:
+                d_start = dt_start
+                r_start = rt_start
+            else:
+                d_start = t_this_start
+                r_start = t_ref_start
+            if ival==num_reference_episodes-2:
+                d_end = dt_end
+                r_end = rt_end
+            else:
+                d_end = t_this_end
+                r_end = t_ref_end
+            if stretch_which=='ref':
+                if has_data_ts:
+                    data_sel = (data_timestamps >= d_start) & (data_timestamps <= d_end)
+                    new_data_timestamps[data_sel] += rec_sync.loc[ival,'offset']*1000.
+                ref_sel = (reference_video_timestamps >= r_start) & (reference_video_timestamps <= r_end)
+                new_reference_video_timestamps[ref_sel] = (reference_video_timestamps[ref_sel]-t_ref_start)*(1-stretch_fac)+t_ref_start
+            elif stretch_which=='other':
+                if has_data_ts:
+                    data_sel = (data_timestamps >= d_start) & (data_timestamps <= d_end)
+                    new_data_timestamps[data_sel] = t_ref_start+(data_timestamps[data_sel]-t_this_start)/(1-stretch_fac)
+    else:
+        if has_data_ts:
+            new_data_timestamps += sync.loc[(rec,0),'mean_off']*1000.
+    if has_data_ts:
+        fr_ref = video_utils.timestamps_to_frame_number(new_data_timestamps,new_reference_video_timestamps,trim=True)['frame_idx'].to_numpy(copy=True)
+    else:
+        new_data_timestamps = None
+        fr_ref = None
+    return new_data_timestamps, new_reference_video_timestamps, fr_ref
+
+
+def _make_sync(t_this: list[float], offsets: list[float], rec='rec') -> pd.DataFrame:
+    # sync table as made by synchronization.get_sync_for_recs() for a single recording, times in s
+    index = pd.MultiIndex.from_product([[rec], range(len(t_this))], names=['recording','interval'])
+    sync  = pd.DataFrame(columns=['t_ref','t_this','offset','t_ref_elapsed','diff_offset','stretch_fac','mean_off'], dtype=float, index=index)
+    for i,(t,o) in enumerate(zip(t_this,offsets)):
+        sync.loc[(rec,i),'t_ref']  = t+o
+        sync.loc[(rec,i),'t_this'] = t
+        sync.loc[(rec,i),'offset'] = o
+    for i in range(len(t_this)-1):
+        sync.loc[(rec,i),'t_ref_elapsed'] = sync.loc[(rec,i+1),'t_ref' ]-sync.loc[(rec,i),'t_ref' ]
+        sync.loc[(rec,i),'diff_offset']   = sync.loc[(rec,i+1),'offset']-sync.loc[(rec,i),'offset']
+        sync.loc[(rec,i),'stretch_fac']   = sync.loc[(rec,i),'diff_offset']/sync.loc[(rec,i),'t_ref_elapsed']
+    sync.loc[(rec,0),'mean_off'] = sync.loc[(rec,slice(None)),'offset'].mean()
+    return sync
+
+
+@st.composite
+def _sync_setups(draw):
+    # a recording of up to 60 s with 1-6 sync points, drifting by up to 5% relative to the reference
+    n_sync  = draw(st.integers(1, 6))
+    t_this  = [draw(st.floats(1., 5.))]
+    for _ in range(1,n_sync):
+        t_this.append(t_this[-1]+draw(st.floats(.5, 10.)))
+    offsets = [draw(st.floats(-2., 2.))]
+    for i in range(1,n_sync):
+        offsets.append(offsets[-1]+draw(st.floats(-.05, .05))*(t_this[i]-t_this[i-1]))
+    sync    = _make_sync(t_this, offsets)
+    data_ts = np.sort(draw(st.lists(st.floats(0., 60000.), min_size=2, max_size=200)))
+    ref_ts  = np.arange(0., draw(st.floats(1000., 60000.)), 1000/draw(st.sampled_from([25, 30, 50])))
+    return sync, data_ts, ref_ts
+
+
+def _interior_sync_points(sync: pd.DataFrame, col: str) -> np.ndarray:
+    return sync.loc['rec',col].to_numpy(dtype='float')[1:-1]*1000.
+
+
+def _check_same(new, old):
+    for n,o in zip(new,old):
+        if o is None:
+            assert n is None
+        else:
+            np.testing.assert_array_equal(n, o)
+
+
+@pytest.mark.parametrize('do_time_stretch,stretch_which', [(False,'ref'), (True,'ref'), (True,'other')])
+@settings(max_examples=200, deadline=None, suppress_health_check=[HealthCheck.too_slow])
+@given(setup=_sync_setups())
+def test_same_as_old(do_time_stretch: bool, stretch_which: str, setup):
+    sync, data_ts, ref_ts = setup
+    if do_time_stretch and stretch_which=='ref':
+        # these get a different offset by design, tested below
+        data_ts = data_ts[~np.isin(data_ts, _interior_sync_points(sync, 't_this'))]
+        if data_ts.size<2:
+            return
+    new = synchronization.apply_sync('rec', sync, data_ts, ref_ts, do_time_stretch, stretch_which)
+    old = _apply_sync_old('rec', sync, data_ts, ref_ts, do_time_stretch, stretch_which)
+    _check_same(new, old)
+
+
+@pytest.mark.parametrize('stretch_which', ['ref', 'other'])
+@settings(max_examples=50, deadline=None)
+@given(setup=_sync_setups())
+def test_sync_points_same_as_old(stretch_which: str, setup):
+    # timestamps exactly on the sync points, and reference timestamps only in 'ref' mode
+    sync, _, ref_ts = setup
+    t_this = sync.loc['rec','t_this'].to_numpy(dtype='float')*1000.
+    data_ts = np.concatenate(([0.], t_this if stretch_which=='other' else t_this[[0,-1]], [60000.]))
+    ref_ts  = np.union1d(ref_ts, sync.loc['rec','t_ref'].to_numpy(dtype='float')*1000.)
+    new = synchronization.apply_sync('rec', sync, data_ts, ref_ts, True, stretch_which)
+    old = _apply_sync_old('rec', sync, data_ts, ref_ts, True, stretch_which)
+    _check_same(new, old)
+
+
+@settings(max_examples=50, deadline=None)
+@given(setup=_sync_setups())
+def test_no_data_timestamps(setup):
+    sync, _, ref_ts = setup
+    new_data_ts, new_ref_ts, fr_ref = synchronization.apply_sync('rec', sync, None, ref_ts, True, 'ref')
+    assert new_data_ts is None and fr_ref is None
+    np.testing.assert_array_equal(new_ref_ts, _apply_sync_old('rec', sync, None, ref_ts, True, 'ref')[1])
+
+
+def test_ref_on_sync_point():
+    # Intentional difference from the old implementation: with stretch_which=='ref', a data timestamp exactly on an
+    # interior sync point used to get the offsets of both intervals adjoining that sync point added. Now it gets the
+    # offset of the interval starting at the sync point, like reference timestamps on a sync point always did
+    sync    = _make_sync([10., 20., 30.], [1., 1.5, 1.8])
+    on_sync = 20000.
+    data_ts = np.array([5000., on_sync, 25000.])
+    ref_ts  = np.arange(0., 40000., 40.)
+    new_data_ts, new_ref_ts, _ = synchronization.apply_sync('rec', sync, data_ts, ref_ts, True, 'ref')
+    old_data_ts, old_ref_ts, _ = _apply_sync_old('rec', sync, data_ts, ref_ts, True, 'ref')
+    np.testing.assert_array_equal(new_ref_ts, old_ref_ts)
+    np.testing.assert_array_equal(new_data_ts[[0,2]], old_data_ts[[0,2]])
+    assert new_data_ts[1]==on_sync+1500.
+    assert old_data_ts[1]==on_sync+1000.+1500.
+
+
+@pytest.mark.parametrize('ts,expected', [
+    ([0., 9.99], [0, 0]),
+    ([10.], [1]),           # on the first interior sync point: interval starting there
+    ([15., 20.], [1, 2]),
+    ([30., 100.], [2, 2]),  # the last interval extends to the end of the data, including on and past the last sync point
+])
+def test_get_interval_indices(ts: list[float], expected: list[int]):
+    np.testing.assert_array_equal(synchronization._get_interval_indices(np.array(ts), np.array([0., 10., 20., 30.])), expected)